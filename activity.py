@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Activity module for VPN Telegram Bot
+Write-behind buffer for users' last_activity and username/name refreshes: touches are
+coalesced per user in memory and written in one transaction every ACTIVITY_FLUSH_INTERVAL
+seconds and on shutdown. Losing a few seconds of activity on a crash is acceptable;
+registration itself (database.add_user) stays synchronous.
+"""
+
+import asyncio
+import datetime
+import logging
+from typing import Dict, Optional, Tuple
+
+import async_db
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Profile = Tuple[Optional[str], str, str] # (username, first_name, last_name)
+
+# user_id -> (last activity, latest profile or None if only the activity changed)
+_pending: Dict[int, Tuple[str, Optional[Profile]]] = {}
+_flusher: Optional[asyncio.Task] = None
+
+metrics.FunctionMetric("bot_activity_pending", "Users with buffered activity not yet written", "gauge", lambda: len(_pending))
+
+def touch(user_id: int, profile: Optional[Profile] = None) -> None:
+    """Record activity of a user, optionally with their current username and names."""
+    previous = _pending.get(user_id)
+    if profile is None and previous is not None:
+        profile = previous[1] # Keep a profile refresh that has not been written yet
+    _pending[user_id] = (datetime.datetime.now().isoformat(), profile)
+
+async def flush() -> int:
+    """Write everything buffered so far; returns the number of users written.
+    On a database error the entries go back into the buffer (newer touches win)."""
+    global _pending
+    if not _pending:
+        return 0
+    batch, _pending = _pending, {}
+    activity = [(last_activity, user_id) for user_id, (last_activity, profile) in batch.items() if profile is None]
+    profiles = [(*profile, last_activity, user_id) for user_id, (last_activity, profile) in batch.items() if profile is not None]
+    if await async_db.save_user_activity(activity, profiles):
+        return len(batch)
+    for user_id, (last_activity, profile) in batch.items():
+        newer = _pending.get(user_id)
+        if newer is None:
+            _pending[user_id] = (last_activity, profile)
+        elif newer[1] is None:
+            _pending[user_id] = (newer[0], profile)
+    return 0
+
+async def _flush_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush()
+        except Exception as e:
+            logger.error(f"Failed to flush user activity: {e}")
+
+def start(interval: float = config.ACTIVITY_FLUSH_INTERVAL) -> None:
+    """Start the periodic flush on the running event loop."""
+    global _flusher
+    if _flusher is None:
+        _flusher = asyncio.create_task(_flush_periodically(interval))
+
+async def stop() -> None:
+    """Stop the periodic flush and write what is still buffered."""
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        await asyncio.gather(_flusher, return_exceptions=True)
+        _flusher = None
+    written = await flush()
+    if written:
+        logger.info(f"Flushed buffered activity of {written} users on shutdown")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Async database module for VPN Telegram Bot
+Awaitable façade over database.py. Every call runs on a dedicated thread pool
+so that SQLite reads and commits never block the event loop.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import config
+import database
+import metrics
+
+# Dedicated executor for database work (each worker thread gets its own
+# thread-local connection from database.get_db_connection)
+_executor = ThreadPoolExecutor(
+    max_workers=config.DB_EXECUTOR_WORKERS,
+    thread_name_prefix="db"
+)
+
+def _timed_call(func: Callable[..., Any], queued_at: float, args, kwargs) -> Any:
+    """Run func on a database thread, recording queue wait, latency and errors."""
+    name = func.__name__
+    started = time.perf_counter()
+    metrics.DB_QUEUE_SECONDS.observe(started - queued_at, function=name)
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        metrics.DB_ERRORS.inc(function=name)
+        raise
+    finally:
+        metrics.DB_SECONDS.observe(time.perf_counter() - started, function=name)
+
+async def run(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a synchronous database function on the database executor."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed_call, func, time.perf_counter(), args, kwargs)
+
+def _wrap(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Build an awaitable version of a database.py function."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+def shutdown() -> None:
+    """Wait for in-flight database work and stop the executor."""
+    _executor.shutdown(wait=True)
+
+# --- User Management ---
+add_user = _wrap(database.add_user)
+get_user = _wrap(database.get_user)
+update_user_info = _wrap(database.update_user_info)
+update_user_activity = _wrap(database.update_user_activity)
+save_user_activity = _wrap(database.save_user_activity)
+approve_user = _wrap(database.approve_user)
+reject_user = _wrap(database.reject_user)
+get_all_users = _wrap(database.get_all_users)
+get_pending_users = _wrap(database.get_pending_users)
+get_users_page = _wrap(database.get_users_page)
+increase_credit = _wrap(database.increase_credit)
+decrease_credit = _wrap(database.decrease_credit)
+get_user_cache_stats = _wrap(database.get_user_cache_stats)
+
+# --- Catalog Cache ---
+load_catalog = _wrap(database.load_catalog)
+
+# --- Discount Codes ---
+add_discount_code = _wrap(database.add_discount_code)
+get_discount_code = _wrap(database.get_discount_code)
+use_discount_code = _wrap(database.use_discount_code)
+delete_discount_code = _wrap(database.delete_discount_code)
+get_all_discount_codes = _wrap(database.get_all_discount_codes)
+
+# --- Services ---
+set_service = _wrap(database.set_service)
+get_service = _wrap(database.get_service)
+delete_service = _wrap(database.delete_service)
+get_all_services = _wrap(database.get_all_services)
+
+# --- Service Prices ---
+set_service_price = _wrap(database.set_service_price)
+get_service_price = _wrap(database.get_service_price)
+get_all_service_prices = _wrap(database.get_all_service_prices)
+
+# --- Credit Transfers ---
+add_credit_transfer = _wrap(database.add_credit_transfer)
+transfer_credit = _wrap(database.transfer_credit)
+get_credit_transfers_for_user = _wrap(database.get_credit_transfers_for_user)
+
+# --- Support Messages ---
+add_support_message = _wrap(database.add_support_message)
+get_support_message_by_id = _wrap(database.get_support_message_by_id)
+get_support_messages = _wrap(database.get_support_messages)
+get_support_messages_with_users = _wrap(database.get_support_messages_with_users)
+mark_support_message_answered = _wrap(database.mark_support_message_answered)
+
+# --- Purchase Requests ---
+add_purchase_request = _wrap(database.add_purchase_request)
+get_purchase_request_by_id = _wrap(database.get_purchase_request_by_id)
+get_purchase_requests_by_user = _wrap(database.get_purchase_requests_by_user)
+get_purchase_requests_by_status = _wrap(database.get_purchase_requests_by_status)
+get_purchase_requests_with_users = _wrap(database.get_purchase_requests_with_users)
+get_purchase_requests_page = _wrap(database.get_purchase_requests_page)
+get_purchase_request_ids = _wrap(database.get_purchase_request_ids)
+update_purchase_request_status = _wrap(database.update_purchase_request_status)
+update_purchase_requests_status = _wrap(database.update_purchase_requests_status)
+
+# --- Subscriptions ---
+get_next_subscription_due = _wrap(database.get_next_subscription_due)
+process_due_subscriptions = _wrap(database.process_due_subscriptions)
+
+# --- Broadcast Jobs ---
+create_broadcast_job = _wrap(database.create_broadcast_job)
+set_broadcast_progress_message = _wrap(database.set_broadcast_progress_message)
+get_broadcast_job = _wrap(database.get_broadcast_job)
+get_unfinished_broadcast_jobs = _wrap(database.get_unfinished_broadcast_jobs)
+get_pending_broadcast_recipients = _wrap(database.get_pending_broadcast_recipients)
+record_broadcast_results = _wrap(database.record_broadcast_results)
+finish_broadcast_job = _wrap(database.finish_broadcast_job)
+
+# --- Media file_id Cache ---
+get_media_file_ids = _wrap(database.get_media_file_ids)
+save_media_file_ids = _wrap(database.save_media_file_ids)
+
+# --- Credential Inventory ---
+add_inventory_items = _wrap(database.add_inventory_items)
+claim_inventory_item = _wrap(database.claim_inventory_item)
+release_inventory_item = _wrap(database.release_inventory_item)
+get_inventory_stock = _wrap(database.get_inventory_stock)
+
+# --- Generated Configs ---
+get_generated_config = _wrap(database.get_generated_config)
+save_generated_config = _wrap(database.save_generated_config)
+
+# --- Conversation Persistence ---
+get_persistence_data = _wrap(database.get_persistence_data)
+get_persistence_conversations = _wrap(database.get_persistence_conversations)
+save_persistence_batch = _wrap(database.save_persistence_batch)
+
+# --- Bot Statistics ---
+get_bot_statistics = _wrap(database.get_bot_statistics)
+reconcile_statistics = _wrap(database.reconcile_statistics)
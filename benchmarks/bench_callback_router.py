@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Callback dispatch microbenchmark.
+Compares the previous chain of regex CallbackQueryHandlers (patterns tried in
+registration order, then query.data.split('_') to extract ids) with the
+CallbackRouter dict lookup plus typed argument parsing, on the same set of callbacks.
+
+Usage:
+    python benchmarks/bench_callback_router.py [--iterations 200000] [--json]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Callable, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callback_router import CallbackRouter, callback_data
+
+def _handler(name: str) -> Callable:
+    async def handler(update, context, *args):
+        return name
+    handler.__name__ = name
+    return handler
+
+# Global callback handlers as they were registered in main() before the router:
+# (regex pattern, handler name, how the handler extracted its argument from query.data)
+LEGACY_CHAIN: List[Tuple[str, str, Optional[Callable[[str], tuple]]]] = [
+    ("admin_main_menu", "admin_panel", None),
+    ("admin_manage_users", "admin_manage_users_menu", None),
+    ("admin_manage_services", "admin_manage_services_menu", None),
+    ("admin_discount_codes", "admin_discount_codes_menu", None),
+    ("admin_requests", "admin_requests_menu", None),
+    ("admin_stats", "admin_stats_command", None),
+    ("admin_support", "admin_support_menu", None),
+    ("admin_view_all_users", "view_all_users_command", None),
+    ("admin_view_pending_users", "view_pending_users_command", None),
+    ("admin_approve_user_list", "view_pending_users_command", None),
+    ("admin_add_credit_to_user_list", "admin_add_credit_to_user_list", None),
+    (r"^users_page_", "user_browser_page", lambda d: (lambda p: (p[2], p[3], int(p[4])))(d.split('_'))),
+    (r"^approve_user_", "approve_user_action", lambda d: (int(d.split('_')[2]),)),
+    (r"^reject_user_", "reject_user_action", lambda d: (int(d.split('_')[2]),)),
+    ("admin_view_all_services", "view_all_services_command", None),
+    ("admin_view_all_service_prices", "view_all_service_prices_command", None),
+    ("admin_view_all_discount_codes", "view_all_discount_codes_command", None),
+    ("admin_view_pending_requests", "view_pending_requests_command", None),
+    ("admin_view_approved_requests", "view_approved_requests_command", None),
+    ("admin_view_unanswered_support", "view_unanswered_support_messages_command", None),
+    ("admin_view_all_support", "view_all_support_messages_command", None),
+    (r"^mark_support_answered_", "mark_support_message_answered_action", lambda d: (int(d.split('_')[3]),)),
+    ("show_connection_guide", "show_connection_guide", None),
+    ("deliver_cancel_send", "deliver_cancel_send", None),
+]
+
+# The same routes in the router: (action, handler name, argument types)
+ROUTES: List[Tuple[str, str, tuple]] = [
+    ("admin_main_menu", "admin_panel", ()),
+    ("admin_manage_users", "admin_manage_users_menu", ()),
+    ("admin_manage_services", "admin_manage_services_menu", ()),
+    ("admin_discount_codes", "admin_discount_codes_menu", ()),
+    ("admin_requests", "admin_requests_menu", ()),
+    ("admin_stats", "admin_stats_command", ()),
+    ("admin_support", "admin_support_menu", ()),
+    ("admin_view_all_users", "view_all_users_command", ()),
+    ("admin_view_pending_users", "view_pending_users_command", ()),
+    ("admin_approve_user_list", "view_pending_users_command", ()),
+    ("admin_add_credit_to_user_list", "admin_add_credit_to_user_list", ()),
+    ("users_page", "user_browser_page", (str, str, int)),
+    ("approve_user", "approve_user_action", (int,)),
+    ("reject_user", "reject_user_action", (int,)),
+    ("admin_view_all_services", "view_all_services_command", ()),
+    ("admin_view_all_service_prices", "view_all_service_prices_command", ()),
+    ("admin_view_all_discount_codes", "view_all_discount_codes_command", ()),
+    ("admin_view_pending_requests", "view_pending_requests_command", ()),
+    ("admin_view_approved_requests", "view_approved_requests_command", ()),
+    ("admin_view_unanswered_support", "view_unanswered_support_messages_command", ()),
+    ("admin_view_all_support", "view_all_support_messages_command", ()),
+    ("mark_support_answered", "mark_support_message_answered_action", (int,)),
+    ("show_connection_guide", "show_connection_guide", ()),
+    ("deliver_cancel_send", "deliver_cancel_send", ()),
+]
+
+def sample_data() -> List[Tuple[str, str]]:
+    """One (legacy data, router data) pair per route, ids as in production."""
+    samples = []
+    for (pattern, _, extract), (action, _, arg_types) in zip(LEGACY_CHAIN, ROUTES):
+        if action == "users_page":
+            samples.append(("users_page_all_next_123456789", callback_data(action, "all", "next", 123456789)))
+        elif extract is not None:
+            legacy_prefix = pattern.lstrip("^")
+            samples.append((f"{legacy_prefix}987654321", callback_data(action, 987654321)))
+        else:
+            samples.append((action, action))
+    return samples
+
+def legacy_dispatch(chain, data: str):
+    for regex, handler, extract in chain:
+        if regex.match(data):
+            return handler, extract(data) if extract else ()
+    return None
+
+def bench(func: Callable[[str], object], data: List[str], iterations: int) -> float:
+    """Return nanoseconds per dispatch."""
+    count = len(data)
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(data[i % count])
+    return (time.perf_counter() - started) / iterations * 1e9
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare regex-chain and router callback dispatch.")
+    parser.add_argument("--iterations", type=int, default=200000, help="dispatches per variant")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    chain = [(re.compile(pattern), _handler(name), extract) for pattern, name, extract in LEGACY_CHAIN]
+    router = CallbackRouter()
+    for action, name, arg_types in ROUTES:
+        router.add(action, _handler(name), *arg_types)
+
+    samples = sample_data()
+    legacy_data = [legacy for legacy, _ in samples]
+    router_data = [routed for _, routed in samples]
+
+    # Both must find the same handler with the same arguments
+    for legacy, routed in samples:
+        old_handler, old_args = legacy_dispatch(chain, legacy)
+        new_handler, new_args = router.resolve(routed)
+        assert old_handler.__name__ == new_handler.__name__ and tuple(old_args) == tuple(new_args), (legacy, routed)
+
+    legacy_ns = bench(lambda d: legacy_dispatch(chain, d), legacy_data, args.iterations)
+    router_ns = bench(router.resolve, router_data, args.iterations)
+    # Worst case for the chain: callbacks registered last
+    tail = legacy_data[-3:], router_data[-3:]
+    legacy_tail_ns = bench(lambda d: legacy_dispatch(chain, d), tail[0], args.iterations)
+    router_tail_ns = bench(router.resolve, tail[1], args.iterations)
+
+    results = {
+        "routes": len(ROUTES),
+        "iterations": args.iterations,
+        "regex_chain_ns": round(legacy_ns, 1),
+        "router_ns": round(router_ns, 1),
+        "speedup": round(legacy_ns / router_ns, 2),
+        "regex_chain_tail_ns": round(legacy_tail_ns, 1),
+        "router_tail_ns": round(router_tail_ns, 1),
+        "tail_speedup": round(legacy_tail_ns / router_tail_ns, 2),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'variant':<14} {'mean ns':>10} {'last-3 ns':>10}")
+    print(f"{'regex chain':<14} {results['regex_chain_ns']:>10} {results['regex_chain_tail_ns']:>10}")
+    print(f"{'router':<14} {results['router_ns']:>10} {results['router_tail_ns']:>10}")
+    print(f"speedup: {results['speedup']}x mean, {results['tail_speedup']}x for the last routes ({len(ROUTES)} routes)")
+
+if __name__ == "__main__":
+    main()
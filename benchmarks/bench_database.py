@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for database.py.
+Seeds a fresh database with synthetic users, purchase_requests, support_messages and
+credit_transfers (one row per user in each table by default) at one or more scales,
+then times every public database function and reports latency percentiles.
+Functions added to database.py without a case here are listed as not benchmarked.
+
+Results can be saved with --output and compared against a saved run with --compare,
+so regressions show up between commits.
+
+Usage:
+    python benchmarks/bench_database.py [--scales 10000 100000 1000000] [--repeat 200]
+        [--heavy-repeat 3] [--only get_user ...] [--user-cache] [--json] [--output FILE]
+        [--compare BASELINE.json] [--max-slowdown 1.5]
+"""
+
+import argparse
+import datetime
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+
+# Connection handling and schema setup, not part of the data layer's query paths
+INFRASTRUCTURE = {
+    "apply_pragmas", "open_connection", "get_db_connection", "close_db_connection",
+    "get_db", "get_db_immediate", "init_database",
+}
+
+SEED_BATCH = 50000
+DISCOUNT_CODES = 100
+ACCOUNT_TYPES = list(config.ACCOUNT_TYPES)
+SERVICE_TYPES = list(config.SERVICE_TYPES.values())
+DEVICES = ["android", "ios", "windows"]
+
+class Case(NamedTuple):
+    """One benchmarked function. make_args(i, rng) returns (args, kwargs) for the i-th call.
+    Heavy cases return or write O(rows) data and run --heavy-repeat times."""
+    name: str
+    make_args: Callable[[int, random.Random], Tuple[tuple, Dict[str, Any]]]
+    heavy: bool = False
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the pct-th percentile of samples (in milliseconds)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index] * 1000
+
+def public_functions() -> List[str]:
+    """Names of the public functions defined in database.py."""
+    return sorted(
+        name for name, obj in vars(database).items()
+        if inspect.isfunction(obj) and obj.__module__ == database.__name__
+        and not name.startswith("_") and name not in INFRASTRUCTURE
+    )
+
+# --- Seeding ---
+
+def _dates(rng: random.Random, now: datetime.datetime) -> Iterator[str]:
+    """Timestamps spread over the last year."""
+    while True:
+        yield (now - datetime.timedelta(seconds=rng.randint(0, 365 * 86400))).isoformat()
+
+def _insert_batches(conn: sqlite3.Connection, sql: str, rows: Iterator[tuple]) -> None:
+    while True:
+        batch = list(itertools.islice(rows, SEED_BATCH))
+        if not batch:
+            return
+        conn.executemany(sql, batch)
+
+def seed(scale: int, rng: random.Random) -> Dict[str, int]:
+    """Fill the current database with `scale` users and `scale` rows in each activity table."""
+    now = datetime.datetime.now()
+    dates = _dates(rng, now)
+    conn = database.get_db_connection()
+    with conn:
+        _insert_batches(conn, """INSERT INTO users (id, username, first_name, last_name, phone_number, full_name,
+                   requested_os, credit, is_approved, registration_date, last_activity)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+            (user_id, f"user{user_id}", "First", "Last", f"+98912{user_id:07d}", f"User {user_id}",
+             rng.choice(DEVICES), rng.randint(0, 100000), int(rng.random() < 0.9), next(dates), next(dates))
+            for user_id in range(1, scale + 1)
+        ))
+        _insert_batches(conn, """INSERT INTO purchase_requests (user_id, account_type, requested_service,
+                   requested_device, request_date, status) VALUES (?, ?, ?, ?, ?, ?)""", (
+            (rng.randint(1, scale), rng.choice(ACCOUNT_TYPES), rng.choice(SERVICE_TYPES), rng.choice(DEVICES),
+             next(dates), rng.choices(("approved", "pending", "rejected"), (80, 15, 5))[0])
+            for _ in range(scale)
+        ))
+        _insert_batches(conn, """INSERT INTO support_messages (user_id, message_text, message_date, is_answered)
+                   VALUES (?, ?, ?, ?)""", (
+            (rng.randint(1, scale), "سلام، اتصال برقرار نمی‌شود", next(dates), int(rng.random() < 0.9))
+            for _ in range(scale)
+        ))
+        _insert_batches(conn, """INSERT INTO credit_transfers (sender_id, receiver_id, amount, transfer_date)
+                   VALUES (?, ?, ?, ?)""", (
+            (rng.randint(1, scale), rng.randint(1, scale), rng.randint(1, 5000), next(dates))
+            for _ in range(scale)
+        ))
+        conn.executemany(
+            "INSERT INTO discount_codes (code, value, created_date) VALUES (?, ?, ?)",
+            [(f"SEED{n:04d}", rng.randint(1, 50) * 100, now.isoformat()) for n in range(DISCOUNT_CODES)]
+        )
+        conn.executemany(
+            "INSERT INTO services (type, content, is_file, file_name) VALUES (?, ?, 0, NULL)",
+            [(service_type, f"https://example.com/{service_type}") for service_type in SERVICE_TYPES]
+        )
+        conn.executemany(
+            "INSERT INTO service_prices (service_type, price) VALUES (?, ?)",
+            [(service_type, 5000) for service_type in SERVICE_TYPES]
+        )
+    conn.execute("ANALYZE")
+    return {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("users", "purchase_requests", "support_messages", "credit_transfers", "discount_codes")
+    }
+
+# --- Cases ---
+
+def build_cases(scale: int, job_id: int) -> List[Case]:
+    """Benchmark cases for a database seeded with `scale` users (broadcast job `job_id` exists)."""
+    new_ids = itertools.count(scale + 1)
+    new_codes = itertools.count()
+    user = lambda i, rng: ((rng.randint(1, scale),), {})
+    row = lambda i, rng: ((rng.randint(1, scale),), {})
+    none = lambda i, rng: ((), {})
+    return [
+        # Users
+        Case("get_user", user),
+        Case("get_user_cache_stats", none),
+        Case("get_all_users", none, heavy=True),
+        Case("get_pending_users", none, heavy=True),
+        Case("get_users_page", lambda i, rng: ((rng.randint(0, scale),), {})),
+        Case("add_user", lambda i, rng: ((next(new_ids), "new_user", "First", "Last"), {})),
+        Case("update_user_info", lambda i, rng: ((rng.randint(1, scale),), {"full_name": "Bench User", "requested_os": "android"})),
+        Case("update_user_activity", user),
+        Case("save_user_activity", lambda i, rng: (([("2026-01-01T00:00:00", rng.randint(1, scale)) for _ in range(100)], [("user", "First", "Last", "2026-01-01T00:00:00", rng.randint(1, scale)) for _ in range(20)]), {})),
+        Case("approve_user", user),
+        Case("reject_user", user),
+        Case("increase_credit", lambda i, rng: ((rng.randint(1, scale), 100), {})),
+        Case("decrease_credit", lambda i, rng: ((rng.randint(1, scale), 1), {})),
+        # Catalog
+        Case("load_catalog", none),
+        Case("get_catalog_version", none),
+        Case("get_discount_code", lambda i, rng: ((f"SEED{rng.randrange(DISCOUNT_CODES):04d}",), {})),
+        Case("get_all_discount_codes", none),
+        Case("get_service", lambda i, rng: ((rng.choice(SERVICE_TYPES),), {})),
+        Case("get_all_services", none),
+        Case("get_service_price", lambda i, rng: ((rng.choice(SERVICE_TYPES),), {})),
+        Case("get_all_service_prices", none),
+        Case("add_discount_code", lambda i, rng: ((f"BENCH{next(new_codes):06d}", 500), {})),
+        Case("use_discount_code", lambda i, rng: ((f"SEED{rng.randrange(DISCOUNT_CODES):04d}",), {})),
+        Case("delete_discount_code", lambda i, rng: ((f"BENCH{i:06d}",), {})),
+        Case("set_service", lambda i, rng: ((rng.choice(SERVICE_TYPES), "https://example.com/new", False), {})),
+        Case("delete_service", lambda i, rng: (("bench_missing",), {})),
+        Case("set_service_price", lambda i, rng: ((rng.choice(SERVICE_TYPES), 6000), {})),
+        # Credit transfers
+        Case("get_credit_transfers_for_user", user),
+        Case("add_credit_transfer", lambda i, rng: ((rng.randint(1, scale), rng.randint(1, scale), 10), {})),
+        Case("transfer_credit", lambda i, rng: ((rng.randint(1, scale), rng.randint(1, scale), 1), {})),
+        # Support messages
+        Case("get_support_message_by_id", row),
+        Case("get_support_messages", lambda i, rng: ((False,), {}), heavy=True),
+        Case("get_support_messages_with_users", lambda i, rng: ((False,), {}), heavy=True),
+        Case("add_support_message", lambda i, rng: ((rng.randint(1, scale), "پیام تست"), {})),
+        Case("mark_support_message_answered", row),
+        # Purchase requests
+        Case("get_purchase_request_by_id", row),
+        Case("get_purchase_requests_by_user", user),
+        Case("get_purchase_requests_by_status", lambda i, rng: (("pending",), {}), heavy=True),
+        Case("get_purchase_requests_with_users", lambda i, rng: (("pending",), {}), heavy=True),
+        Case("get_purchase_requests_page", lambda i, rng: (("pending", rng.randint(0, scale)), {})),
+        Case("get_purchase_request_ids", lambda i, rng: (("pending",), {}), heavy=True),
+        Case("add_purchase_request", lambda i, rng: ((rng.randint(1, scale), rng.choice(ACCOUNT_TYPES), rng.choice(SERVICE_TYPES), "android"), {})),
+        Case("update_purchase_request_status", lambda i, rng: ((rng.randint(1, scale), rng.choice(("approved", "rejected"))), {})),
+        Case("update_purchase_requests_status", lambda i, rng: (([rng.randint(1, scale) for _ in range(100)], "approved"), {})),
+        # Subscriptions (approvals above start them)
+        Case("get_next_subscription_due", none),
+        Case("process_due_subscriptions", lambda i, rng: ((500,), {})),
+        # Broadcast jobs
+        Case("create_broadcast_job", lambda i, rng: ((1, "benchmark"), {}), heavy=True),
+        Case("set_broadcast_progress_message", lambda i, rng: ((job_id, i), {})),
+        Case("get_broadcast_job", lambda i, rng: ((job_id,), {})),
+        Case("get_unfinished_broadcast_jobs", none),
+        Case("get_pending_broadcast_recipients", lambda i, rng: ((job_id, rng.randint(0, scale)), {})),
+        Case("record_broadcast_results", lambda i, rng: ((job_id, [(rng.randint(1, scale), "sent", None) for _ in range(50)]), {})),
+        Case("finish_broadcast_job", lambda i, rng: ((job_id,), {})),
+        # Media file_id cache
+        Case("get_media_file_ids", lambda i, rng: (([f"photo{n}.jpg" for n in range(1, 11)],), {})),
+        Case("save_media_file_ids", lambda i, rng: (([(f"photo{n}.jpg", "1-1", f"file{n}") for n in range(1, 11)],), {})),
+        # Credential inventory (stock refilled as it is claimed)
+        Case("add_inventory_items", lambda i, rng: (("openvpn", [(f"vpn://bench/{i}/{n}", False, None) for n in range(100)]), {})),
+        Case("claim_inventory_item", lambda i, rng: (("openvpn", rng.randint(1, scale), next(new_ids)), {})),
+        Case("release_inventory_item", lambda i, rng: ((i + 1,), {})),
+        Case("get_inventory_stock", none),
+        # Generated configs (saved before they are read back)
+        Case("save_generated_config", lambda i, rng: ((i % scale + 1, i + 1, "openvpn", f"u{i}", "client\nremote vpn.example.com 1194\n", f"openvpn_{i + 1}.ovpn"), {})),
+        Case("get_generated_config", lambda i, rng: ((i % scale + 1, i + 1), {})),
+        # Conversation persistence
+        Case("get_persistence_data", lambda i, rng: (("user", rng.randint(1, scale)), {})),
+        Case("get_persistence_conversations", lambda i, rng: (("purchase_conv",), {})),
+        Case("save_persistence_batch", lambda i, rng: (([("user", rng.randint(1, scale), b"\x80\x04}\x94.")], [("purchase_conv", f"[{rng.randint(1, scale)}]", "3")]), {})),
+        # Statistics
+        Case("get_bot_statistics", none),
+        Case("reconcile_statistics", lambda i, rng: ((False,), {}), heavy=True),
+    ]
+
+def run_case(case: Case, repeat: int, rng: random.Random) -> Dict[str, Any]:
+    func = getattr(database, case.name)
+    samples: List[float] = []
+    rows: Optional[int] = None
+    for i in range(repeat):
+        args, kwargs = case.make_args(i, rng)
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        samples.append(time.perf_counter() - started)
+        if isinstance(result, list):
+            rows = len(result)
+    return {
+        "function": case.name,
+        "calls": repeat,
+        "rows": rows,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 4),
+        "p50_ms": round(percentile(samples, 50), 4),
+        "p95_ms": round(percentile(samples, 95), 4),
+        "p99_ms": round(percentile(samples, 99), 4),
+    }
+
+def run_scale(scale: int, args) -> Dict[str, Any]:
+    """Seed a fresh database with `scale` users and time every case against it."""
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.close_db_connection()
+        database.user_cache.clear()
+        database.user_cache.max_size = config.USER_CACHE_SIZE if args.user_cache else 0
+        database.init_database()
+
+        started = time.perf_counter()
+        row_counts = seed(scale, rng)
+        seed_seconds = time.perf_counter() - started
+        job_id = database.create_broadcast_job(1, "benchmark")
+
+        cases = [case for case in build_cases(scale, job_id) if not args.only or case.name in args.only]
+        results = [
+            run_case(case, args.heavy_repeat if case.heavy else args.repeat, rng)
+            for case in cases
+        ]
+        database.close_db_connection()
+
+    return {
+        "scale": scale,
+        "rows": row_counts,
+        "seed_seconds": round(seed_seconds, 2),
+        "results": results,
+    }
+
+# --- Reporting ---
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_slowdown: float) -> List[str]:
+    """Print p50 changes against a baseline report; return the functions slower than max_slowdown."""
+    before = {
+        (run["scale"], result["function"]): result
+        for run in baseline["runs"] for result in run["results"]
+    }
+    regressions = []
+    print(f"\ncompared with {baseline.get('revision') or 'baseline'} (p50)")
+    for run in report["runs"]:
+        for result in run["results"]:
+            old = before.get((run["scale"], result["function"]))
+            if old is None or not old["p50_ms"]:
+                continue
+            ratio = result["p50_ms"] / old["p50_ms"]
+            flag = ""
+            if ratio > max_slowdown:
+                flag = "  REGRESSION"
+                regressions.append(f"{result['function']}@{run['scale']}")
+            print(f"{run['scale']:>9} {result['function']:<36} {old['p50_ms']:>10} -> {result['p50_ms']:>10} ms ({ratio:.2f}x){flag}")
+    return regressions
+
+def print_table(report: Dict[str, Any]) -> None:
+    for run in report["runs"]:
+        print(f"\nscale {run['scale']} ({', '.join(f'{table}={count}' for table, count in run['rows'].items())}; seeded in {run['seed_seconds']}s)")
+        print(f"{'function':<36} {'calls':>6} {'rows':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for r in run["results"]:
+            rows = "" if r["rows"] is None else r["rows"]
+            print(f"{r['function']:<36} {r['calls']:>6} {rows:>8} {r['p50_ms']:>10} {r['p95_ms']:>10} {r['p99_ms']:>10}")
+    if report["not_benchmarked"]:
+        print(f"\nnot benchmarked: {', '.join(report['not_benchmarked'])}")
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Time every public database.py function at several data scales.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10000], help="users (and rows per activity table) to seed")
+    parser.add_argument("--repeat", type=int, default=200, help="calls per function")
+    parser.add_argument("--heavy-repeat", type=int, default=3, help="calls per function that reads or writes O(rows) data")
+    parser.add_argument("--only", nargs="+", help="benchmark only these functions")
+    parser.add_argument("--user-cache", action="store_true", help="keep the user cache enabled (default: measure SQLite reads)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and arguments")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--compare", help="JSON report of an earlier run to compare p50 latencies with")
+    parser.add_argument("--max-slowdown", type=float, default=1.5, help="with --compare, exit 1 if any p50 grew by more than this factor")
+    args = parser.parse_args()
+
+    covered = {case.name for case in build_cases(1, 0)}
+    report = {
+        "revision": git_revision(),
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "pragmas": database.DB_PRAGMAS,
+        "user_cache": args.user_cache,
+        "not_benchmarked": [name for name in public_functions() if name not in covered],
+        "runs": [run_scale(scale, args) for scale in args.scales],
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_table(report)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_slowdown)
+        if regressions:
+            print(f"\n{len(regressions)} function(s) slower than {args.max_slowdown}x: {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
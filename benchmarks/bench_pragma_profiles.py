@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the SQLite pragma profiles in config.DB_PRAGMA_PROFILES.
+Runs a realistic write mix (add_user, add_purchase_request, update_user_activity)
+against a fresh database per profile while reader threads call get_user,
+then reports throughput and latency percentiles.
+
+Usage:
+    python benchmarks/bench_pragma_profiles.py [--users 2000] [--readers 2] [--profiles legacy balanced] [--json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import database
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the pct-th percentile of samples (in milliseconds)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index] * 1000
+
+def run_profile(profile: str, users: int, readers: int) -> Dict[str, object]:
+    """Run the write mix for a single pragma profile and collect timings."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "bench.db")
+        database.DB_PRAGMAS = config.DB_PRAGMA_PROFILES[profile]
+        database.close_db_connection()
+        database.user_cache.max_size = 0 # Measure SQLite reads, not the user cache
+        database.init_database()
+
+        write_latencies: Dict[str, List[float]] = {"add_user": [], "add_purchase_request": [], "update_user_activity": []}
+        read_latencies: List[float] = []
+        stop = threading.Event()
+
+        def reader() -> None:
+            rng = random.Random()
+            while not stop.is_set():
+                started = time.perf_counter()
+                database.get_user(rng.randint(1, users))
+                read_latencies.append(time.perf_counter() - started)
+            database.close_db_connection()
+
+        reader_threads = [threading.Thread(target=reader) for _ in range(readers)]
+        for thread in reader_threads:
+            thread.start()
+
+        account_types = list(config.ACCOUNT_TYPES)
+        service_types = list(config.SERVICE_TYPES.values())
+        started_all = time.perf_counter()
+        for user_id in range(1, users + 1):
+            started = time.perf_counter()
+            database.add_user(user_id, f"user{user_id}", "First", "Last")
+            write_latencies["add_user"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            database.add_purchase_request(user_id, random.choice(account_types), random.choice(service_types), "android")
+            write_latencies["add_purchase_request"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            database.update_user_activity(user_id)
+            write_latencies["update_user_activity"].append(time.perf_counter() - started)
+        elapsed = time.perf_counter() - started_all
+
+        stop.set()
+        for thread in reader_threads:
+            thread.join()
+        database.close_db_connection()
+
+    total_writes = sum(len(samples) for samples in write_latencies.values())
+    result: Dict[str, object] = {
+        "profile": profile,
+        "pragmas": config.DB_PRAGMA_PROFILES[profile],
+        "writes": total_writes,
+        "writes_per_sec": round(total_writes / elapsed, 1),
+        "reads": len(read_latencies),
+        "reads_per_sec": round(len(read_latencies) / elapsed, 1),
+        "read_p50_ms": round(percentile(read_latencies, 50), 3),
+        "read_p99_ms": round(percentile(read_latencies, 99), 3),
+    }
+    for name, samples in write_latencies.items():
+        result[f"{name}_p50_ms"] = round(percentile(samples, 50), 3)
+        result[f"{name}_p99_ms"] = round(percentile(samples, 99), 3)
+    return result
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare SQLite pragma profiles on the bot's write mix.")
+    parser.add_argument("--users", type=int, default=2000, help="number of simulated users (3 writes each)")
+    parser.add_argument("--readers", type=int, default=2, help="concurrent get_user reader threads")
+    parser.add_argument("--profiles", nargs="+", default=list(config.DB_PRAGMA_PROFILES), help="profiles to compare")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [run_profile(profile, args.users, args.readers) for profile in args.profiles]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'profile':<10} {'writes/s':>10} {'reads/s':>10} {'add_user p99':>13} {'purchase p99':>13} {'read p99':>10}")
+    for r in results:
+        print(
+            f"{r['profile']:<10} {r['writes_per_sec']:>10} {r['reads_per_sec']:>10} "
+            f"{r['add_user_p99_ms']:>11}ms {r['add_purchase_request_p99_ms']:>11}ms {r['read_p99_ms']:>8}ms"
+        )
+
+if __name__ == "__main__":
+    main()
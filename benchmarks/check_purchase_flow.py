@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purchase flow regression check.
+Against a fresh database, takes every button of the real /purchase keyboard, routes its
+callback data to the account/device/service handlers the way the bot's CallbackQueryHandlers
+do, and approves the stored request with the same call the admin panel uses. Exits with
+status 1 if a request does not store the account type name, or if an account type listed
+in config.ACCOUNT_TYPE_DAYS is approved without an expiry.
+
+Usage:
+    python benchmarks/check_purchase_flow.py
+"""
+
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+from typing import Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_db
+import bot
+import config
+import database
+from callback_router import CallbackRouter
+
+USER_ID = 1001
+
+# Same routes as the purchase ConversationHandler states in bot.main()
+ROUTER = (
+    CallbackRouter()
+    .add("account", bot.select_purchase_account_type, str)
+    .add("device", bot.select_device_type, str)
+    .add("service", bot.select_service_type, str)
+)
+
+class Recorder:
+    """Stands in for Message/CallbackQuery/Bot: records the reply markups it is sent."""
+
+    def __init__(self):
+        self.markups: List[Any] = []
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        self.markups.append(reply_markup)
+
+    edit_message_text = reply_text
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def send_message(self, chat_id, text, **kwargs):
+        pass
+
+def buttons(markup) -> List[Any]:
+    return [button for row in markup.inline_keyboard for button in row]
+
+async def press(data: str, context) -> None:
+    """Run the handler routed for one button press."""
+    recorder = Recorder()
+    query = SimpleNamespace(
+        data=data, from_user=SimpleNamespace(id=USER_ID, username="check"),
+        answer=recorder.answer, edit_message_text=recorder.edit_message_text, message=recorder,
+    )
+    resolved = ROUTER.resolve(data)
+    if resolved is None:
+        raise AssertionError(f"No route for callback data {data!r}")
+    callback, args = resolved
+    await callback(SimpleNamespace(callback_query=query), context, *args)
+
+async def run_checks() -> int:
+    database.add_user(USER_ID, "check", "Check", "")
+    database.approve_user(USER_ID)
+    context = SimpleNamespace(user_data={}, bot=Recorder(), job_queue=None)
+
+    recorder = Recorder()
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=USER_ID), message=recorder)
+    await bot.purchase_command(update, context)
+    account_buttons = buttons(recorder.markups[0])
+    device = config.DEVICE_TYPES["اندروید"]
+    service = config.SERVICE_TYPES["OpenVPN"]
+
+    failures = 0
+    now = datetime.datetime.now()
+    for button in account_buttons:
+        for data in (button.callback_data, f"device:{device}", f"service:{service}"):
+            await press(data, context)
+        request = max(database.get_purchase_requests_by_user(USER_ID), key=lambda r: r['id'])
+        await async_db.update_purchase_requests_status([request['id']], 'approved')
+        request = database.get_purchase_request_by_id(request['id'])
+
+        problems = []
+        if request['account_type'] != button.text:
+            problems.append(f"stored account_type {request['account_type']!r}")
+        days = config.ACCOUNT_TYPE_DAYS.get(button.text)
+        if days:
+            if not request['expires_at'] or not request['notify_at']:
+                problems.append("approved without expires_at/notify_at")
+            elif (datetime.datetime.fromisoformat(request['expires_at']) - now).days not in (days - 1, days):
+                problems.append(f"expires_at {request['expires_at']} is not {days} days ahead")
+        elif request['expires_at'] or request['notify_at']:
+            problems.append("account type without a length got an expiry")
+        print(f"[{'FAIL' if problems else 'ok'}] {button.callback_data}: expires_at={request['expires_at']}")
+        for problem in problems:
+            print(f"       -> {problem}")
+        failures += bool(problems)
+
+    if failures:
+        print(f"{failures} account type(s) failed the purchase flow")
+        return 1
+    print("All account types go through purchase and approval correctly.")
+    return 0
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "purchase.db")
+        database.close_db_connection()
+        database.init_database()
+        try:
+            return asyncio.run(run_checks())
+        finally:
+            database.close_db_connection()
+
+if __name__ == "__main__":
+    sys.exit(main())
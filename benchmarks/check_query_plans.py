@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Query plan regression check for database.py.
+Calls every filtered/sorted read function against a fresh database, captures the
+SQL it executes and runs EXPLAIN QUERY PLAN on it. Exits with status 1 if any
+statement does a full table scan or sorts with a temporary B-tree, so new
+queries cannot silently lose their index.
+
+Usage:
+    python benchmarks/check_query_plans.py
+"""
+
+import os
+import sys
+import tempfile
+from typing import Callable, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+# Read paths that must be served by an index
+INDEXED_CALLS: List[Tuple[Callable, tuple]] = [
+    (database.get_pending_users, ()),
+    (database.get_users_page, (0, None, 10, False)),
+    (database.get_users_page, (0, 50, 10, True)),
+    (database.get_purchase_requests_by_status, ('pending',)),
+    (database.get_purchase_requests_by_user, (1,)),
+    (database.get_support_messages, (None,)),
+    (database.get_support_messages, (False,)),
+    (database.get_support_messages, (True,)),
+    (database.get_credit_transfers_for_user, (1,)),
+    (database.get_purchase_requests_with_users, ('pending',)),
+    (database.get_purchase_requests_page, ('pending', 0, None, 20)),
+    (database.get_purchase_requests_page, ('pending', 0, 50, 20)),
+    (database.get_purchase_request_ids, ('pending',)),
+    (database.get_support_messages_with_users, (None,)),
+    (database.get_support_messages_with_users, (False,)),
+    (database.claim_inventory_item, ('openvpn', 1, 1)),
+    (database.get_inventory_stock, ()),
+    (database.get_next_subscription_due, ()),
+    (database.process_due_subscriptions, (500,)),
+]
+
+# A user's own transfers are merged from two indexes (sender OR receiver), so the
+# final ORDER BY needs a small per-user sort; that is expected.
+ALLOWED_TEMP_SORTS = {"get_credit_transfers_for_user"}
+
+def capture_statements(func: Callable, args: tuple) -> List[str]:
+    """Run func and return the SELECT statements it executed."""
+    statements: List[str] = []
+    conn = database.get_db_connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        func(*args)
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+
+def plan_problems(func_name: str, sql: str) -> List[str]:
+    """Return the plan lines that indicate a scan or an unindexed sort."""
+    conn = database.get_db_connection()
+    problems = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row[3]
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            problems.append(detail)
+        elif detail.startswith("USE TEMP B-TREE") and func_name not in ALLOWED_TEMP_SORTS:
+            problems.append(detail)
+    return problems
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database.DB_PATH = os.path.join(tmp_dir, "plans.db")
+        database.close_db_connection()
+        database.init_database()
+
+        failures = 0
+        for func, args in INDEXED_CALLS:
+            for sql in capture_statements(func, args):
+                problems = plan_problems(func.__name__, sql)
+                status = "FAIL" if problems else "ok"
+                print(f"[{status}] {func.__name__}{args}: {' '.join(sql.split())}")
+                for detail in problems:
+                    print(f"       -> {detail}")
+                failures += bool(problems)
+
+        database.close_db_connection()
+
+    if failures:
+        print(f"{failures} statement(s) without a usable index")
+        return 1
+    print("All checked queries use indexes.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Telegram Bot API, for load tests.
+Serves the methods the bot uses (getUpdates/setWebhook, sendMessage, sendMediaGroup,
+sendDocument, editMessageText, answerCallbackQuery, ...) on keep_alive's HTTP server,
+records every call, and can add latency and answer a fraction of calls with 429.
+
+Point the bot at it with BOT_API_BASE_URL=http://HOST:PORT/bot. Run standalone:
+    python benchmarks/fake_bot_api.py [--port 8081] [--latency-ms 30] [--rate-429 0.01]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import keep_alive
+
+JSON = "application/json"
+
+# Methods whose result is a Message
+MESSAGE_METHODS = ("sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageReplyMarkup", "editMessageCaption")
+# Methods whose result is simply True
+TRUE_METHODS = (
+    "setWebhook", "deleteWebhook", "answerCallbackQuery", "deleteMessage", "sendChatAction",
+    "setMyCommands", "deleteMyCommands", "close", "logOut",
+)
+
+def parse_body(request: keep_alive.Request) -> Dict[str, Any]:
+    """Decode the form-encoded or multipart parameters python-telegram-bot sends."""
+    content_type = request.headers.get("content-type", "")
+    params: Dict[str, Any] = {}
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=default_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + request.body
+        )
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                params[name] = {"file_size": len(part.get_payload(decode=True) or b"")}
+            else:
+                params[name] = part.get_content()
+    elif content_type.startswith("application/json"):
+        params = json.loads(request.body or b"{}")
+    else:
+        params = dict(parse_qsl(request.body.decode("utf-8"), keep_blank_values=True))
+    # Non-string values arrive JSON-encoded
+    for name, value in params.items():
+        if isinstance(value, str):
+            try:
+                params[name] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+def chat_of_callback(callback_query_id: str) -> Optional[int]:
+    """Callback query IDs created by the load generator are "<chat id>:<n>"."""
+    chat_id, _, _ = str(callback_query_id).partition(":")
+    try:
+        return int(chat_id)
+    except ValueError:
+        return None
+
+class FakeBotAPI:
+    """In-process fake Bot API with update injection and per-chat call listeners."""
+
+    def __init__(self, token: str, host: str = "127.0.0.1", port: int = 8081,
+                 latency: float = 0.0, jitter: float = 0.0, rate_429: float = 0.0, retry_after: int = 1):
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.bot_user = {"id": int(token.split(":")[0]), "is_bot": True, "first_name": "Load Test Bot", "username": "load_test_bot"}
+        self.server = keep_alive.WebServer(host, port)
+        self.calls: Counter = Counter()
+        self.rejected: Counter = Counter() # 429s per method
+        self.call_log: List[tuple] = [] # (time, method, chat_id)
+        self.get_updates_started = asyncio.Event()
+        self._updates: List[Dict[str, Any]] = []
+        self._update_id = 0
+        self._new_updates = asyncio.Event()
+        self._message_id = 0
+        self._listeners: Dict[int, asyncio.Queue] = {}
+        self._webhook_url = ""
+        for method in MESSAGE_METHODS + TRUE_METHODS + ("getMe", "getUpdates", "getWebhookInfo", "sendMediaGroup", "copyMessage"):
+            self.server.route("POST", f"/bot{token}/{method}", self._endpoint(method))
+        self.server.route("GET", "/stats", self._stats_route)
+
+    # --- Update injection ---
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Queue an update for getUpdates; returns its update_id."""
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._new_updates.set()
+        return self._update_id
+
+    def listen(self, chat_id: int) -> asyncio.Queue:
+        """Queue receiving (method, params, result) for every call directed at chat_id."""
+        return self._listeners.setdefault(chat_id, asyncio.Queue())
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    # --- Bot API ---
+
+    def _endpoint(self, method: str):
+        async def handle(request: keep_alive.Request) -> keep_alive.Response:
+            params = parse_body(request)
+            if method != "getUpdates":
+                delay = self.latency + random.uniform(0, self.jitter)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.rate_429 and random.random() < self.rate_429:
+                    self.rejected[method] += 1
+                    return 429, JSON, json.dumps({
+                        "ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    }).encode()
+            self.calls[method] += 1
+            result = await self._call(method, params)
+            chat_id = params.get("chat_id")
+            if method == "answerCallbackQuery":
+                chat_id = chat_of_callback(params.get("callback_query_id", ""))
+            if isinstance(chat_id, int):
+                self.call_log.append((time.monotonic(), method, chat_id))
+                listener = self._listeners.get(chat_id)
+                if listener is not None:
+                    listener.put_nowait((method, params, result))
+            return 200, JSON, json.dumps({"ok": True, "result": result}).encode()
+        return handle
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        message = {
+            "message_id": fields.pop("message_id", None) or self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.bot_user,
+        }
+        message.update({name: value for name, value in fields.items() if value is not None})
+        return message
+
+    async def _call(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return dict(self.bot_user, can_join_groups=True, can_read_all_group_messages=False, supports_inline_queries=False)
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "getWebhookInfo":
+            return {"url": self._webhook_url, "has_custom_certificate": False, "pending_update_count": len(self._updates)}
+        if method == "setWebhook":
+            self._webhook_url = params.get("url", "")
+        if method == "deleteWebhook":
+            self._webhook_url = ""
+        if method in TRUE_METHODS:
+            return True
+        if method == "copyMessage":
+            return {"message_id": self.next_message_id()}
+        if method == "sendMediaGroup":
+            return [
+                self._message(params.get("chat_id"), caption=item.get("caption"), photo=self._photo())
+                for item in params.get("media", [])
+            ]
+        # Message-returning methods
+        markup = params.get("reply_markup")
+        inline_markup = markup if isinstance(markup, dict) and "inline_keyboard" in markup else None
+        fields = {"text": params.get("text"), "caption": params.get("caption"), "reply_markup": inline_markup}
+        if method.startswith("edit"):
+            fields["message_id"] = params.get("message_id")
+            fields["edit_date"] = int(time.time())
+        if method == "sendDocument":
+            fields["document"] = {"file_id": f"doc{self._message_id}", "file_unique_id": f"udoc{self._message_id}", "file_name": "config"}
+        if method == "sendPhoto":
+            fields["photo"] = self._photo()
+        return self._message(params.get("chat_id"), **fields)
+
+    def _photo(self) -> List[Dict[str, Any]]:
+        file_id = f"photo{self.next_message_id()}"
+        return [{"file_id": file_id, "file_unique_id": f"u{file_id}", "width": 1280, "height": 720}]
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.get_updates_started.set()
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Confirmed updates (below offset) are dropped, as on Telegram
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _stats_route(self, request: keep_alive.Request) -> keep_alive.Response:
+        return 200, JSON, json.dumps(self.stats()).encode()
+
+    def stats(self) -> Dict[str, Any]:
+        per_chat = defaultdict(int)
+        for _, _, chat_id in self.call_log:
+            per_chat[chat_id] += 1
+        return {
+            "calls": dict(self.calls),
+            "rejected_429": dict(self.rejected),
+            "chats": len(per_chat),
+            "pending_updates": len(self._updates),
+        }
+
+    async def start(self) -> None:
+        await self.server.start()
+
+    async def stop(self) -> None:
+        self._new_updates.set() # Release a waiting getUpdates
+        await self.server.stop()
+
+async def _serve(args) -> None:
+    api = FakeBotAPI(args.token, args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_429)
+    await api.start()
+    print(f"Fake Bot API on http://{args.host}:{args.port}/bot (token {args.token}); call counts at /stats")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve a fake Telegram Bot API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--token", default="123456:LOADTEST")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="added to every call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random extra latency up to this value")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of calls answered with 429")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end load test of bot.py against the fake Bot API.
+Seeds a fresh database, starts bot.py in polling mode against benchmarks/fake_bot_api.py
+and drives simulated users through the registration, purchase, discount and support
+flows. Each step injects one update and waits for the bot's replies to that chat.
+
+Reports throughput, end-to-end step latency, and the bot's own handler latency,
+DB write-lock wait and DB queue wait (scraped from its /metrics endpoint).
+
+Usage:
+    python benchmarks/load_test.py [--users 1000] [--concurrency 100] [--latency-ms 30]
+                                   [--jitter-ms 20] [--rate-429 0.0] [--admin-approval] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from fake_bot_api import FakeBotAPI
+
+TOKEN = "123456:LOADTEST"
+ADMIN_ID = 1000
+FIRST_USER_ID = 100000
+STEP_TIMEOUT = 30.0
+
+# Main menu buttons (see bot.get_main_menu_keyboard)
+BUTTON_PURCHASE = "🛍 خرید اکانت"
+BUTTON_DISCOUNT = "🎁 استفاده از کد تخفیف"
+BUTTON_SUPPORT = "📞 پشتیبانی"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+class StepFailed(Exception):
+    pass
+
+class SimulatedUser:
+    """One Telegram user: sends updates and waits for the bot's replies to its chat."""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, stats: "LoadStats"):
+        self.api = api
+        self.user_id = user_id
+        self.stats = stats
+        self.inbox = api.listen(user_id)
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        self.last_markup: Optional[Dict[str, Any]] = None
+        self.last_message_id = 0
+        self._callbacks = 0
+
+    def _message(self, **fields) -> Dict[str, Any]:
+        message = {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private", "first_name": self.user["first_name"]},
+            "from": self.user,
+        }
+        message.update(fields)
+        return message
+
+    async def _step(self, name: str, update: Dict[str, Any], replies: int) -> None:
+        """Inject update and wait until the bot made `replies` calls to this chat."""
+        started = time.perf_counter()
+        self.api.push_update(update)
+        for _ in range(replies):
+            try:
+                method, params, result = await asyncio.wait_for(self.inbox.get(), STEP_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise StepFailed(name)
+            markup = params.get("reply_markup")
+            if isinstance(markup, dict) and "inline_keyboard" in markup:
+                self.last_markup = markup
+                self.last_message_id = result["message_id"]
+        self.stats.record_step(name, time.perf_counter() - started)
+
+    async def send_text(self, name: str, text: str, replies: int) -> None:
+        fields: Dict[str, Any] = {"text": text}
+        if text.startswith("/"):
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self._step(name, {"message": self._message(**fields)}, replies)
+
+    async def send_contact(self, name: str, replies: int) -> None:
+        contact = {"phone_number": f"+98912{self.user_id:07d}", "first_name": self.user["first_name"], "user_id": self.user_id}
+        await self._step(name, {"message": self._message(contact=contact)}, replies)
+
+    async def press(self, name: str, replies: int, exclude: Tuple[str, ...] = ()) -> None:
+        """Press a random button of the last inline keyboard the bot sent."""
+        if not self.last_markup:
+            raise StepFailed(f"{name}: no inline keyboard")
+        buttons = [button["callback_data"] for row in self.last_markup["inline_keyboard"] for button in row
+                   if "callback_data" in button and button["callback_data"] not in exclude]
+        self.last_markup = None
+        self._callbacks += 1
+        await self.press_data(name, random.choice(buttons), replies)
+
+    async def press_data(self, name: str, data: str, replies: int) -> None:
+        callback_query = {
+            "id": f"{self.user_id}:{self._callbacks}", # fake_bot_api maps answers back to this chat
+            "from": self.user,
+            "chat_instance": str(self.user_id),
+            "data": data,
+            "message": self._message(message_id=self.last_message_id or 1, text="...", **{"from": self.api.bot_user}),
+        }
+        await self._step(name, {"callback_query": callback_query}, replies)
+
+    async def run(self, discount_code: str, admin: Optional["AdminUser"]) -> None:
+        # Registration: welcome + "complete your info" + contact request
+        await self.send_text("start", "/start", 3)
+        await self.send_contact("contact", 2) # saved + ask full name
+        await self.send_text("full_name", f"Load Test {self.user_id}", 2) # saved + OS keyboard
+        await self.press("os", 3) # answer + edit + main menu
+
+        if admin is not None:
+            await admin.approve(self) # user receives the approval message
+
+        # Purchase: account type -> device -> service
+        await self.send_text("purchase", BUTTON_PURCHASE, 1)
+        await self.press("account_type", 2) # answer + edit
+        await self.press("device", 2, exclude=("device:guide",))
+        await self.press("service", 2)
+
+        # Discount code
+        await self.send_text("discount", BUTTON_DISCOUNT, 1)
+        await self.send_text("discount_code", discount_code, 1)
+
+        # Support message
+        await self.send_text("support", BUTTON_SUPPORT, 1)
+        await self.send_text("support_message", f"Load test message from {self.user_id}", 1)
+
+class AdminUser:
+    """The admin approving users through the approve_user callback (serialized on the admin chat)."""
+
+    def __init__(self, api: FakeBotAPI):
+        self.api = api
+        self.user = {"id": ADMIN_ID, "is_bot": False, "first_name": "Admin"}
+        self._callbacks = 0
+
+    async def approve(self, user: SimulatedUser) -> None:
+        self._callbacks += 1
+        callback_query = {
+            "id": f"{ADMIN_ID}:{self._callbacks}",
+            "from": self.user,
+            "chat_instance": str(ADMIN_ID),
+            "data": f"approve_user:{user.user_id}",
+            "message": {"message_id": 1, "date": int(time.time()), "chat": {"id": ADMIN_ID, "type": "private"}, "text": "..."},
+        }
+        started = time.perf_counter()
+        self.api.push_update({"callback_query": callback_query})
+        try:
+            await asyncio.wait_for(user.inbox.get(), STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise StepFailed("approve")
+        user.stats.record_step("approve", time.perf_counter() - started)
+
+class LoadStats:
+    def __init__(self):
+        self.steps: Dict[str, List[float]] = defaultdict(list)
+        self.failures: Counter = Counter()
+        self.completed = 0
+
+    def record_step(self, name: str, seconds: float) -> None:
+        self.steps[name].append(seconds)
+
+# --- Bot process ---
+
+def seed_database(workdir: str, users: int, pre_approve: bool) -> List[str]:
+    """Create the bot database with the admin, discount codes and (optionally) pre-approved users."""
+    import database
+    database.DB_PATH = os.path.join(workdir, "vpn_bot.db")
+    database.init_database()
+    database.add_user(ADMIN_ID, "admin", "Admin", "")
+    database.approve_user(ADMIN_ID)
+    codes = []
+    for i in range(users):
+        code = f"LOAD{i:06d}"
+        database.add_discount_code(code, 1000)
+        codes.append(code)
+        if pre_approve:
+            user_id = FIRST_USER_ID + i
+            database.add_user(user_id, f"user{user_id}", f"User{user_id}", "")
+            database.approve_user(user_id)
+    database.close_db_connection()
+    return codes
+
+def start_bot(workdir: str, api_port: int, metrics_port: int) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN=TOKEN,
+        ADMIN_TELEGRAM_ID=str(ADMIN_ID),
+        BOT_API_BASE_URL=f"http://127.0.0.1:{api_port}/bot",
+        BOT_API_BASE_FILE_URL=f"http://127.0.0.1:{api_port}/file/bot",
+        RUN_MODE="polling",
+        HEALTH_SERVER="1",
+        WEB_HOST="127.0.0.1",
+        WEB_PORT=str(metrics_port),
+        GUIDE_WARMUP="0",
+        FLOOD_USER_RATE="0", # Simulated users click faster than flood control allows
+        FLOOD_GLOBAL_RATE="0",
+    )
+    env.pop("PORT", None)
+    log = open(os.path.join(workdir, "bot.log"), "wb")
+    return subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "bot.py")], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def scrape_histograms(metrics_port: int, names: Tuple[str, ...]) -> Dict[str, Dict[str, float]]:
+    """Read the bot's /metrics and summarize histograms (all label sets merged)."""
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=10) as response:
+        text = response.read().decode("utf-8")
+    line_re = re.compile(r'^(\w+)_(bucket|sum|count)(?:\{(.*)\})? (\S+)$')
+    buckets: Dict[str, Dict[float, float]] = defaultdict(lambda: defaultdict(float))
+    totals: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+    for line in text.splitlines():
+        match = line_re.match(line)
+        if not match or match.group(1) not in names:
+            continue
+        name, kind, labels, value = match.groups()
+        if kind == "bucket":
+            le = re.search(r'le="([^"]+)"', labels).group(1)
+            buckets[name][float("inf") if le == "+Inf" else float(le)] += float(value)
+        else:
+            totals[name][kind] += float(value)
+    summary = {}
+    for name in names:
+        count = totals[name]["count"]
+        cumulative = sorted(buckets[name].items())
+
+        def bucket_percentile(pct: float) -> float:
+            target = count * pct / 100
+            for bound, seen in cumulative:
+                if seen >= target:
+                    return bound
+            return 0.0
+
+        summary[name] = {
+            "count": int(count),
+            "total_s": round(totals[name]["sum"], 3),
+            "p50_ms_le": round(bucket_percentile(50) * 1000, 2) if count else 0.0,
+            "p99_ms_le": round(bucket_percentile(99) * 1000, 2) if count else 0.0,
+        }
+    return summary
+
+async def run_load(args) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="vpnbot-load-")
+    codes = seed_database(workdir, args.users, pre_approve=not args.admin_approval)
+
+    api_port, metrics_port = free_port(), free_port()
+    api = FakeBotAPI(TOKEN, "127.0.0.1", api_port, args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_429)
+    await api.start()
+    bot = start_bot(workdir, api_port, metrics_port)
+    try:
+        await asyncio.wait_for(api.get_updates_started.wait(), 60)
+    except asyncio.TimeoutError:
+        bot.kill()
+        await api.stop()
+        raise SystemExit(f"bot.py did not start polling; see {workdir}/bot.log")
+
+    stats = LoadStats()
+    admin = AdminUser(api) if args.admin_approval else None
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate(index: int) -> None:
+        async with semaphore:
+            user = SimulatedUser(api, FIRST_USER_ID + index, stats)
+            try:
+                await user.run(codes[index], admin)
+                stats.completed += 1
+            except StepFailed as e:
+                stats.failures[str(e)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    bot_metrics = scrape_histograms(metrics_port, (
+        "bot_handler_seconds", "bot_db_call_seconds", "bot_db_lock_wait_seconds",
+        "bot_db_queue_seconds", "bot_update_wait_seconds",
+    ))
+    bot.send_signal(signal.SIGINT)
+    try:
+        bot.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+    await api.stop()
+
+    updates = sum(len(samples) for samples in stats.steps.values())
+    all_steps = [sample for samples in stats.steps.values() for sample in samples]
+    return {
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "api_latency_ms": args.latency_ms,
+        "rate_429": args.rate_429,
+        "elapsed_s": round(elapsed, 2),
+        "flows_completed": stats.completed,
+        "flows_failed": dict(stats.failures),
+        "updates": updates,
+        "updates_per_sec": round(updates / elapsed, 1),
+        "step_p50_ms": round(percentile(all_steps, 50) * 1000, 2),
+        "step_p99_ms": round(percentile(all_steps, 99) * 1000, 2),
+        "steps": {
+            name: {"p50_ms": round(percentile(samples, 50) * 1000, 2), "p99_ms": round(percentile(samples, 99) * 1000, 2)}
+            for name, samples in stats.steps.items()
+        },
+        "bot": bot_metrics,
+        "api": api.stats(),
+        "workdir": workdir,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test bot.py against a fake Bot API.")
+    parser.add_argument("--users", type=int, default=1000, help="simulated users (each runs all flows once)")
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="fake Bot API latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="random extra latency per call")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of Bot API calls answered with 429")
+    parser.add_argument("--admin-approval", action="store_true", help="approve users through the admin chat instead of seeding them approved")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{results['flows_completed']}/{results['users']} user flows completed in {results['elapsed_s']}s "
+          f"({results['updates']} updates, {results['updates_per_sec']} updates/s)")
+    if results["flows_failed"]:
+        print(f"failed at step: {results['flows_failed']}")
+    print(f"end-to-end step latency: p50 {results['step_p50_ms']}ms, p99 {results['step_p99_ms']}ms")
+    print(f"{'step':<16} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, step in results["steps"].items():
+        print(f"{name:<16} {step['p50_ms']:>9} {step['p99_ms']:>9}")
+    print(f"{'bot metric':<26} {'count':>8} {'total s':>9} {'p50 ms<=':>9} {'p99 ms<=':>9}")
+    for name, summary in results["bot"].items():
+        print(f"{name:<26} {summary['count']:>8} {summary['total_s']:>9} {summary['p50_ms_le']:>9} {summary['p99_ms_le']:>9}")
+    print(f"Bot API calls: {results['api']['calls']}; 429s injected: {results['api']['rejected_429']}")
+    print(f"bot log and database: {results['workdir']}")
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,35 @@
 import os
+import html
+import asyncio
+import secrets
+import signal
 import sqlite3
 import logging
+import tempfile
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler,
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler,
     filters, ContextTypes, ConversationHandler, CallbackQueryHandler
 )
+from telegram.error import TelegramError
 
 import config # Import config.py for states and constants
 import database # Import database.py for database operations
+import async_db # Non-blocking wrappers around database.py for handlers
+import broadcast # Rate-limited, resumable broadcast jobs
+import keep_alive # Async HTTP server for health checks and the webhook
+import telemetry # Handler and Bot API metrics served on /metrics
+from persistence import SQLitePersistence # Conversation states and user_data survive restarts
+from update_processor import ChatOrderedUpdateProcessor # Concurrent updates, in order per chat
+from callback_router import CallbackRouter, action_handler, callback_data # "action:args" callback dispatch
+from ratelimit import FloodControl # Per-user/global admission of incoming updates
+import metrics # In-process counters served on /metrics
+import chat_relay # Live admin-user chats: relays user messages to the admin
+import inventory # Pre-provisioned credentials delivered on approval
+import config_generator # Per-user configs rendered from templates
+import subscriptions # Renewal reminders and expiry of approved subscriptions
+import activity # Write-behind buffer for last_activity and profile refreshes
 import datetime
 
 # Enable logging
@@ -25,17 +45,33 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 ADMIN_ID = config.ADMIN_ID # Using ADMIN_ID from config.py
+WEBHOOK_SECRET = config.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+
+# HTTP server on the bot's event loop (health route, webhook in webhook mode)
+web_server = None
+
+# Incoming update limits; the admin is never throttled
+flood_control = FloodControl(
+    user_rate=config.FLOOD_USER_RATE,
+    user_burst=config.FLOOD_USER_BURST,
+    global_rate=config.FLOOD_GLOBAL_RATE,
+    global_burst=config.FLOOD_GLOBAL_BURST,
+    notice_interval=config.FLOOD_NOTICE_INTERVAL,
+    exempt=[ADMIN_ID],
+)
 
 # --- Helper Functions for Keyboards ---
 
+MAIN_MENU_BUTTONS = [
+    ["🛍 خرید اکانت", "⬇️ دانلود برنامه‌ها"],
+    ["🎁 استفاده از کد تخفیف", "💳 انتقال اعتبار"],
+    ["📞 پشتیبانی", "💰 اعتبار من", "👤 اطلاعات من"],
+]
+MAIN_MENU_TEXTS = {text for row in MAIN_MENU_BUTTONS for text in row}
+
 async def get_main_menu_keyboard():
     """Returns the main menu ReplyKeyboardMarkup for users."""
-    keyboard = [
-        ["🛍 خرید اکانت", "⬇️ دانلود برنامه‌ها"],
-        ["🎁 استفاده از کد تخفیف", "💳 انتقال اعتبار"],
-        ["📞 پشتیبانی", "💰 اعتبار من", "👤 اطلاعات من"],
-    ]
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=False)
+    return ReplyKeyboardMarkup(MAIN_MENU_BUTTONS, resize_keyboard=True, one_time_keyboard=False)
 
 async def get_admin_panel_keyboard():
     """Returns the main admin panel InlineKeyboardMarkup."""
@@ -59,8 +95,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     first_name = update.effective_user.first_name
     last_name = update.effective_user.last_name if update.effective_user.last_name else ""
 
-    # Add/update user in DB
-    database.add_user(user_id, username, first_name, last_name)
+    # Register new users right away; known users' username/names are refreshed in the background
+    if await async_db.get_user(user_id) is None:
+        await async_db.add_user(user_id, username, first_name, last_name)
+    else:
+        activity.touch(user_id, (username, first_name, last_name))
 
     welcome_message = (
         "🔰 سلام 👋\n"
@@ -78,7 +117,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await update.message.reply_text(welcome_message, reply_markup=keyboard)
     
     # Check if user needs registration details
-    user_data = database.get_user(user_id)
+    user_data = await async_db.get_user(user_id)
     if not user_data.get('phone_number') or not user_data.get('full_name') or not user_data.get('requested_os'):
         await update.message.reply_text("👋 برای استفاده کامل از ربات، لطفاً اطلاعات خود را تکمیل کنید.")
         await ask_contact(update, context) # Start registration flow if incomplete
@@ -102,7 +141,7 @@ async def about_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def show_credit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays user's current credit."""
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if user:
         await update.message.reply_text(f"💰 اعتبار فعلی شما: {user['credit']} تومان")
     else:
@@ -111,7 +150,7 @@ async def show_credit_command(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def show_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays user's registration status and info."""
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if user:
         status_text = (
             f"👤 اطلاعات شما:\n"
@@ -132,6 +171,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels any ongoing conversation."""
     user_id = update.effective_user.id
     logger.info("User %s canceled the conversation.", user_id)
+    await leave_admin_chat(context, user_id)
     await update.message.reply_text(
         "عملیات لغو شد. می‌توانید از منوی اصلی استفاده کنید.",
         reply_markup=await get_main_menu_keyboard(),
@@ -150,6 +190,68 @@ async def show_app_downloads_command(update: Update, context: ContextTypes.DEFAU
     
     await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
+def _read_file(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+async def _connection_guide_entries():
+    """Returns (path, fingerprint, caption) for each guide image present on disk, and the cached file_ids."""
+    entries = []
+    for i, image_name in enumerate(config.CONNECTION_GUIDE['images']):
+        image_path = os.path.join(config.IMAGES_DIR, image_name)
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            logger.warning(f"Image not found: {image_path}")
+            continue
+        caption = config.CONNECTION_GUIDE['captions'][i] if i < len(config.CONNECTION_GUIDE['captions']) else ""
+        entries.append((image_path, f"{stat.st_mtime_ns}:{stat.st_size}", caption))
+    cached = await async_db.get_media_file_ids([path for path, _, _ in entries])
+    return entries, cached
+
+def _is_cached(cached: dict, path: str, fingerprint: str) -> bool:
+    return path in cached and cached[path]['fingerprint'] == fingerprint
+
+async def send_connection_guide(bot, chat_id: int, **kwargs) -> list:
+    """Sends the guide images as a media group, by cached file_id where possible.
+    Images that had to be uploaded get their new file_ids cached. Returns the sent messages."""
+    entries, cached = await _connection_guide_entries()
+    if not entries:
+        return []
+
+    media_group = []
+    uploaded = [] # (index in media group, path, fingerprint)
+    for path, fingerprint, caption in entries:
+        if _is_cached(cached, path, fingerprint):
+            media_group.append(InputMediaPhoto(media=cached[path]['file_id'], caption=caption))
+        else:
+            data = await asyncio.to_thread(_read_file, path)
+            uploaded.append((len(media_group), path, fingerprint))
+            media_group.append(InputMediaPhoto(media=data, caption=caption))
+
+    messages = await bot.send_media_group(chat_id=chat_id, media=media_group, **kwargs)
+    if uploaded:
+        await async_db.save_media_file_ids([
+            (path, fingerprint, messages[index].photo[-1].file_id) for index, path, fingerprint in uploaded
+        ])
+    return messages
+
+async def warm_connection_guide_cache(bot) -> None:
+    """Uploads uncached guide images to the admin chat once, so no user pays the upload cost."""
+    if not config.GUIDE_WARMUP or not ADMIN_ID:
+        return
+    entries, cached = await _connection_guide_entries()
+    if all(_is_cached(cached, path, fingerprint) for path, fingerprint, _ in entries):
+        return
+    try:
+        messages = await send_connection_guide(bot, ADMIN_ID, disable_notification=True)
+        # file_ids stay valid after the messages are deleted
+        for message in messages:
+            await bot.delete_message(chat_id=ADMIN_ID, message_id=message.message_id)
+        logger.info("Connection guide images uploaded and their file_ids cached.")
+    except Exception as e:
+        logger.warning(f"Connection guide warm-up failed: {e}")
+
 async def show_connection_guide(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends connection guide images and captions."""
     query = update.callback_query
@@ -157,19 +259,7 @@ async def show_connection_guide(update: Update, context: ContextTypes.DEFAULT_TY
 
     await query.message.reply_text("لطفاً صبر کنید، راهنمای اتصال در حال ارسال است...")
 
-    media_group = []
-    for i, image_name in enumerate(config.CONNECTION_GUIDE['images']):
-        image_path = os.path.join(config.IMAGES_DIR, image_name)
-        if os.path.exists(image_path):
-            caption = config.CONNECTION_GUIDE['captions'][i] if i < len(config.CONNECTION_GUIDE['captions']) else ""
-            with open(image_path, 'rb') as f:
-                media_group.append(InputMediaPhoto(media=f.read(), caption=caption))
-        else:
-            logger.warning(f"Image not found: {image_path}")
-
-    if media_group:
-        await query.message.reply_media_group(media=media_group)
-    else:
+    if not await send_connection_guide(context.bot, query.message.chat_id):
         await query.message.reply_text("فایل‌های راهنمای اتصال یافت نشدند.")
 
     await query.message.reply_text(config.CONNECTION_GUIDE['additional_note'])
@@ -186,7 +276,7 @@ async def receive_contact(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     phone_number = update.message.contact.phone_number
     
-    database.update_user_info(user_id, phone_number=phone_number)
+    await async_db.update_user_info(user_id, phone_number=phone_number)
     await update.message.reply_text("شماره تماس شما با موفقیت ثبت شد.", reply_markup=ReplyKeyboardRemove())
     await ask_full_name(update, context)
     return config.REQUESTING_FULL_NAME
@@ -199,24 +289,23 @@ async def receive_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     full_name = update.message.text
     
-    database.update_user_info(user_id, full_name=full_name)
+    await async_db.update_user_info(user_id, full_name=full_name)
     await update.message.reply_text("نام کامل شما ثبت شد.")
     await ask_os(update, context)
     return config.SELECTING_OS
 
 async def ask_os(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"os_{value}")] for name, value in config.DEVICE_TYPES.items() if value != "guide"]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("os", value))] for name, value in config.DEVICE_TYPES.items() if value != "guide"]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("لطفاً سیستم عامل دستگاه خود را انتخاب کنید:", reply_markup=reply_markup)
     return config.SELECTING_OS
 
-async def receive_os(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def receive_os(update: Update, context: ContextTypes.DEFAULT_TYPE, selected_os: str) -> int:
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    selected_os = query.data.split('_')[1]
 
-    database.update_user_info(user_id, requested_os=selected_os)
+    await async_db.update_user_info(user_id, requested_os=selected_os)
     await query.edit_message_text(f"سیستم عامل شما ({selected_os}) با موفقیت ثبت شد.\n\nثبت نام شما تکمیل شد! 😊")
     
     await query.message.reply_text("حالا می‌توانید از منوی اصلی استفاده کنید.", reply_markup=await get_main_menu_keyboard())
@@ -226,32 +315,36 @@ async def receive_os(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 # --- User Purchase Flow ---
 async def purchase_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if not user or not user['is_approved']:
         await update.message.reply_text("⚠️ شما هنوز توسط ادمین تأیید نشده‌اید. لطفاً پس از تکمیل ثبت نام، منتظر تأیید ادمین بمانید.")
         return ConversationHandler.END
 
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"account_{key}")] for name, key in config.ACCOUNT_TYPES.items()]
+    # The callback carries the account type name: it is what the request stores and what
+    # config.ACCOUNT_TYPE_DAYS is keyed by (the dict values are prices)
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("account", name))] for name in config.ACCOUNT_TYPES]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("لطفاً نوع اکانت مورد نظر خود را انتخاب کنید:", reply_markup=reply_markup)
     return config.SELECTING_PURCHASE_ACCOUNT_TYPE
 
-async def select_purchase_account_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def select_purchase_account_type(update: Update, context: ContextTypes.DEFAULT_TYPE, account_type_key: str) -> int:
     query = update.callback_query
     await query.answer()
-    account_type_key = query.data.split('_')[1] # e.g., '1 ماهه (30 روز)'
+
+    if account_type_key not in config.ACCOUNT_TYPES: # Button of an outdated /purchase message
+        await query.edit_message_text("این نوع اکانت دیگر موجود نیست. لطفاً دوباره از /purchase شروع کنید.")
+        return ConversationHandler.END
 
     context.user_data['selected_account_type'] = account_type_key
 
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"device_{value}")] for name, value in config.DEVICE_TYPES.items()]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("device", value))] for name, value in config.DEVICE_TYPES.items()]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً سیستم عامل یا نوع دستگاه خود را انتخاب کنید:", reply_markup=reply_markup)
     return config.SELECTING_DEVICE
 
-async def select_device_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def select_device_type(update: Update, context: ContextTypes.DEFAULT_TYPE, device_type_key: str) -> int:
     query = update.callback_query
     await query.answer()
-    device_type_key = query.data.split('_')[1] # e.g., 'android', 'ios', 'guide'
 
     context.user_data['selected_device_type'] = device_type_key
 
@@ -260,15 +353,14 @@ async def select_device_type(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.message.reply_text("حالا می‌توانید ادامه فرآیند خرید را دنبال کنید.", reply_markup=await get_main_menu_keyboard())
         return ConversationHandler.END # End purchase flow if user just wanted guide
 
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"service_{key}")] for name, key in config.SERVICE_TYPES.items()]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("service", key))] for name, key in config.SERVICE_TYPES.items()]
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً نوع سرویس مورد نظر خود را انتخاب کنید:", reply_markup=reply_markup)
     return config.SELECTING_SERVICE
 
-async def select_service_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def select_service_type(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type_key: str) -> int:
     query = update.callback_query
     await query.answer()
-    service_type_key = query.data.split('_')[1] # e.g., 'openvpn', 'v2ray', 'proxy'
 
     selected_account_type = context.user_data.get('selected_account_type')
     selected_device_type = context.user_data.get('selected_device_type')
@@ -280,7 +372,7 @@ async def select_service_type(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = query.from_user.id
     
     # Save the purchase request
-    request_id = database.add_purchase_request(
+    request_id = await async_db.add_purchase_request(
         user_id=user_id,
         account_type=selected_account_type,
         requested_service=service_type_key,
@@ -294,7 +386,7 @@ async def select_service_type(update: Update, context: ContextTypes.DEFAULT_TYPE
             "لطفاً منتظر تأیید و ارسال سرویس توسط ادمین باشید."
         )
         # Notify admin (optional, but good practice)
-        admin_user = database.get_user(ADMIN_ID)
+        admin_user = await async_db.get_user(ADMIN_ID)
         if admin_user:
             await context.bot.send_message(
                 chat_id=ADMIN_ID,
@@ -320,7 +412,7 @@ async def select_service_type(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def discount_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Initiates the discount code entry process."""
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if not user or not user['is_approved']:
         await update.message.reply_text("⚠️ شما هنوز توسط ادمین تأیید نشده‌اید. لطفاً پس از تکمیل ثبت نام، منتظر تأیید ادمین بمانید.")
         return ConversationHandler.END
@@ -333,11 +425,11 @@ async def enter_discount_code(update: Update, context: ContextTypes.DEFAULT_TYPE
     user_id = update.effective_user.id
     code = update.message.text.strip()
 
-    discount = database.get_discount_code(code)
+    discount = await async_db.get_discount_code(code)
     if discount:
-        value = database.use_discount_code(code)
+        value = await async_db.use_discount_code(code)
         if value is not None:
-            database.increase_credit(user_id, value)
+            await async_db.increase_credit(user_id, value)
             await update.message.reply_text(f"✅ کد تخفیف با موفقیت اعمال شد. {value} تومان به اعتبار شما اضافه شد.")
         else:
             await update.message.reply_text("❌ خطایی در اعمال کد تخفیف رخ داد. ممکن است کد قبلاً استفاده شده باشد.")
@@ -350,7 +442,7 @@ async def enter_discount_code(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def transfer_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Initiates credit transfer by asking for receiver ID."""
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if not user or not user['is_approved']:
         await update.message.reply_text("⚠️ شما هنوز توسط ادمین تأیید نشده‌اید و/یا به این قابلیت دسترسی ندارید.")
         return ConversationHandler.END
@@ -362,7 +454,7 @@ async def ask_transfer_amount(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Asks for the amount to transfer."""
     try:
         receiver_id = int(update.message.text.strip())
-        if not database.get_user(receiver_id):
+        if not await async_db.get_user(receiver_id):
             await update.message.reply_text("کاربری با این آیدی یافت نشد. لطفاً آیدی معتبر وارد کنید یا /cancel را بزنید.")
             return config.TRANSFER_USER_ID
         
@@ -383,19 +475,20 @@ async def confirm_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             await update.message.reply_text("مبلغ باید مثبت باشد. لطفاً مبلغ معتبر وارد کنید یا /cancel را بزنید.")
             return config.TRANSFER_AMOUNT
 
-        sender_credit = database.get_user(sender_id)['credit']
-        if sender_credit < amount:
-            await update.message.reply_text(f"اعتبار شما کافی نیست. اعتبار فعلی شما: {sender_credit} تومان. لطفاً مبلغ کمتری وارد کنید یا /cancel را بزنید.")
-            return config.TRANSFER_AMOUNT
-        
-        if database.decrease_credit(sender_id, amount) and database.increase_credit(receiver_id, amount):
-            database.add_credit_transfer(sender_id, receiver_id, amount)
+        # Debit, credit and ledger entry happen in one transaction
+        balances = await async_db.transfer_credit(sender_id, receiver_id, amount)
+        if balances:
+            _, receiver_credit = balances
             await update.message.reply_text(f"✅ {amount} تومان با موفقیت به کاربر {receiver_id} منتقل شد.")
             await context.bot.send_message(
                 chat_id=receiver_id, 
-                text=f"🎁 {amount} تومان اعتبار از طرف کاربر {sender_id} به شما منتقل شد. اعتبار جدید شما: {database.get_user(receiver_id)['credit']} تومان"
+                text=f"🎁 {amount} تومان اعتبار از طرف کاربر {sender_id} به شما منتقل شد. اعتبار جدید شما: {receiver_credit} تومان"
             )
         else:
+            sender = await async_db.get_user(sender_id)
+            if sender and sender['credit'] < amount:
+                await update.message.reply_text(f"اعتبار شما کافی نیست. اعتبار فعلی شما: {sender['credit']} تومان. لطفاً مبلغ کمتری وارد کنید یا /cancel را بزنید.")
+                return config.TRANSFER_AMOUNT
             await update.message.reply_text("❌ خطایی در انتقال اعتبار رخ داد. لطفاً دوباره تلاش کنید.")
     except (ValueError, TypeError):
         await update.message.reply_text("مبلغ نامعتبر است. لطفاً یک عدد وارد کنید یا /cancel را بزنید.")
@@ -407,7 +500,7 @@ async def confirm_transfer(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Initiates the support message entry process."""
     user_id = update.effective_user.id
-    user = database.get_user(user_id)
+    user = await async_db.get_user(user_id)
     if not user or not user['is_approved']:
         await update.message.reply_text("⚠️ شما هنوز توسط ادمین تأیید نشده‌اید و/یا به این قابلیت دسترسی ندارید.")
         return ConversationHandler.END
@@ -420,10 +513,10 @@ async def enter_support_message(update: Update, context: ContextTypes.DEFAULT_TY
     user_id = update.effective_user.id
     message_text = update.message.text.strip()
 
-    if database.add_support_message(user_id, message_text):
+    if await async_db.add_support_message(user_id, message_text):
         await update.message.reply_text("✅ پیام شما به پشتیبانی ارسال شد. در اسرع وقت پاسخ داده خواهد شد.")
         # Notify admin
-        admin_user = database.get_user(ADMIN_ID)
+        admin_user = await async_db.get_user(ADMIN_ID)
         if admin_user:
             await context.bot.send_message(
                 chat_id=ADMIN_ID,
@@ -466,82 +559,100 @@ async def admin_manage_users_menu(update: Update, context: ContextTypes.DEFAULT_
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("🛠 مدیریت کاربران:", reply_markup=reply_markup)
 
-async def view_all_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays a list of all registered users."""
-    query = update.callback_query
-    await query.answer()
+# Admin user browser: one message edited in place, keyset-paginated by user id.
+# callback_data: users_page:<mode>:<next|prev>:<cursor id>
+USER_BROWSER_TITLES = {
+    'all': "👥 لیست همه کاربران",
+    'pending': "⏳ کاربران در انتظار تأیید",
+    'credit': "➕ انتخاب کاربر برای افزایش اعتبار",
+}
+
+async def build_user_browser_page(mode: str, direction: str, cursor: int):
+    """Builds the text and keyboard for one page of the admin user browser."""
+    page_size = config.ADMIN_USERS_PAGE_SIZE
+    pending_only = mode == 'pending'
+    # Fetch one extra row to know whether another page exists in that direction
+    if direction == 'prev':
+        users = await async_db.get_users_page(before_id=cursor, limit=page_size + 1, pending_only=pending_only)
+        has_prev = len(users) > page_size
+        users = users[-page_size:]
+        has_next = True
+    else:
+        users = await async_db.get_users_page(after_id=cursor, limit=page_size + 1, pending_only=pending_only)
+        has_next = len(users) > page_size
+        users = users[:page_size]
+        has_prev = cursor > 0
 
-    users = database.get_all_users()
+    keyboard = []
     if not users:
-        await query.edit_message_text("هیچ کاربری در دیتابیس یافت نشد.")
-        return
-
-    message_text = "لیست همه کاربران:\n\n"
-    for user in users:
-        status = "✅ تأیید شده" if user['is_approved'] else "⏳ در انتظار"
-        message_text += (
-            f"👤 ID: `{user['id']}` (@{user['username']})\n"
-            f"نام: {user['first_name']} {user['last_name']}\n"
-            f"وضعیت: {status}\n"
-            f"اعتبار: {user['credit']} تومان\n"
-            f"تلفن: {user.get('phone_number', 'نامشخص')}\n"
-            f"نام کامل: {user.get('full_name', 'نامشخص')}\n"
-            f"OS: {user.get('requested_os', 'نامشخص')}\n"
-        )
-        # Add Inline button to chat with user
-        keyboard = [[InlineKeyboardButton("💬 چت با این کاربر", callback_data=f"admin_chat_user_{user['id']}")]]
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text=message_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
-        message_text = "" # Clear for next user
-    
-    await query.message.reply_text("پایان لیست کاربران.", reply_markup=await get_admin_panel_keyboard())
+        text = f"{USER_BROWSER_TITLES[mode]}:\n\nکاربری برای نمایش وجود ندارد."
+    else:
+        entries = []
+        for user in users:
+            status = "✅ تأیید شده" if user['is_approved'] else "⏳ در انتظار"
+            entries.append(
+                f"👤 ID: <code>{user['id']}</code> (@{html.escape(str(user['username']))})\n"
+                f"نام: {html.escape(user['first_name'] or '')} {html.escape(user['last_name'] or '')}\n"
+                f"نام کامل: {html.escape(user['full_name'] or 'نامشخص')} | تلفن: {html.escape(user['phone_number'] or 'نامشخص')}\n"
+                f"OS: {html.escape(user['requested_os'] or 'نامشخص')} | وضعیت: {status} | اعتبار: {user['credit']} تومان"
+            )
+            # Action buttons for the users on this page only
+            if mode == 'pending':
+                keyboard.append([
+                    InlineKeyboardButton(f"✅ {user['id']}", callback_data=callback_data("approve_user", user['id'])),
+                    InlineKeyboardButton(f"❌ {user['id']}", callback_data=callback_data("reject_user", user['id'])),
+                    InlineKeyboardButton(f"💬 {user['id']}", callback_data=callback_data("admin_chat_user", user['id'])),
+                ])
+            elif mode == 'credit':
+                keyboard.append([InlineKeyboardButton(f"➕ افزایش اعتبار {user['id']}", callback_data=callback_data("admin_select_user_for_add_credit", user['id']))])
+            else:
+                keyboard.append([InlineKeyboardButton(f"💬 چت با {user['id']}", callback_data=callback_data("admin_chat_user", user['id']))])
+        text = f"{USER_BROWSER_TITLES[mode]}:\n\n" + "\n\n".join(entries)
+
+    navigation = []
+    if has_prev and users:
+        navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=callback_data("users_page", mode, "prev", users[0]['id'])))
+    elif has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=callback_data("users_page", mode, "prev", cursor)))
+    if has_next and users:
+        navigation.append(InlineKeyboardButton("بعدی ➡️", callback_data=callback_data("users_page", mode, "next", users[-1]['id'])))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_users")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_user_browser(update: Update, mode: str, direction: str = 'next', cursor: int = 0) -> None:
+    """Renders a user browser page into the callback query's message."""
+    query = update.callback_query
+    text, reply_markup = await build_user_browser_page(mode, direction, cursor)
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='HTML')
 
+async def view_all_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays the first page of all registered users."""
+    query = update.callback_query
+    await query.answer()
+    await show_user_browser(update, 'all')
 
 async def view_pending_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Displays a list of users awaiting approval."""
+    """Displays the first page of users awaiting approval."""
     query = update.callback_query
     await query.answer()
+    await show_user_browser(update, 'pending')
 
-    pending_users = database.get_pending_users()
-    if not pending_users:
-        await query.edit_message_text("هیچ کاربری در انتظار تأیید نیست.")
+async def user_browser_page(update: Update, context: ContextTypes.DEFAULT_TYPE, mode: str, direction: str, cursor: int) -> None:
+    """Handles next/prev navigation in the admin user browser."""
+    query = update.callback_query
+    await query.answer()
+    if mode not in USER_BROWSER_TITLES:
         return
+    await show_user_browser(update, mode, direction, cursor)
 
-    message_text = "کاربران در انتظار تأیید:\n\n"
-    for user in pending_users:
-        message_text += (
-            f"👤 ID: `{user['id']}` (@{user['username']})\n"
-            f"نام: {user['first_name']} {user['last_name']}\n"
-            f"شماره تماس: {user.get('phone_number', 'نامشخص')}\n"
-            f"نام کامل: {user.get('full_name', 'نامشخص')}\n"
-            f"OS: {user.get('requested_os', 'نامشخص')}\n"
-        )
-        keyboard = [
-            [InlineKeyboardButton("✅ تأیید", callback_data=f"approve_user_{user['id']}"),
-             InlineKeyboardButton("❌ رد", callback_data=f"reject_user_{user['id']}")],
-            [InlineKeyboardButton("💬 چت با این کاربر", callback_data=f"admin_chat_user_{user['id']}")],
-        ]
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text=message_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
-        message_text = ""
-    
-    await query.message.reply_text("پایان لیست کاربران در انتظار.", reply_markup=await get_admin_panel_keyboard())
-
-async def approve_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def approve_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id_to_approve: int) -> None:
     """Approves a selected user."""
     query = update.callback_query
     await query.answer()
-    user_id_to_approve = int(query.data.split('_')[2])
 
-    if database.approve_user(user_id_to_approve):
+    if await async_db.approve_user(user_id_to_approve):
         await query.edit_message_text(f"✅ کاربر {user_id_to_approve} تأیید شد.")
         await context.bot.send_message(
             chat_id=user_id_to_approve,
@@ -552,13 +663,12 @@ async def approve_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.edit_message_text(f"❌ خطایی در تأیید کاربر {user_id_to_approve} رخ داد.")
     await query.message.reply_text("به پنل ادمین بازگشتیم.", reply_markup=await get_admin_panel_keyboard())
 
-async def reject_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def reject_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id_to_reject: int) -> None:
     """Rejects a selected user."""
     query = update.callback_query
     await query.answer()
-    user_id_to_reject = int(query.data.split('_')[2])
 
-    if database.reject_user(user_id_to_reject):
+    if await async_db.reject_user(user_id_to_reject):
         await query.edit_message_text(f"❌ کاربر {user_id_to_reject} رد شد.")
         await context.bot.send_message(
             chat_id=user_id_to_reject,
@@ -568,37 +678,17 @@ async def reject_user_action(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await query.edit_message_text(f"❌ خطایی در رد کاربر {user_id_to_reject} رخ داد.")
     await query.message.reply_text("به پنل ادمین بازگشتیم.", reply_markup=await get_admin_panel_keyboard())
 
-async def admin_add_credit_to_user_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Prompts admin to enter user ID for credit addition."""
+async def admin_add_credit_to_user_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Displays the user browser with per-user credit buttons."""
     query = update.callback_query
     await query.answer()
-    
-    users = database.get_all_users()
-    if not users:
-        await query.edit_message_text("هیچ کاربری در دیتابیس یافت نشد.")
-        return ConversationHandler.END
-
-    message_text = "لیست کاربران برای افزایش اعتبار:\n\n"
-    for user in users:
-        message_text += f"👤 ID: `{user['id']}` (@{user['username']}) - اعتبار: {user['credit']} تومان\n"
-        keyboard = [[InlineKeyboardButton("➕ افزایش اعتبار", callback_data=f"admin_select_user_for_add_credit_{user['id']}")]]
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text=message_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
-        message_text = ""
-    
-    await query.message.reply_text("برای افزایش اعتبار کاربر مورد نظر را انتخاب کنید:", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_users")]]))
-    return config.ADMIN_SELECT_USER_FOR_ACTION
+    await show_user_browser(update, 'credit')
 
 
-async def ask_user_add_credit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def ask_user_add_credit(update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int) -> int:
     """Callback handler to get user ID for credit addition."""
     query = update.callback_query
     await query.answer()
-    target_user_id = int(query.data.split('_')[5]) # admin_select_user_for_add_credit_USER_ID
 
     context.user_data['target_user_id_for_credit'] = target_user_id
     await query.edit_message_text(f"لطفاً مبلغ اعتبار (به تومان) را برای کاربر {target_user_id} وارد کنید:")
@@ -617,11 +707,11 @@ async def do_add_credit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
             await update.message.reply_text("مبلغ باید مثبت باشد. لطفاً یک عدد معتبر وارد کنید.")
             return config.ADMIN_USER_ADD_CREDIT_AMOUNT
 
-        if database.increase_credit(target_user_id, amount):
+        if await async_db.increase_credit(target_user_id, amount):
             await update.message.reply_text(f"✅ {amount} تومان به اعتبار کاربر {target_user_id} اضافه شد.")
             await context.bot.send_message(
                 chat_id=target_user_id,
-                text=f"🎁 {amount} تومان اعتبار به حساب شما توسط ادمین اضافه شد. اعتبار جدید شما: {database.get_user(target_user_id)['credit']} تومان"
+                text=f"🎁 {amount} تومان اعتبار به حساب شما توسط ادمین اضافه شد. اعتبار جدید شما: {(await async_db.get_user(target_user_id))['credit']} تومان"
             )
         else:
             await update.message.reply_text("❌ خطایی در افزایش اعتبار رخ داد.")
@@ -645,6 +735,7 @@ async def admin_manage_services_menu(update: Update, context: ContextTypes.DEFAU
         [InlineKeyboardButton("🗑 حذف سرویس", callback_data="admin_delete_service_ask")],
         [InlineKeyboardButton("📋 مشاهده همه سرویس‌ها", callback_data="admin_view_all_services")],
         [InlineKeyboardButton("💲 مشاهده قیمت سرویس‌ها", callback_data="admin_view_all_service_prices")],
+        [InlineKeyboardButton("📦 انبار سرویس‌ها", callback_data="admin_inventory")],
         [InlineKeyboardButton("↩️ بازگشت به پنل اصلی", callback_data="admin_main_menu")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -655,17 +746,16 @@ async def admin_set_service_type_ask(update: Update, context: ContextTypes.DEFAU
     query = update.callback_query
     await query.answer()
     
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"set_service_type_{key}")] for name, key in config.SERVICE_TYPES.items()]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("set_service_type", key))] for name, key in config.SERVICE_TYPES.items()]
     keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_services")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً نوع سرویسی که می‌خواهید محتوایش را تنظیم یا بروزرسانی کنید را انتخاب کنید:", reply_markup=reply_markup)
     return config.ADMIN_SET_SERVICE
 
-async def admin_set_service_content_or_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def admin_set_service_content_or_file(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type: str) -> int:
     """Asks admin if content is text or file."""
     query = update.callback_query
     await query.answer()
-    service_type = query.data.split('_')[3] # set_service_type_openvpn
 
     context.user_data['service_type_to_set'] = service_type
 
@@ -691,7 +781,7 @@ async def process_service_text_content(update: Update, context: ContextTypes.DEF
     service_type = context.user_data.get('service_type_to_set')
     content = update.message.text.strip()
 
-    if database.set_service(service_type, content, is_file=False):
+    if await async_db.set_service(service_type, content, is_file=False):
         await update.message.reply_text(f"✅ محتوای متنی سرویس {service_type} با موفقیت تنظیم شد.")
     else:
         await update.message.reply_text(f"❌ خطایی در تنظیم محتوای سرویس {service_type} رخ داد.")
@@ -720,7 +810,7 @@ async def process_service_file_content(update: Update, context: ContextTypes.DEF
     
     # Save file to a local directory for later use if needed, or just save file_id
     # For now, we will save file_id as content
-    if database.set_service(service_type, file_id, is_file=True, file_name=file_name):
+    if await async_db.set_service(service_type, file_id, is_file=True, file_name=file_name):
         await update.message.reply_text(f"✅ فایل سرویس {service_type} با موفقیت ذخیره شد. (File ID: `{file_id}`)", parse_mode='Markdown')
     else:
         await update.message.reply_text(f"❌ خطایی در ذخیره فایل سرویس {service_type} رخ داد.")
@@ -734,17 +824,16 @@ async def admin_set_service_price_ask(update: Update, context: ContextTypes.DEFA
     query = update.callback_query
     await query.answer()
     
-    keyboard = [[InlineKeyboardButton(name, callback_data=f"set_price_type_{key}")] for name, key in config.SERVICE_TYPES.items()]
+    keyboard = [[InlineKeyboardButton(name, callback_data=callback_data("set_price_type", key))] for name, key in config.SERVICE_TYPES.items()]
     keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_services")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً نوع سرویسی که می‌خواهید قیمتش را تنظیم کنید را انتخاب کنید:", reply_markup=reply_markup)
     return config.ADMIN_SET_SERVICE_PRICE_TYPE
 
-async def admin_set_service_price_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def admin_set_service_price_value(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type: str) -> int:
     """Asks admin to input price value for selected service type."""
     query = update.callback_query
     await query.answer()
-    service_type = query.data.split('_')[3] # set_price_type_openvpn
 
     context.user_data['service_type_for_price'] = service_type
     await query.edit_message_text(f"لطفاً قیمت (به تومان) برای سرویس {service_type} را وارد کنید:")
@@ -759,7 +848,7 @@ async def process_service_price_value(update: Update, context: ContextTypes.DEFA
             await update.message.reply_text("قیمت نمی‌تواند منفی باشد. لطفا مبلغ معتبری وارد کنید.")
             return config.ADMIN_SET_SERVICE_PRICE_VALUE
 
-        if database.set_service_price(service_type, price):
+        if await async_db.set_service_price(service_type, price):
             await update.message.reply_text(f"✅ قیمت سرویس {service_type} به {price} تومان تنظیم شد.")
         else:
             await update.message.reply_text(f"❌ خطایی در تنظیم قیمت سرویس {service_type} رخ داد.")
@@ -776,24 +865,23 @@ async def admin_delete_service_ask(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
 
-    services = database.get_all_services()
+    services = await async_db.get_all_services()
     if not services:
         await query.edit_message_text("هیچ سرویسی برای حذف یافت نشد.")
         return ConversationHandler.END
     
-    keyboard = [[InlineKeyboardButton(f"🗑 {s['type']}", callback_data=f"delete_service_{s['type']}")] for s in services]
+    keyboard = [[InlineKeyboardButton(f"🗑 {s['type']}", callback_data=callback_data("delete_service", s['type']))] for s in services]
     keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_services")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً سرویسی که می‌خواهید حذف کنید را انتخاب کنید:", reply_markup=reply_markup)
     return config.ADMIN_DELETE_DISCOUNT # Using a generic state, can define a new one if needed
 
-async def do_delete_service(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def do_delete_service(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type_to_delete: str) -> int:
     """Deletes the selected service."""
     query = update.callback_query
     await query.answer()
-    service_type_to_delete = query.data.split('_')[2] # delete_service_openvpn
 
-    if database.delete_service(service_type_to_delete):
+    if await async_db.delete_service(service_type_to_delete):
         await query.edit_message_text(f"✅ سرویس {service_type_to_delete} با موفقیت حذف شد.")
     else:
         await query.edit_message_text(f"❌ خطایی در حذف سرویس {service_type_to_delete} رخ داد.")
@@ -805,7 +893,7 @@ async def view_all_services_command(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     await query.answer()
 
-    services = database.get_all_services()
+    services = await async_db.get_all_services()
     if not services:
         await query.edit_message_text("هیچ سرویسی در دیتابیس تعریف نشده است.")
         return
@@ -823,7 +911,7 @@ async def view_all_service_prices_command(update: Update, context: ContextTypes.
     query = update.callback_query
     await query.answer()
 
-    prices = database.get_all_service_prices()
+    prices = await async_db.get_all_service_prices()
     if not prices:
         await query.edit_message_text("هیچ قیمتی برای سرویس‌ها تعریف نشده است.")
         return
@@ -835,6 +923,64 @@ async def view_all_service_prices_command(update: Update, context: ContextTypes.
     await query.edit_message_text(message_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_services")]]))
 
 
+# Admin Credential Inventory
+async def admin_inventory_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Shows the unclaimed stock per service type with import buttons."""
+    query = update.callback_query
+    await query.answer()
+
+    stock = await inventory.refresh_stock_metrics()
+    message_text = "📦 موجودی انبار سرویس‌ها:\n\n"
+    keyboard = []
+    for name, service_type in config.SERVICE_TYPES.items():
+        count = stock.get(service_type, 0)
+        warning = " ⚠️" if count <= config.INVENTORY_LOW_STOCK else ""
+        message_text += f"{name}: {count} مورد{warning}\n"
+        keyboard.append([InlineKeyboardButton(f"➕ افزودن به انبار {name}", callback_data=callback_data("inventory_import", service_type))])
+    keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_manage_services")])
+    await query.edit_message_text(message_text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def ask_inventory_file(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type: str) -> int:
+    """Asks the admin for a file of credentials for one service type."""
+    query = update.callback_query
+    await query.answer()
+    context.user_data['inventory_service_type'] = service_type
+    await query.edit_message_text(
+        f"فایل موجودی سرویس {service_type} را ارسال کنید:\n"
+        "• فایل متنی: هر خط یک اکانت/لینک\n"
+        "• فایل zip: هر فایل داخل آن یک کانفیگ\n"
+        "موارد تکراری نادیده گرفته می‌شوند. برای لغو /cancel را بزنید."
+    )
+    return config.ADMIN_INVENTORY_IMPORT_FILE
+
+async def receive_inventory_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Downloads the uploaded file and streams its items into the inventory."""
+    service_type = context.user_data.pop('inventory_service_type', None)
+    if not service_type:
+        await update.message.reply_text("خطا: نوع سرویس مشخص نیست. لطفاً دوباره از منوی انبار شروع کنید.")
+        return ConversationHandler.END
+
+    progress = await update.message.reply_text("⏳ در حال وارد کردن موجودی...")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "inventory")
+        try:
+            telegram_file = await update.message.document.get_file()
+            await telegram_file.download_to_drive(path)
+            added, read = await async_db.run(inventory.import_file, path, service_type)
+        except Exception as e:
+            logger.error(f"Inventory import for {service_type} failed: {e}")
+            await progress.edit_text(f"❌ خطا در وارد کردن فایل: {e}")
+            return ConversationHandler.END
+
+    stock = await inventory.refresh_stock_metrics()
+    await progress.edit_text(
+        f"✅ {added} مورد به انبار {service_type} اضافه شد ({read - added} مورد تکراری).\n"
+        f"موجودی فعلی: {stock.get(service_type, 0)}",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📦 بازگشت به انبار", callback_data="admin_inventory")]])
+    )
+    return ConversationHandler.END
+
+
 # Admin Discount Codes
 async def admin_discount_codes_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays discount code management options."""
@@ -867,7 +1013,7 @@ async def do_add_discount_code(update: Update, context: ContextTypes.DEFAULT_TYP
         code = parts[0]
         value = int(parts[1])
 
-        if database.add_discount_code(code, value):
+        if await async_db.add_discount_code(code, value):
             await update.message.reply_text(f"✅ کد تخفیف '{code}' با مقدار {value} با موفقیت اضافه شد.")
         else:
             await update.message.reply_text(f"❌ کد تخفیف '{code}' از قبل وجود دارد یا خطایی رخ داد.")
@@ -882,24 +1028,23 @@ async def ask_delete_discount_code(update: Update, context: ContextTypes.DEFAULT
     query = update.callback_query
     await query.answer()
     
-    codes = database.get_all_discount_codes()
+    codes = await async_db.get_all_discount_codes()
     if not codes:
         await query.edit_message_text("هیچ کد تخفیفی برای حذف یافت نشد.")
         return ConversationHandler.END
     
-    keyboard = [[InlineKeyboardButton(f"🗑 {c['code']} (Val:{c['value']})", callback_data=f"delete_code_{c['code']}")] for c in codes]
+    keyboard = [[InlineKeyboardButton(f"🗑 {c['code']} (Val:{c['value']})", callback_data=callback_data("delete_code", c['code']))] for c in codes]
     keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_discount_codes")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً کد تخفیفی که می‌خواهید حذف کنید را انتخاب کنید:", reply_markup=reply_markup)
     return config.ADMIN_DELETE_DISCOUNT
 
-async def do_delete_discount_code(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def do_delete_discount_code(update: Update, context: ContextTypes.DEFAULT_TYPE, code_to_delete: str) -> int:
     """Deletes the selected discount code."""
     query = update.callback_query
     await query.answer()
-    code_to_delete = query.data.split('_')[2]
 
-    if database.delete_discount_code(code_to_delete):
+    if await async_db.delete_discount_code(code_to_delete):
         await query.edit_message_text(f"✅ کد تخفیف '{code_to_delete}' با موفقیت حذف شد.")
     else:
         await query.edit_message_text(f"❌ خطایی در حذف کد تخفیف '{code_to_delete}' رخ داد.")
@@ -911,7 +1056,7 @@ async def view_all_discount_codes_command(update: Update, context: ContextTypes.
     query = update.callback_query
     await query.answer()
 
-    codes = database.get_all_discount_codes()
+    codes = await async_db.get_all_discount_codes()
     if not codes:
         await query.edit_message_text("هیچ کد تخفیفی در دیتابیس یافت نشد.")
         return
@@ -931,6 +1076,7 @@ async def admin_requests_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     keyboard = [
         [InlineKeyboardButton("⏳ مشاهده درخواست‌های در انتظار", callback_data="admin_view_pending_requests")],
         [InlineKeyboardButton("✅ مشاهده درخواست‌های تأیید شده", callback_data="admin_view_approved_requests")],
+        [InlineKeyboardButton("🗂 تأیید/رد گروهی درخواست‌ها", callback_data=callback_data("bulk_requests", "next", 0))],
         [InlineKeyboardButton("↩️ بازگشت به پنل اصلی", callback_data="admin_main_menu")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -941,15 +1087,14 @@ async def view_pending_requests_command(update: Update, context: ContextTypes.DE
     query = update.callback_query
     await query.answer()
 
-    requests = database.get_purchase_requests_by_status('pending')
+    requests = await async_db.get_purchase_requests_with_users('pending')
     if not requests:
         await query.edit_message_text("هیچ درخواست خرید در انتظاری یافت نشد.")
         return
     
     message_text = "درخواست‌های خرید در انتظار:\n\n"
     for req in requests:
-        user = database.get_user(req['user_id'])
-        username = user['username'] if user else 'نامشخص'
+        username = req['username'] or 'نامشخص'
         message_text = (
             f"🛒 درخواست #{req['id']}\n"
             f"کاربر: `{req['user_id']}` (@{username})\n"
@@ -959,9 +1104,9 @@ async def view_pending_requests_command(update: Update, context: ContextTypes.DE
             f"تاریخ درخواست: {req['request_date'].split('T')[0]}\n"
         )
         keyboard = [
-            [InlineKeyboardButton("✅ تأیید و ارسال سرویس", callback_data=f"process_request_approve_{req['id']}")],
-            [InlineKeyboardButton("❌ رد کردن درخواست", callback_data=f"process_request_reject_{req['id']}")],
-            [InlineKeyboardButton("💬 چت با این کاربر", callback_data=f"admin_chat_user_{req['user_id']}")],
+            [InlineKeyboardButton("✅ تأیید و ارسال سرویس", callback_data=callback_data("process_request", "approve", req['id']))],
+            [InlineKeyboardButton("❌ رد کردن درخواست", callback_data=callback_data("process_request", "reject", req['id']))],
+            [InlineKeyboardButton("💬 چت با این کاربر", callback_data=callback_data("admin_chat_user", req['user_id']))],
         ]
         await context.bot.send_message(
             chat_id=query.from_user.id,
@@ -977,15 +1122,14 @@ async def view_approved_requests_command(update: Update, context: ContextTypes.D
     query = update.callback_query
     await query.answer()
 
-    requests = database.get_purchase_requests_by_status('approved')
+    requests = await async_db.get_purchase_requests_with_users('approved')
     if not requests:
         await query.edit_message_text("هیچ درخواست خرید تأیید شده‌ای یافت نشد.")
         return
     
     message_text = "درخواست‌های خرید تأیید شده:\n\n"
     for req in requests:
-        user = database.get_user(req['user_id'])
-        username = user['username'] if user else 'نامشخص'
+        username = req['username'] or 'نامشخص'
         message_text += (
             f"🛒 درخواست #{req['id']}\n"
             f"کاربر: `{req['user_id']}` (@{username})\n"
@@ -993,38 +1137,49 @@ async def view_approved_requests_command(update: Update, context: ContextTypes.D
             f"سرویس درخواستی: {req['requested_service']}\n"
             f"دستگاه درخواستی: {req['requested_device']}\n"
             f"تاریخ درخواست: {req['request_date'].split('T')[0]}\n"
-            f"وضعیت: {req['status']}\n\n"
         )
+        if req['expires_at']:
+            message_text += f"تاریخ انقضا: {req['expires_at'].split('T')[0]}\n"
+        message_text += f"وضعیت: {req['status']}\n\n"
     await query.edit_message_text(message_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data="admin_requests")]]))
 
-async def process_request_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Processes a purchase request (approves or rejects)."""
+async def process_request_command(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, request_id: int) -> int:
+    """Processes a purchase request (action is 'approve' or 'reject')."""
     query = update.callback_query
     await query.answer()
-    
-    parts = query.data.split('_')
-    action = parts[2] # 'approve' or 'reject'
-    request_id = int(parts[3])
 
-    req = database.get_purchase_request_by_id(request_id)
+    req = await async_db.get_purchase_request_by_id(request_id)
     if not req:
         await query.edit_message_text("درخواست خرید یافت نشد.")
         return ConversationHandler.END
     
     user_id_to_notify = req['user_id']
 
+    # Only a pending request changes, so a second click (or a bulk action in between) cannot
+    # deliver the service or notify the user twice
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    if not await async_db.update_purchase_requests_status([request_id], new_status):
+        await query.edit_message_text(f"درخواست خرید #{request_id} قبلاً بررسی شده است (وضعیت فعلی: {req['status']}).")
+        return ConversationHandler.END
+
     if action == 'approve':
-        database.update_purchase_request_status(request_id, 'approved')
-        await query.edit_message_text(f"✅ درخواست خرید #{request_id} تأیید شد.\nحالا سرویس را برای کاربر ارسال کنید.")
+        await subscriptions.schedule(context.job_queue)
+        service_type = req['requested_service']
+        outcome = await inventory.deliver(context.bot, request_id, user_id_to_notify, service_type)
+        if outcome == 'delivered':
+            await query.edit_message_text(f"✅ درخواست خرید #{request_id} تأیید شد و سرویس {service_type} از انبار برای کاربر ارسال شد.")
+            return ConversationHandler.END
+        reason = "موجودی انبار این سرویس تمام شده است." if outcome == 'out_of_stock' else "ارسال خودکار از انبار ناموفق بود."
+        await query.edit_message_text(f"✅ درخواست خرید #{request_id} تأیید شد.\n{reason}\nحالا سرویس را برای کاربر ارسال کنید.")
         
         # Start guided service delivery
         context.user_data['service_delivery_target_user_id'] = user_id_to_notify
         context.user_data['service_delivery_request_id'] = request_id
+        context.user_data['service_delivery_service_type'] = service_type
         await start_service_delivery_after_approval(update, context) # Call the function directly
         return config.ADMIN_DELIVERING_SERVICE_CHOOSE_METHOD # Transition to service delivery state
 
     elif action == 'reject':
-        database.update_purchase_request_status(request_id, 'rejected')
         await query.edit_message_text(f"❌ درخواست خرید #{request_id} رد شد.")
         await context.bot.send_message(
             chat_id=user_id_to_notify,
@@ -1033,13 +1188,129 @@ async def process_request_command(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END # End the process for now, return to main admin menu or previous state
 
 
+# Bulk approve/reject: the admin ticks pending requests page by page (selection kept in
+# user_data), then one transaction updates them all and the users are notified in the background
+async def bulk_requests_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction: str, cursor: int) -> None:
+    """Shows one page of pending purchase requests with selection toggles (keyset paging by request id)."""
+    query = update.callback_query
+    await query.answer()
+
+    page_size = config.ADMIN_REQUESTS_PAGE_SIZE
+    # Fetch one extra row to know whether another page exists in that direction
+    if direction == 'prev':
+        requests = await async_db.get_purchase_requests_page('pending', before_id=cursor, limit=page_size + 1)
+        has_prev = len(requests) > page_size
+        requests = requests[-page_size:]
+        has_next = True
+    else:
+        requests = await async_db.get_purchase_requests_page('pending', after_id=cursor, limit=page_size + 1)
+        has_next = len(requests) > page_size
+        requests = requests[:page_size]
+        has_prev = cursor > 0
+    selected = context.user_data.setdefault('bulk_selected_requests', set())
+    if not requests:
+        await query.edit_message_text(
+            "هیچ درخواست خرید در انتظاری یافت نشد.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data="admin_requests")]])
+        )
+        return
+
+    # Redrawing a page after a toggle starts again just before its first request
+    anchor = requests[0]['id'] - 1
+    keyboard = []
+    for req in requests:
+        mark = "✅" if req['id'] in selected else "⬜"
+        keyboard.append([InlineKeyboardButton(
+            f"{mark} #{req['id']} | {req['user_id']} | {req['account_type']}",
+            callback_data=callback_data("bulk_toggle", anchor, req['id'])
+        )])
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=callback_data("bulk_requests", "prev", requests[0]['id'])))
+    if has_next:
+        navigation.append(InlineKeyboardButton("بعدی ➡️", callback_data=callback_data("bulk_requests", "next", requests[-1]['id'])))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([
+        InlineKeyboardButton("☑️ این صفحه", callback_data=callback_data("bulk_select", "page", anchor)),
+        InlineKeyboardButton("☑️ همه", callback_data=callback_data("bulk_select", "all", anchor)),
+        InlineKeyboardButton("✖️ هیچ", callback_data=callback_data("bulk_select", "none", anchor)),
+    ])
+    keyboard.append([
+        InlineKeyboardButton(f"✅ تأیید ({len(selected)})", callback_data=callback_data("bulk_process", "approve")),
+        InlineKeyboardButton(f"❌ رد ({len(selected)})", callback_data=callback_data("bulk_process", "reject")),
+    ])
+    keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_requests")])
+    await query.edit_message_text(
+        f"🗂 تأیید/رد گروهی درخواست‌های در انتظار\n"
+        f"درخواست‌های #{requests[0]['id']} تا #{requests[-1]['id']} | انتخاب شده: {len(selected)}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def bulk_toggle_request(update: Update, context: ContextTypes.DEFAULT_TYPE, anchor: int, request_id: int) -> None:
+    """Selects or unselects one request and redraws the page."""
+    selected = context.user_data.setdefault('bulk_selected_requests', set())
+    selected.symmetric_difference_update({request_id})
+    await bulk_requests_page(update, context, 'next', anchor)
+
+async def bulk_select_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, scope: str, anchor: int) -> None:
+    """Selects the requests of the current page or all pending requests, or clears the selection.
+    Requests handled meanwhile stay selected; the conditional update skips them."""
+    selected = context.user_data.setdefault('bulk_selected_requests', set())
+    if scope == 'none':
+        selected.clear()
+    elif scope == 'page':
+        page = await async_db.get_purchase_requests_page('pending', after_id=anchor, limit=config.ADMIN_REQUESTS_PAGE_SIZE)
+        selected.update(req['id'] for req in page)
+    else:
+        selected.update(await async_db.get_purchase_request_ids('pending'))
+    await bulk_requests_page(update, context, 'next', anchor)
+
+async def bulk_process_requests(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+    """Approves or rejects every selected request in one transaction and notifies the users."""
+    query = update.callback_query
+    selected = context.user_data.get('bulk_selected_requests')
+    if not selected or action not in ('approve', 'reject'):
+        await query.answer("هیچ درخواستی انتخاب نشده است.", show_alert=True)
+        return
+    await query.answer()
+
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    changed = await async_db.update_purchase_requests_status(list(selected), new_status)
+    skipped = len(selected) - len(changed)
+    selected.clear()
+
+    if action == 'approve':
+        header = f"✅ {len(changed)} درخواست خرید تأیید شد."
+        template = "✅ درخواست خرید شما (شماره #{}) تأیید شد. سرویس به‌زودی برای شما ارسال می‌شود."
+    else:
+        header = f"❌ {len(changed)} درخواست خرید رد شد."
+        template = "❌ درخواست خرید شما (شماره #{}) توسط ادمین رد شد. لطفاً در صورت نیاز با پشتیبانی تماس بگیرید."
+    if skipped:
+        header += f"\n{skipped} درخواست قبلاً بررسی شده بود و تغییری نکرد."
+
+    if not changed:
+        await query.edit_message_text(header)
+        return
+    await query.edit_message_text(f"{header}\n📨 در حال ارسال اطلاع‌رسانی به کاربران...")
+    if action == 'approve':
+        await subscriptions.schedule(context.job_queue)
+        # Deliver from the inventory; users left without an item get the approval notice
+        broadcast.spawn(inventory.deliver_and_report(
+            context.bot, changed, query.message.chat_id, query.message.message_id, header, template
+        ))
+        return
+    notifications = [(user_id, template.format(request_id)) for request_id, user_id, _ in changed]
+    broadcast.start_notifications(context.bot, notifications, query.message.chat_id, query.message.message_id, header)
+
+
 # Admin Statistics
 async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Displays bot statistics."""
     query = update.callback_query
     await query.answer()
 
-    stats = database.get_bot_statistics()
+    stats = await async_db.get_bot_statistics()
     if not stats:
         await query.edit_message_text("خطا در دریافت آمار ربات.")
         return
@@ -1075,15 +1346,14 @@ async def view_unanswered_support_messages_command(update: Update, context: Cont
     query = update.callback_query
     await query.answer()
 
-    messages = database.get_support_messages(answered=False)
+    messages = await async_db.get_support_messages_with_users(answered=False)
     if not messages:
         await query.edit_message_text("هیچ پیام پشتیبانی بی‌پاسخی یافت نشد.")
         return
     
     await query.edit_message_text("پیام‌های پشتیبانی بی‌پاسخ:")
     for msg in messages:
-        user = database.get_user(msg['user_id'])
-        username = user['username'] if user else 'نامشخص'
+        username = msg['username'] or 'نامشخص'
         message_text = (
             f"🆔 پیام #{msg['id']}\n"
             f"کاربر: `{msg['user_id']}` (@{username})\n"
@@ -1091,8 +1361,8 @@ async def view_unanswered_support_messages_command(update: Update, context: Cont
             f"متن: \"{msg['message_text']}\""
         )
         keyboard = [
-            [InlineKeyboardButton("✅ علامت‌گذاری به عنوان پاسخ داده شده", callback_data=f"mark_support_answered_{msg['id']}")],
-            [InlineKeyboardButton("💬 پاسخ به این کاربر", callback_data=f"admin_chat_user_{msg['user_id']}")], # Reuse chat function
+            [InlineKeyboardButton("✅ علامت‌گذاری به عنوان پاسخ داده شده", callback_data=callback_data("mark_support_answered", msg['id']))],
+            [InlineKeyboardButton("💬 پاسخ به این کاربر", callback_data=callback_data("admin_chat_user", msg['user_id']))], # Reuse chat function
         ]
         await context.bot.send_message(
             chat_id=query.from_user.id,
@@ -1107,15 +1377,14 @@ async def view_all_support_messages_command(update: Update, context: ContextType
     query = update.callback_query
     await query.answer()
 
-    messages = database.get_support_messages(answered=None) # Get all
+    messages = await async_db.get_support_messages_with_users(answered=None) # Get all
     if not messages:
         await query.edit_message_text("هیچ پیام پشتیبانی یافت نشد.")
         return
     
     await query.edit_message_text("همه پیام‌های پشتیبانی:")
     for msg in messages:
-        user = database.get_user(msg['user_id'])
-        username = user['username'] if user else 'نامشخص'
+        username = msg['username'] or 'نامشخص'
         status = "✅ پاسخ داده شده" if msg['is_answered'] else "⏳ بی‌پاسخ"
         message_text = (
             f"🆔 پیام #{msg['id']}\n"
@@ -1125,7 +1394,7 @@ async def view_all_support_messages_command(update: Update, context: ContextType
             f"متن: \"{msg['message_text']}\""
         )
         keyboard = [
-            [InlineKeyboardButton("💬 چت با این کاربر", callback_data=f"admin_chat_user_{msg['user_id']}")],
+            [InlineKeyboardButton("💬 چت با این کاربر", callback_data=callback_data("admin_chat_user", msg['user_id']))],
         ]
         await context.bot.send_message(
             chat_id=query.from_user.id,
@@ -1136,13 +1405,12 @@ async def view_all_support_messages_command(update: Update, context: ContextType
     await query.message.reply_text("پایان لیست پیام‌های پشتیبانی.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data="admin_support")]]))
 
 
-async def mark_support_message_answered_action(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def mark_support_message_answered_action(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id: int) -> None:
     """Marks a support message as answered."""
     query = update.callback_query
     await query.answer()
-    message_id = int(query.data.split('_')[3]) # mark_support_answered_MESSAGE_ID
 
-    if database.mark_support_message_answered(message_id):
+    if await async_db.mark_support_message_answered(message_id):
         await query.edit_message_text(f"✅ پیام پشتیبانی #{message_id} به عنوان پاسخ داده شده علامت‌گذاری شد.")
     else:
         await query.edit_message_text(f"❌ خطایی در علامت‌گذاری پیام #{message_id} رخ داد.")
@@ -1161,42 +1429,33 @@ async def ask_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     return config.ADMIN_BROADCAST_MESSAGE
 
 async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Sends the broadcast message to all users."""
+    """Starts a background broadcast job to all users; progress is edited into one admin message."""
     broadcast_message = update.message.text.strip()
-    
-    users = database.get_all_users()
-    sent_count = 0
-    failed_count = 0
-    
-    await update.message.reply_text("در حال ارسال پیام همگانی...")
 
-    for user in users:
-        try:
-            await context.bot.send_message(chat_id=user['id'], text=f"📢 پیام از ادمین:\n\n{broadcast_message}")
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Failed to send broadcast to user {user['id']}: {e}")
-            failed_count += 1
-    
-    await update.message.reply_text(f"✅ پیام همگانی ارسال شد.\nموفق: {sent_count}\nناموفق: {failed_count}")
+    progress_message = await update.message.reply_text("در حال ارسال پیام همگانی...")
+    job_id = await broadcast.start_broadcast(
+        context.bot, update.effective_chat.id, broadcast_message, progress_message.message_id
+    )
+    if not job_id:
+        await progress_message.edit_text("❌ خطایی در ایجاد پیام همگانی رخ داد.")
     return ConversationHandler.END
 
 
 # --- NEW FEATURE: Admin-User Direct Chat ---
 
-async def chat_with_user_entry(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def chat_with_user_entry(update: Update, context: ContextTypes.DEFAULT_TYPE, target_user_id: int) -> int:
     """Entry point for admin to start a direct chat with a user."""
     query = update.callback_query
     await query.answer()
 
-    target_user_id = int(query.data.split('_')[3]) # admin_chat_user_USER_ID
-    target_user = database.get_user(target_user_id)
+    target_user = await async_db.get_user(target_user_id)
 
     if not target_user:
         await query.edit_message_text("کاربر مورد نظر یافت نشد.")
         return ConversationHandler.END
     
     context.user_data['admin_chat_target_user_id'] = target_user_id
+    chat_relay.get_registry(context.bot_data, config.ADMIN_CHAT_TTL).start(update.effective_user.id, target_user_id)
     await query.edit_message_text(
         f"شما وارد حالت چت با کاربر {target_user_id} (@{target_user.get('username', 'نامشخص')}) شدید.\n"
         "هر پیامی که اینجا ارسال کنید به او فرستاده می‌شود.\n"
@@ -1217,6 +1476,9 @@ async def admin_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("خطا: کاربر مقصد برای چت مشخص نیست. لطفاً /cancel را بزنید و دوباره تلاش کنید.")
         return ConversationHandler.END
     
+    # Keep the relay of the user's replies alive while the admin is writing
+    chat_relay.get_registry(context.bot_data, config.ADMIN_CHAT_TTL).user_for(update.effective_user.id)
+
     message_to_send = update.message.text
     try:
         await context.bot.send_message(chat_id=target_user_id, text=f"پیام از ادمین: {message_to_send}")
@@ -1226,51 +1488,41 @@ async def admin_chat_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     return config.ADMIN_CHATTING_WITH_USER # Stay in chat state
 
+async def leave_admin_chat(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> None:
+    """Ends the user's live chat with an admin, if any, and tells the admin."""
+    admin_id = chat_relay.get_registry(context.bot_data, config.ADMIN_CHAT_TTL).end_for_user(user_id)
+    if admin_id is None:
+        return
+    try:
+        await context.bot.send_message(
+            chat_id=admin_id,
+            text=f"کاربر {user_id} از چت خارج شد. برای بازگشت به پنل، /exit_chat را بزنید."
+        )
+    except Exception as e:
+        logger.error(f"Failed to tell admin {admin_id} that user {user_id} left the chat: {e}")
+
 async def user_reply_to_admin_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handles replies from user when admin is in chat mode with them."""
-    user_id = update.effective_user.id
-    message_text = update.message.text
-    
-    # This function acts as a general message handler for users.
-    # If the admin is currently chatting with this user, forward user's message to admin.
-    # The admin's `context.user_data` needs to store the user they are chatting with.
-    # This requires checking all active admin contexts, which is complex for a simple bot.
-    # A simpler approach: if a message is received from a user, and admin is in a chat state,
-    # and that user is the target, display it to the admin.
-    # For now, we will simply log this or send it as a support message if no active admin chat.
-    
-    # A more robust solution would involve a custom dispatcher or more complex state management
-    # to route messages based on active conversations.
-    # For simplicity, if the user sends a message and it's not part of an ongoing user conversation handler,
-    # it's just a regular message. If an admin is chatting with them, Telegram's native reply
-    # functionality might suffice outside the bot's direct control, or we need to manage it explicitly.
-    
-    # Given the request "وقتی کابری پیام پشتیبانی داد ادمین که میخواد جواب بده وارد پت با اون کاربر بشه"
-    # The 'reply to user' button from support messages or 'chat with user' will set ADMIN_CHATTING_WITH_USER state.
-    # When in ADMIN_CHATTING_WITH_USER state, ALL messages from this specific user will be forwarded to admin.
-    
-    # This requires checking if the current *admin* has 'admin_chat_target_user_id' set to this user_id
-    # This is a bit tricky with `ContextTypes.DEFAULT_TYPE`, which is for the current update.
-    # We'd need to iterate through all active contexts for ADMIN_ID, or use a global dict for active chats.
-    # For now, let's assume admin initiates, and user's regular messages are handled as support or main menu actions.
-    # The direct reply from the admin covers the support side.
-    
-    # For the prompt "وقتی کابری پیام پشتیبانی داد ادمین که میخواد جواب بده وارد پت با اون کاربر بشه":
-    # The "Reply to this user" button now transitions to ADMIN_CHATTING_WITH_USER.
-    # The user's replies need to be seen by the admin.
-    # This will require custom logic in the main dispatcher or a dedicated listener.
-    
-    # Simpler version for `user_reply_to_admin_chat`:
-    # If a message is received and it's from a user who is being chatted with by ADMIN_ID,
-    # forward it to ADMIN_ID. This is a general MessageHandler.
-    
-    # Check if this user is currently being chatted with by the admin.
-    # This information would typically be stored in a global dictionary or context outside of a specific user's context.
-    # For example, context.bot_data['active_admin_chats'] = {admin_id: target_user_id}
-    
-    # This part requires more robust state management beyond single user_data.
-    # For now, let's assume the admin initiates, and regular user messages default to support if it's the right context.
-    pass # This function needs more complex logic to route back to the admin effectively.
+    """Relays a user's message to the admin chatting with them (runs before all other handlers).
+    A main menu button ends the chat and is handled as usual."""
+    registry = chat_relay.get_registry(context.bot_data, config.ADMIN_CHAT_TTL)
+    admin_id = registry.admin_for(update.effective_user.id)
+    if admin_id is None:
+        return # Not in a live chat: let the regular handlers take the message
+    message = update.effective_message
+    if message.text in MAIN_MENU_TEXTS:
+        await leave_admin_chat(context, update.effective_user.id)
+        return
+
+    try:
+        await context.bot.copy_message(
+            chat_id=admin_id,
+            from_chat_id=update.effective_chat.id,
+            message_id=message.message_id,
+        )
+    except Exception as e:
+        logger.error(f"Failed to relay message from user {update.effective_user.id} to admin {admin_id}: {e}")
+        await message.reply_text("خطا در ارسال پیام به ادمین. لطفاً دوباره تلاش کنید.")
+    raise ApplicationHandlerStop # The message belonged to the chat, not to menus or conversations
 
 # --- NEW FEATURE: Guided Service Delivery for Admin ---
 
@@ -1293,6 +1545,8 @@ async def start_service_delivery_after_approval(update: Update, context: Context
         [InlineKeyboardButton("ارسال محتوای جدید (متن/فایل)", callback_data="deliver_new_content")],
         [InlineKeyboardButton("لغو ارسال", callback_data="cancel_delivery")]
     ]
+    if config_generator.template_path(context.user_data.get('service_delivery_service_type', '')):
+        keyboard.insert(0, [InlineKeyboardButton("⚙️ ساخت و ارسال کانفیگ اختصاصی", callback_data="deliver_generated_config")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.callback_query.message.reply_text("انتخاب روش ارسال:", reply_markup=reply_markup)
     return config.ADMIN_DELIVERING_SERVICE_CHOOSE_METHOD
@@ -1307,11 +1561,14 @@ async def choose_delivery_method(update: Update, context: ContextTypes.DEFAULT_T
         return await send_predefined_service_choice(update, context)
     elif choice == "deliver_new_content":
         return await choose_new_delivery_type(update, context)
+    elif choice == "deliver_generated_config":
+        return await send_generated_config(update, context)
     elif choice == "cancel_delivery":
         await query.edit_message_text("ارسال سرویس لغو شد.")
         # Clear context data
         context.user_data.pop('service_delivery_target_user_id', None)
         context.user_data.pop('service_delivery_request_id', None)
+        context.user_data.pop('service_delivery_service_type', None)
         return ConversationHandler.END
     return config.ADMIN_DELIVERING_SERVICE_CHOOSE_METHOD # Stay in state on unexpected callback
 
@@ -1320,30 +1577,29 @@ async def send_predefined_service_choice(update: Update, context: ContextTypes.D
     query = update.callback_query
     await query.answer()
 
-    services = database.get_all_services()
+    services = await async_db.get_all_services()
     if not services:
         await query.edit_message_text("هیچ سرویس ذخیره شده‌ای برای ارسال وجود ندارد. لطفاً ابتدا سرویس‌ها را تنظیم کنید.")
         return ConversationHandler.END
     
-    keyboard = [[InlineKeyboardButton(s['type'], callback_data=f"send_existing_{s['type']}")] for s in services]
+    keyboard = [[InlineKeyboardButton(s['type'], callback_data=callback_data("send_existing", s['type']))] for s in services]
     keyboard.append([InlineKeyboardButton("↩️ بازگشت", callback_data="deliver_cancel_send")]) # Custom callback to cancel delivery
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text("لطفاً سرویس ذخیره شده‌ای که می‌خواهید ارسال کنید را انتخاب کنید:", reply_markup=reply_markup)
     return config.ADMIN_DELIVERING_SERVICE_CHOOSE_EXISTING
 
-async def send_existing_service_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+async def send_existing_service_content(update: Update, context: ContextTypes.DEFAULT_TYPE, service_type: str) -> int:
     """Sends the selected predefined service to the user."""
     query = update.callback_query
     await query.answer()
     
-    service_type = query.data.split('_')[2] # send_existing_openvpn
     target_user_id = context.user_data.get('service_delivery_target_user_id')
     
     if not target_user_id:
         await query.edit_message_text("خطا: کاربر مقصد برای ارسال سرویس مشخص نیست.")
         return ConversationHandler.END
 
-    service_data = database.get_service(service_type)
+    service_data = await async_db.get_service(service_type)
     if not service_data:
         await query.edit_message_text(f"سرویس {service_type} در دیتابیس یافت نشد.")
         return ConversationHandler.END
@@ -1363,6 +1619,44 @@ async def send_existing_service_content(update: Update, context: ContextTypes.DE
     # Clear context data
     context.user_data.pop('service_delivery_target_user_id', None)
     context.user_data.pop('service_delivery_request_id', None)
+    context.user_data.pop('service_delivery_service_type', None)
+    return ConversationHandler.END
+
+
+async def send_generated_config(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Generates the user's own config from the service template and sends it."""
+    query = update.callback_query
+    target_user_id = context.user_data.get('service_delivery_target_user_id')
+    request_id = context.user_data.get('service_delivery_request_id')
+    service_type = context.user_data.get('service_delivery_service_type')
+    if not target_user_id or not request_id or not service_type:
+        await query.edit_message_text("خطا: اطلاعات کاربر یا درخواست برای ساخت کانفیگ مشخص نیست.")
+        return ConversationHandler.END
+
+    await query.edit_message_text("⏳ در حال ساخت کانفیگ اختصاصی...")
+    try:
+        generated = await config_generator.generate(target_user_id, request_id, service_type)
+        if not generated:
+            await query.edit_message_text(f"❌ قالب کانفیگ برای سرویس {service_type} یافت نشد.")
+            return ConversationHandler.END
+        if generated['file_name']:
+            await context.bot.send_document(
+                chat_id=target_user_id, document=generated['content'].encode("utf-8"),
+                filename=generated['file_name'], caption=f"کانفیگ اختصاصی {service_type} شما:"
+            )
+        else:
+            await context.bot.send_message(chat_id=target_user_id, text=f"کانفیگ اختصاصی {service_type} شما:\n\n{generated['content']}")
+        await query.edit_message_text(
+            f"✅ کانفیگ اختصاصی {service_type} برای کاربر {target_user_id} ساخته و ارسال شد.\n"
+            f"نام کاربری VPN: {generated['username']}"
+        )
+    except Exception as e:
+        logger.error(f"Config generation for request {request_id} failed: {e}")
+        await query.edit_message_text(f"❌ خطایی در ساخت یا ارسال کانفیگ رخ داد: {e}")
+
+    context.user_data.pop('service_delivery_target_user_id', None)
+    context.user_data.pop('service_delivery_request_id', None)
+    context.user_data.pop('service_delivery_service_type', None)
     return ConversationHandler.END
 
 
@@ -1404,6 +1698,7 @@ async def receive_and_send_new_text_content(update: Update, context: ContextType
     # Clear context data
     context.user_data.pop('service_delivery_target_user_id', None)
     context.user_data.pop('service_delivery_request_id', None)
+    context.user_data.pop('service_delivery_service_type', None)
     return ConversationHandler.END
 
 async def ask_for_new_file_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -1436,6 +1731,7 @@ async def receive_and_send_new_file_content(update: Update, context: ContextType
     # Clear context data
     context.user_data.pop('service_delivery_target_user_id', None)
     context.user_data.pop('service_delivery_request_id', None)
+    context.user_data.pop('service_delivery_service_type', None)
     return ConversationHandler.END
 
 # General exit for admin conversations (e.g., from an admin-initiated chat)
@@ -1445,8 +1741,10 @@ async def exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     if user_id == ADMIN_ID:
         # Clear specific chat target if set
         context.user_data.pop('admin_chat_target_user_id', None)
+        chat_relay.get_registry(context.bot_data, config.ADMIN_CHAT_TTL).end(user_id)
         context.user_data.pop('service_delivery_target_user_id', None)
         context.user_data.pop('service_delivery_request_id', None)
+        context.user_data.pop('service_delivery_service_type', None)
 
         await update.message.reply_text(
             "شما از حالت فعلی خارج شدید. به پنل ادمین بازگشتید.",
@@ -1457,14 +1755,113 @@ async def exit_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         # For regular users, this is handled by the general cancel command
         return await cancel(update, context)
 
+# --- Flood Control ---
+
+async def throttle_updates(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Drops updates over the per-user or global rate before any other handler (and so any database call) runs.
+    The user gets an occasional "slow down" notice instead of one reply per dropped update.
+    Admitted updates count as user activity (buffered, written in the background)."""
+    user = update.effective_user
+    scope = flood_control.check(user.id if user else None)
+    if scope is None:
+        if user is not None:
+            activity.touch(user.id)
+        return
+    metrics.THROTTLED_UPDATES.inc(scope=scope)
+    if user is not None and flood_control.should_notify(user.id):
+        text = "⏳ تعداد درخواست‌های شما بیش از حد مجاز است. لطفاً چند لحظه صبر کنید و دوباره تلاش کنید."
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(text, show_alert=True)
+            elif update.effective_message and update.effective_chat.type == "private":
+                await update.effective_message.reply_text(text)
+        except TelegramError as e:
+            logger.debug(f"Could not send flood notice to user {user.id}: {e}")
+    raise ApplicationHandlerStop
+
 # --- Main Application Setup ---
 
+async def on_startup(application: Application) -> None:
+    """Runs once the bot is initialized, before updates are fetched."""
+    global web_server
+    if config.RUN_MODE == "webhook" or config.HEALTH_SERVER:
+        web_server = keep_alive.create_server(config.WEB_HOST, config.WEB_PORT)
+        if config.RUN_MODE == "webhook":
+            keep_alive.add_webhook_route(web_server, application, config.WEBHOOK_PATH, WEBHOOK_SECRET)
+        await web_server.start()
+    await broadcast.resume_broadcasts(application.bot)
+    await inventory.refresh_stock_metrics()
+    await subscriptions.schedule(application.job_queue)
+    activity.start()
+    await warm_connection_guide_cache(application.bot)
+
+async def on_shutdown(application: Application) -> None:
+    """Runs when the bot is shutting down."""
+    await broadcast.stop_broadcasts()
+    await activity.stop()
+    if web_server is not None:
+        await web_server.stop()
+
+async def run_webhook(application: Application) -> None:
+    """Receives updates through the webhook on the built-in HTTP server until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError: # Signal handlers are not available on Windows
+            pass
+
+    await application.initialize()
+    # post_init/post_shutdown only run automatically under run_polling/run_webhook
+    await on_startup(application)
+    await application.bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    await application.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
 def main() -> None:
     """Runs the bot."""
     # Initialize the database
     database.init_database()
-
-    application = Application.builder().token(TOKEN).build()
+    database.load_catalog() # Warm the services/prices/discount codes cache
+    drift = database.reconcile_statistics()
+    if drift:
+        logger.warning("Statistics counters drifted and were corrected: %s", drift)
+
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(config.BOT_API_BASE_URL)
+        .base_file_url(config.BOT_API_BASE_FILE_URL)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(ChatOrderedUpdateProcessor(config.MAX_CONCURRENT_UPDATES))
+        .persistence(SQLitePersistence(update_interval=config.PERSISTENCE_UPDATE_INTERVAL))
+        .request(telemetry.InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(telemetry.InstrumentedRequest())
+    )
+    if config.RUN_MODE == "webhook":
+        builder.updater(None) # Updates arrive through keep_alive's webhook route
+    application = builder.build()
+
+    # Flood control: runs first of all (group -2) and stops throttled updates
+    application.add_handler(TypeHandler(Update, throttle_updates), group=-2)
+
+    # Live admin chat relay: checked before every other handler (group -1), it forwards
+    # the messages of users an admin is chatting with and stops further handling
+    application.add_handler(
+        MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND & ~filters.User(ADMIN_ID), user_reply_to_admin_chat),
+        group=-1,
+    )
 
     # --- User Conversation Handlers ---
     
@@ -1477,21 +1874,23 @@ def main() -> None:
         states={
             config.REQUESTING_CONTACT: [MessageHandler(filters.CONTACT, receive_contact)],
             config.REQUESTING_FULL_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, receive_full_name)],
-            config.SELECTING_OS: [CallbackQueryHandler(receive_os, pattern=r"^os_")],
+            config.SELECTING_OS: [action_handler("os", receive_os, str)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="registration_conv",
+        persistent=True,
     )
-    application.add_handler(registration_conv)
-
     # Purchase Conversation
     purchase_conv = ConversationHandler(
         entry_points=[MessageHandler(filters.Regex("^🛍 خرید اکانت$"), purchase_command)],
         states={
-            config.SELECTING_PURCHASE_ACCOUNT_TYPE: [CallbackQueryHandler(select_purchase_account_type, pattern=r"^account_")],
-            config.SELECTING_DEVICE: [CallbackQueryHandler(select_device_type, pattern=r"^device_")],
-            config.SELECTING_SERVICE: [CallbackQueryHandler(select_service_type, pattern=r"^service_")],
+            config.SELECTING_PURCHASE_ACCOUNT_TYPE: [action_handler("account", select_purchase_account_type, str)],
+            config.SELECTING_DEVICE: [action_handler("device", select_device_type, str)],
+            config.SELECTING_SERVICE: [action_handler("service", select_service_type, str)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="purchase_conv",
+        persistent=True,
     )
     application.add_handler(purchase_conv)
 
@@ -1502,6 +1901,8 @@ def main() -> None:
             config.ENTERING_DISCOUNT_CODE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_discount_code)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="discount_conv",
+        persistent=True,
     )
     application.add_handler(discount_conv)
 
@@ -1513,6 +1914,8 @@ def main() -> None:
             config.TRANSFER_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, confirm_transfer)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="transfer_conv",
+        persistent=True,
     )
     application.add_handler(transfer_conv)
 
@@ -1523,6 +1926,8 @@ def main() -> None:
             config.ENTERING_SUPPORT_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, enter_support_message)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        name="support_conv",
+        persistent=True,
     )
     application.add_handler(support_conv)
 
@@ -1537,7 +1942,7 @@ def main() -> None:
             CallbackQueryHandler(admin_delete_service_ask, pattern=r"^admin_delete_service_ask$"),
         ],
         states={
-            config.ADMIN_SET_SERVICE: [CallbackQueryHandler(admin_set_service_content_or_file, pattern=r"^set_service_type_")],
+            config.ADMIN_SET_SERVICE: [action_handler("set_service_type", admin_set_service_content_or_file, str)],
             config.ADMIN_SERVICE_FILE_OR_TEXT: [
                 CallbackQueryHandler(receive_service_text_content, pattern=r"^service_content_text$"),
                 CallbackQueryHandler(receive_service_file_content, pattern=r"^service_content_file$"),
@@ -1546,14 +1951,30 @@ def main() -> None:
                 MessageHandler(filters.TEXT & ~filters.COMMAND, process_service_text_content),
                 MessageHandler(filters.Document.ALL, process_service_file_content),
             ],
-            config.ADMIN_SET_SERVICE_PRICE_TYPE: [CallbackQueryHandler(admin_set_service_price_value, pattern=r"^set_price_type_")],
+            config.ADMIN_SET_SERVICE_PRICE_TYPE: [action_handler("set_price_type", admin_set_service_price_value, str)],
             config.ADMIN_SET_SERVICE_PRICE_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_service_price_value)],
-            config.ADMIN_DELETE_DISCOUNT: [CallbackQueryHandler(do_delete_service, pattern=r"^delete_service_")], # Reusing state, but handler is specific
+            config.ADMIN_DELETE_DISCOUNT: [action_handler("delete_service", do_delete_service, str)], # Reusing state, but handler is specific
         },
         fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(admin_manage_services_menu, pattern="admin_manage_services")],
+        name="admin_service_conv",
+        persistent=True,
     )
     application.add_handler(admin_service_conv)
 
+    # Admin Inventory Import Conversation
+    admin_inventory_conv = ConversationHandler(
+        entry_points=[
+            action_handler("inventory_import", ask_inventory_file, str),
+        ],
+        states={
+            config.ADMIN_INVENTORY_IMPORT_FILE: [MessageHandler(filters.Document.ALL, receive_inventory_file)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(admin_inventory_menu, pattern="^admin_inventory$")],
+        name="admin_inventory_conv",
+        persistent=True,
+    )
+    application.add_handler(admin_inventory_conv)
+
     # Admin Discount Management Conversation
     admin_discount_conv = ConversationHandler(
         entry_points=[
@@ -1562,21 +1983,25 @@ def main() -> None:
         ],
         states={
             config.ADMIN_ADD_DISCOUNT_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, do_add_discount_code)],
-            config.ADMIN_DELETE_DISCOUNT: [CallbackQueryHandler(do_delete_discount_code, pattern=r"^delete_code_")],
+            config.ADMIN_DELETE_DISCOUNT: [action_handler("delete_code", do_delete_discount_code, str)],
         },
         fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(admin_discount_codes_menu, pattern="admin_discount_codes")],
+        name="admin_discount_conv",
+        persistent=True,
     )
     application.add_handler(admin_discount_conv)
 
     # Admin User Management - Add Credit Conversation
     admin_credit_conv = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(ask_user_add_credit, pattern=r"^admin_select_user_for_add_credit_"),
+            action_handler("admin_select_user_for_add_credit", ask_user_add_credit, int),
         ],
         states={
             config.ADMIN_USER_ADD_CREDIT_AMOUNT: [MessageHandler(filters.TEXT & ~filters.COMMAND, do_add_credit)],
         },
         fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(admin_manage_users_menu, pattern="admin_manage_users")],
+        name="admin_credit_conv",
+        persistent=True,
     )
     application.add_handler(admin_credit_conv)
 
@@ -1587,22 +2012,24 @@ def main() -> None:
             config.ADMIN_BROADCAST_MESSAGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast)],
         },
         fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(admin_panel, pattern="admin_main_menu")],
+        name="admin_broadcast_conv",
+        persistent=True,
     )
     application.add_handler(admin_broadcast_conv)
 
     # Admin Purchase Request Processing (including NEW service delivery flow)
     admin_purchase_request_conv = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(process_request_command, pattern=r"process_request_"),
+            action_handler("process_request", process_request_command, str, int),
         ],
         states={
             # State after approving request
             config.ADMIN_DELIVERING_SERVICE_CHOOSE_METHOD: [
-                CallbackQueryHandler(choose_delivery_method, pattern=r"^(deliver_existing_service|deliver_new_content|cancel_delivery)$")
+                CallbackQueryHandler(choose_delivery_method, pattern=r"^(deliver_existing_service|deliver_generated_config|deliver_new_content|cancel_delivery)$")
             ],
             # If admin chooses existing service
             config.ADMIN_DELIVERING_SERVICE_CHOOSE_EXISTING: [
-                CallbackQueryHandler(send_existing_service_content, pattern=r"^send_existing_")
+                action_handler("send_existing", send_existing_service_content, str)
             ],
             # If admin chooses new content
             config.ADMIN_DELIVERING_SERVICE_RECEIVING_CONTENT: [
@@ -1613,6 +2040,8 @@ def main() -> None:
             config.ADMIN_DELIVERING_SERVICE_RECEIVING_FILE: [MessageHandler(filters.Document.ALL, receive_and_send_new_file_content)],
         },
         fallbacks=[CommandHandler("cancel", cancel), CallbackQueryHandler(lambda q,c: q.edit_message_text("عملیات لغو شد.").then(admin_requests_menu(q,c)), pattern="admin_requests")], # Fallback to requests menu
+        name="admin_purchase_request_conv",
+        persistent=True,
     )
     application.add_handler(admin_purchase_request_conv)
     
@@ -1620,7 +2049,7 @@ def main() -> None:
     # --- NEW FEATURE: Admin-User Direct Chat Conversation ---
     admin_user_chat_conv = ConversationHandler(
         entry_points=[
-            CallbackQueryHandler(chat_with_user_entry, pattern=r"^admin_chat_user_"), # From user lists or support view
+            action_handler("admin_chat_user", chat_with_user_entry, int), # From user lists or support view
         ],
         states={
             config.ADMIN_CHATTING_WITH_USER: [
@@ -1630,6 +2059,8 @@ def main() -> None:
             # user_chat_message would be a general handler, not part of specific conv state
         },
         fallbacks=[CommandHandler("cancel", exit_chat), CommandHandler("exit_chat", exit_chat)],
+        name="admin_user_chat_conv",
+        persistent=True,
     )
     application.add_handler(admin_user_chat_conv)
 
@@ -1639,48 +2070,77 @@ def main() -> None:
     application.add_handler(CommandHandler("about", about_command))
     application.add_handler(CommandHandler("score", show_credit_command))
     application.add_handler(CommandHandler("myinfo", show_status_command))
+    # /cancel outside any conversation, e.g. a user leaving a live chat with the admin
+    application.add_handler(CommandHandler("cancel", cancel))
     
     # Handlers for main menu ReplyKeyboard buttons (regex for exact match)
     application.add_handler(MessageHandler(filters.Regex("^💰 اعتبار من$"), show_credit_command))
     application.add_handler(MessageHandler(filters.Regex("^👤 اطلاعات من$"), show_status_command))
     application.add_handler(MessageHandler(filters.Regex("^⬇️ دانلود برنامه‌ها$"), show_app_downloads_command))
 
-    # General callback query handlers for admin panel navigation
-    application.add_handler(CallbackQueryHandler(admin_panel, pattern="admin_main_menu"))
-    application.add_handler(CallbackQueryHandler(admin_manage_users_menu, pattern="admin_manage_users"))
-    application.add_handler(CallbackQueryHandler(admin_manage_services_menu, pattern="admin_manage_services"))
-    application.add_handler(CallbackQueryHandler(admin_discount_codes_menu, pattern="admin_discount_codes"))
-    application.add_handler(CallbackQueryHandler(admin_requests_menu, pattern="admin_requests"))
-    application.add_handler(CallbackQueryHandler(admin_stats_command, pattern="admin_stats"))
-    application.add_handler(CallbackQueryHandler(admin_support_menu, pattern="admin_support"))
+    # Registration goes after the menu handlers: its entry points also match the menu
+    # buttons, and registered earlier it would answer them with /start for everyone
+    application.add_handler(registration_conv)
+
+    # General callback queries: one router dispatching on the action part of callback_data
+    router = CallbackRouter()
+
+    # Admin panel navigation
+    router.add("admin_main_menu", admin_panel)
+    router.add("admin_manage_users", admin_manage_users_menu)
+    router.add("admin_manage_services", admin_manage_services_menu)
+    router.add("admin_discount_codes", admin_discount_codes_menu)
+    router.add("admin_requests", admin_requests_menu)
+    router.add("admin_stats", admin_stats_command)
+    router.add("admin_support", admin_support_menu)
 
     # Specific admin callbacks not part of conv handlers
-    application.add_handler(CallbackQueryHandler(view_all_users_command, pattern="admin_view_all_users"))
-    application.add_handler(CallbackQueryHandler(view_pending_users_command, pattern="admin_view_pending_users"))
-    application.add_handler(CallbackQueryHandler(approve_user_action, pattern=r"^approve_user_"))
-    application.add_handler(CallbackQueryHandler(reject_user_action, pattern=r"^reject_user_"))
-    
-    application.add_handler(CallbackQueryHandler(view_all_services_command, pattern="admin_view_all_services"))
-    application.add_handler(CallbackQueryHandler(view_all_service_prices_command, pattern="admin_view_all_service_prices"))
-    
-    application.add_handler(CallbackQueryHandler(view_all_discount_codes_command, pattern="admin_view_all_discount_codes"))
+    router.add("admin_view_all_users", view_all_users_command)
+    router.add("admin_view_pending_users", view_pending_users_command)
+    router.add("admin_approve_user_list", view_pending_users_command)
+    router.add("admin_add_credit_to_user_list", admin_add_credit_to_user_list)
+    router.add("users_page", user_browser_page, str, str, int)
+    router.add("approve_user", approve_user_action, int)
+    router.add("reject_user", reject_user_action, int)
 
-    application.add_handler(CallbackQueryHandler(view_pending_requests_command, pattern="admin_view_pending_requests"))
-    application.add_handler(CallbackQueryHandler(view_approved_requests_command, pattern="admin_view_approved_requests"))
-    
-    application.add_handler(CallbackQueryHandler(view_unanswered_support_messages_command, pattern="admin_view_unanswered_support"))
-    application.add_handler(CallbackQueryHandler(view_all_support_messages_command, pattern="admin_view_all_support"))
-    application.add_handler(CallbackQueryHandler(mark_support_message_answered_action, pattern=r"^mark_support_answered_"))
+    router.add("admin_view_all_services", view_all_services_command)
+    router.add("admin_view_all_service_prices", view_all_service_prices_command)
+    router.add("admin_inventory", admin_inventory_menu)
 
-    application.add_handler(CallbackQueryHandler(show_connection_guide, pattern="show_connection_guide"))
+    router.add("admin_view_all_discount_codes", view_all_discount_codes_command)
+
+    router.add("admin_view_pending_requests", view_pending_requests_command)
+    router.add("admin_view_approved_requests", view_approved_requests_command)
+    router.add("bulk_requests", bulk_requests_page, str, int)
+    router.add("bulk_toggle", bulk_toggle_request, int, int)
+    router.add("bulk_select", bulk_select_requests, str, int)
+    router.add("bulk_process", bulk_process_requests, str)
+
+    router.add("admin_view_unanswered_support", view_unanswered_support_messages_command)
+    router.add("admin_view_all_support", view_all_support_messages_command)
+    router.add("mark_support_answered", mark_support_message_answered_action, int)
+
+    router.add("show_connection_guide", show_connection_guide)
 
     # Fallback for undefined callbacks in admin delivery (e.g. "بازگشت" or "cancel")
-    application.add_handler(CallbackQueryHandler(lambda q,c: q.edit_message_text("عملیات ارسال لغو شد.").then(admin_panel(q,c)), pattern="deliver_cancel_send"))
+    router.add("deliver_cancel_send", lambda q,c: q.edit_message_text("عملیات ارسال لغو شد.").then(admin_panel(q,c)))
 
+    application.add_handler(router.handler())
+
+    # Record latency and errors of every handler registered above
+    telemetry.instrument_application(application)
 
     # Run the bot
     print("🤖 ربات VPN با دکمه‌های شیشه‌ای شروع شد...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if config.RUN_MODE == "webhook":
+        if not config.WEBHOOK_URL:
+            raise SystemExit("WEBHOOK_URL must be set when RUN_MODE=webhook")
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+    # Let pending database work finish before exiting
+    async_db.shutdown()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Broadcast module for VPN Telegram Bot
+Rate-limited, concurrent sender and the resumable broadcast job runner built on it.
+"""
+
+import asyncio
+import datetime
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import async_db
+import config
+import metrics
+from ratelimit import KeyedTokenBucket, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedSender:
+    """Sends Bot API requests under a global and a per-chat token bucket,
+    with a bounded number in flight and RetryAfter-aware retries."""
+
+    def __init__(self, global_rate: float, per_chat_rate: float, concurrency: int, max_attempts: int):
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = KeyedTokenBucket(per_chat_rate)
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(self, chat_id: int, request: Callable[[], Awaitable]) -> Tuple[bool, Optional[str]]:
+        """Run request() for chat_id once tokens are available. Returns (success, error)."""
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                # Tokens are taken only once a slot is free, so tokens are not used up by
+                # senders queued on the semaphore and then spent in one burst
+                async with self._semaphore:
+                    await self.chat_buckets.acquire(chat_id)
+                    await self.global_bucket.acquire()
+                    await request()
+                return True, None
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if isinstance(retry_after, datetime.timedelta):
+                    retry_after = retry_after.total_seconds()
+                # Flood control applies to the whole bot, so every sender waits
+                self.global_bucket.pause(float(retry_after))
+                error = f"RetryAfter {retry_after}s"
+            except (Forbidden, BadRequest) as e:
+                # Blocked the bot, deactivated, chat not found... retrying will not help
+                return False, str(e)
+            except TelegramError as e:
+                error = str(e)
+                await asyncio.sleep(min(2 ** attempt, 30))
+        return False, error
+
+_sender: Optional[RateLimitedSender] = None
+
+def get_sender() -> RateLimitedSender:
+    """Return the process-wide sender shared by broadcasts and bulk notifications."""
+    global _sender
+    if _sender is None:
+        _sender = RateLimitedSender(
+            global_rate=config.BROADCAST_GLOBAL_RATE,
+            per_chat_rate=config.BROADCAST_PER_CHAT_RATE,
+            concurrency=config.BROADCAST_CONCURRENCY,
+            max_attempts=config.BROADCAST_MAX_ATTEMPTS,
+        )
+    return _sender
+
+def format_progress(job: dict, done: bool = False) -> str:
+    """Progress text shown in the admin's broadcast message."""
+    processed = job['sent'] + job['failed']
+    header = "✅ پیام همگانی ارسال شد." if done else "📢 در حال ارسال پیام همگانی..."
+    return (
+        f"{header}\n"
+        f"پیشرفت: {processed}/{job['total']}\n"
+        f"موفق: {job['sent']}\n"
+        f"ناموفق: {job['failed']}"
+    )
+
+async def _edit_progress(bot: Bot, job: dict, done: bool = False) -> None:
+    if not job.get('progress_message_id'):
+        return
+    try:
+        await bot.edit_message_text(
+            chat_id=job['admin_chat_id'],
+            message_id=job['progress_message_id'],
+            text=format_progress(job, done)
+        )
+    except TelegramError as e:
+        # "Message is not modified" and similar are harmless
+        logger.debug(f"Could not edit broadcast progress for job {job['id']}: {e}")
+
+async def run_broadcast_job(bot: Bot, job_id: int) -> None:
+    """Deliver a broadcast job to all of its pending recipients.
+    Safe to call again after a restart: only recipients still marked pending are sent to."""
+    job = await async_db.get_broadcast_job(job_id)
+    if not job or job['status'] != 'running':
+        return
+
+    sender = get_sender()
+    text = f"📢 پیام از ادمین:\n\n{job['message_text']}"
+    queue: asyncio.Queue = asyncio.Queue(maxsize=config.BROADCAST_CONCURRENCY * 4)
+    results: List[Tuple[int, str, Optional[str]]] = []
+
+    async def flush_results() -> None:
+        batch = results[:]
+        del results[:]
+        if batch and await async_db.record_broadcast_results(job_id, batch):
+            sent = sum(1 for _, status, _ in batch if status == 'sent')
+            job['sent'] += sent
+            job['failed'] += len(batch) - sent
+
+    async def worker() -> None:
+        while True:
+            user_id = await queue.get()
+            try:
+                if user_id is None:
+                    return
+                ok, error = await sender.send(user_id, lambda: bot.send_message(chat_id=user_id, text=text))
+                if not ok:
+                    logger.error(f"Failed to send broadcast to user {user_id}: {error}")
+                status = 'sent' if ok else 'failed'
+                metrics.BROADCAST_MESSAGES.inc(status=status)
+                results.append((user_id, status, error))
+            finally:
+                queue.task_done()
+
+    async def report_progress() -> None:
+        while True:
+            await asyncio.sleep(config.BROADCAST_PROGRESS_INTERVAL)
+            await flush_results()
+            await _edit_progress(bot, job)
+
+    workers = [asyncio.create_task(worker()) for _ in range(config.BROADCAST_CONCURRENCY)]
+    reporter = asyncio.create_task(report_progress())
+    started = time.monotonic()
+    try:
+        after_user_id = 0
+        while True:
+            batch = await async_db.get_pending_broadcast_recipients(job_id, after_user_id, config.BROADCAST_BATCH_SIZE)
+            if not batch:
+                break
+            for user_id in batch:
+                await queue.put(user_id)
+            after_user_id = batch[-1]
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        reporter.cancel()
+        for task in workers:
+            task.cancel()
+        # Persist what was delivered so a restart does not send it again
+        await asyncio.shield(flush_results())
+
+    await async_db.finish_broadcast_job(job_id)
+    await _edit_progress(bot, job, done=True)
+    logger.info(
+        f"Broadcast job {job_id} finished in {time.monotonic() - started:.1f}s: "
+        f"{job['sent']} sent, {job['failed']} failed"
+    )
+
+# Running job tasks (kept referenced so they are not garbage collected)
+_job_tasks: Set[asyncio.Task] = set()
+
+def spawn(coro: Awaitable) -> None:
+    """Run a coroutine in the background; stop_broadcasts() cancels it on shutdown."""
+    task = asyncio.create_task(coro)
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+
+def _spawn_job(bot: Bot, job_id: int) -> None:
+    spawn(run_broadcast_job(bot, job_id))
+
+async def start_broadcast(bot: Bot, admin_chat_id: int, message_text: str, progress_message_id: int) -> int:
+    """Create a broadcast job and start delivering it in the background. Returns the job ID (0 on failure)."""
+    job_id = await async_db.create_broadcast_job(admin_chat_id, message_text)
+    if not job_id:
+        return 0
+    await async_db.set_broadcast_progress_message(job_id, progress_message_id)
+    _spawn_job(bot, job_id)
+    return job_id
+
+async def resume_broadcasts(bot: Bot) -> None:
+    """Restart delivery of broadcast jobs that were interrupted by a shutdown."""
+    for job in await async_db.get_unfinished_broadcast_jobs():
+        logger.info(f"Resuming broadcast job {job['id']} ({job['sent'] + job['failed']}/{job['total']} done)")
+        _spawn_job(bot, job['id'])
+
+async def notify_users(bot: Bot, notifications: List[Tuple[int, str]]) -> Tuple[int, List[Tuple[int, Optional[str]]]]:
+    """Send (chat_id, text) notifications through the shared sender.
+    Returns the number sent and (chat_id, error) for each one that failed."""
+    sender = get_sender()
+    queue: asyncio.Queue = asyncio.Queue()
+    for notification in notifications:
+        queue.put_nowait(notification)
+    failed: List[Tuple[int, Optional[str]]] = []
+
+    async def worker() -> None:
+        while not queue.empty():
+            chat_id, text = queue.get_nowait()
+            ok, error = await sender.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text))
+            metrics.NOTIFICATIONS.inc(status='sent' if ok else 'failed')
+            if not ok:
+                logger.error(f"Failed to notify user {chat_id}: {error}")
+                failed.append((chat_id, error))
+
+    # A fixed set of workers like run_broadcast_job, not one task per recipient
+    await asyncio.gather(*(worker() for _ in range(min(config.BROADCAST_CONCURRENCY, len(notifications)))))
+    return len(notifications) - len(failed), failed
+
+async def notify_and_report(bot: Bot, notifications: List[Tuple[int, str]], admin_chat_id: int, report_message_id: int, header: str) -> None:
+    """Send notifications, then replace the admin's report message with header and a delivery summary."""
+    started = time.monotonic()
+    sent, failed = await notify_users(bot, notifications)
+    text = f"{header}\nاطلاع‌رسانی موفق: {sent}\nاطلاع‌رسانی ناموفق: {len(failed)}"
+    if failed:
+        text += "\nکاربران ناموفق: " + ", ".join(str(chat_id) for chat_id, _ in failed[:20])
+        if len(failed) > 20:
+            text += f" و {len(failed) - 20} کاربر دیگر"
+    try:
+        await bot.edit_message_text(chat_id=admin_chat_id, message_id=report_message_id, text=text)
+    except TelegramError as e:
+        logger.debug(f"Could not edit notification report: {e}")
+    logger.info(f"Bulk notification finished in {time.monotonic() - started:.1f}s: {sent} sent, {len(failed)} failed")
+
+def start_notifications(bot: Bot, notifications: List[Tuple[int, str]], admin_chat_id: int, report_message_id: int, header: str) -> None:
+    """Send notifications in the background and replace the admin's report message with a summary.
+    Unlike broadcasts these are not resumable; a shutdown cancels what is left."""
+    spawn(notify_and_report(bot, notifications, admin_chat_id, report_message_id, header))
+
+async def stop_broadcasts() -> None:
+    """Stop running jobs and notifications on shutdown; delivered broadcast recipients are saved and the rest resume on next start."""
+    for task in list(_job_tasks):
+        task.cancel()
+    await asyncio.gather(*_job_tasks, return_exceptions=True)
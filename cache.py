@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache module for VPN Telegram Bot
+Thread-safe in-process LRU cache with per-entry TTL and hit/miss counters.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+class LRUCache:
+    """LRU cache with a time-to-live, safe to share between database worker threads."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a reader that raced with a writer
+        # does not store the value it read before the write.
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        """Current invalidation generation; pass it back to set()."""
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Store a value. If generation is given and an invalidation happened since, skip it."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """Drop the given keys from the cache."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def update(self, changes: Iterable[Tuple[Hashable, Dict[str, Any]]]) -> None:
+        """Merge (key, fields) changes into cached dict values in place, keeping their
+        expiry; keys not cached are skipped. Bumps the generation like invalidate()."""
+        with self._lock:
+            self._generation += 1
+            for key, fields in changes:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries[key] = (entry[0], {**entry[1], **fields})
+
+    def clear(self) -> None:
+        """Drop every entry (counters are kept)."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            }
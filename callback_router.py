@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Callback router module for VPN Telegram Bot
+Callback data has the form "action:arg1:arg2". The router finds the handler for
+an action with one dict lookup and passes the arguments already converted to
+their declared types, instead of testing a chain of regex patterns.
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram.ext import CallbackQueryHandler
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ":"
+
+def callback_data(action: str, *args: Any) -> str:
+    """Build the callback_data string for an action and its arguments."""
+    return SEPARATOR.join([action, *(str(arg) for arg in args)])
+
+def parse_args(raw: str, arg_types: Tuple[type, ...]) -> Optional[List[Any]]:
+    """Split and convert the argument part of callback data. Returns None if it does not fit.
+    The last argument receives the remainder, so it may itself contain the separator."""
+    if not arg_types:
+        return [] if not raw else None
+    parts = raw.split(SEPARATOR, len(arg_types) - 1)
+    if len(parts) != len(arg_types):
+        return None
+    try:
+        return [arg_type(part) for arg_type, part in zip(arg_types, parts)]
+    except ValueError:
+        return None
+
+class CallbackRouter:
+    """Maps callback actions to handlers called as handler(update, context, *args)."""
+
+    def __init__(self):
+        self.routes: Dict[str, Tuple[Callable[..., Awaitable], Tuple[type, ...]]] = {}
+
+    def add(self, action: str, callback: Callable[..., Awaitable], *arg_types: type) -> "CallbackRouter":
+        """Route `action` to callback, converting its arguments with arg_types (e.g. int, str)."""
+        if SEPARATOR in action:
+            raise ValueError(f"Action must not contain '{SEPARATOR}': {action}")
+        self.routes[action] = (callback, arg_types)
+        return self
+
+    def resolve(self, data: object) -> Optional[Tuple[Callable[..., Awaitable], List[Any]]]:
+        """Return (callback, args) for callback data, or None if no route matches."""
+        if not isinstance(data, str):
+            return None
+        action, _, raw_args = data.partition(SEPARATOR)
+        route = self.routes.get(action)
+        if route is None:
+            return None
+        callback, arg_types = route
+        args = parse_args(raw_args, arg_types)
+        if args is None:
+            return None
+        return callback, args
+
+    def check(self, data: object) -> bool:
+        """Pattern for CallbackQueryHandler: True if the data is routed here."""
+        return self.resolve(data) is not None
+
+    async def dispatch(self, update, context) -> Any:
+        """CallbackQueryHandler callback: run the handler routed for the query's data."""
+        resolved = self.resolve(update.callback_query.data)
+        if resolved is None:
+            # Only reachable if check() was bypassed
+            logger.warning(f"No callback route for {update.callback_query.data!r}")
+            return None
+        callback, args = resolved
+        return await callback(update, context, *args)
+
+    def handler(self):
+        """Build one CallbackQueryHandler serving every route of this router."""
+        return CallbackQueryHandler(self.dispatch, pattern=self.check)
+
+def action_handler(action: str, callback: Callable[..., Awaitable], *arg_types: type):
+    """CallbackQueryHandler for a single action, e.g. inside a ConversationHandler state."""
+    return CallbackRouter().add(action, callback, *arg_types).handler()
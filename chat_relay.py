@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Chat relay module for VPN Telegram Bot
+Registry of live admin-user chats, kept in bot_data so a user's messages can be
+relayed to the admin chatting with them with one dict lookup.
+"""
+
+import time
+from typing import Any, Dict, Optional, Tuple
+
+BOT_DATA_KEY = "active_chats"
+
+class ActiveChatRegistry:
+    """Bidirectional admin <-> user map with a TTL refreshed by the admin's activity.
+    Plain dicts and wall-clock expiry, so it pickles with bot_data and survives restarts."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._user_by_admin: Dict[int, Tuple[int, float]] = {} # admin_id -> (user_id, expires_at)
+        self._admin_by_user: Dict[int, int] = {}
+
+    def start(self, admin_id: int, user_id: int) -> None:
+        """Open a chat, replacing the admin's previous chat and the user's previous admin."""
+        self.end(admin_id)
+        previous_admin = self._admin_by_user.get(user_id)
+        if previous_admin is not None:
+            self.end(previous_admin)
+        self._user_by_admin[admin_id] = (user_id, time.time() + self.ttl)
+        self._admin_by_user[user_id] = admin_id
+
+    def end(self, admin_id: int) -> Optional[int]:
+        """Close the admin's chat; returns the user it was with."""
+        entry = self._user_by_admin.pop(admin_id, None)
+        if entry is None:
+            return None
+        user_id = entry[0]
+        if self._admin_by_user.get(user_id) == admin_id:
+            del self._admin_by_user[user_id]
+        return user_id
+
+    def end_for_user(self, user_id: int) -> Optional[int]:
+        """Close the user's chat (the user left it); returns the admin it was with."""
+        admin_id = self._admin_by_user.get(user_id)
+        if admin_id is None:
+            return None
+        self.end(admin_id)
+        return admin_id
+
+    def user_for(self, admin_id: int) -> Optional[int]:
+        """User the admin is chatting with (refreshes the TTL)."""
+        entry = self._user_by_admin.get(admin_id)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            self.end(admin_id)
+            return None
+        self._user_by_admin[admin_id] = (entry[0], time.time() + self.ttl)
+        return entry[0]
+
+    def admin_for(self, user_id: int) -> Optional[int]:
+        """Admin chatting with the user. Does not refresh the TTL, so a user cannot keep
+        a chat open on their own once the admin has gone quiet."""
+        admin_id = self._admin_by_user.get(user_id)
+        if admin_id is None:
+            return None
+        entry = self._user_by_admin.get(admin_id)
+        if entry is None or entry[0] != user_id:
+            return None
+        if entry[1] < time.time():
+            self.end(admin_id)
+            return None
+        return admin_id
+
+    def prune(self) -> int:
+        """Drop expired chats; returns how many were removed."""
+        now = time.time()
+        expired = [admin_id for admin_id, (_, expires_at) in self._user_by_admin.items() if expires_at < now]
+        for admin_id in expired:
+            self.end(admin_id)
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._user_by_admin)
+
+def get_registry(bot_data: Dict[Any, Any], ttl: float) -> ActiveChatRegistry:
+    """Return the registry stored in bot_data, creating it on first use."""
+    registry = bot_data.get(BOT_DATA_KEY)
+    if registry is None:
+        registry = bot_data[BOT_DATA_KEY] = ActiveChatRegistry(ttl)
+    registry.ttl = ttl
+    return registry
@@ -63,11 +63,119 @@ ADMIN_DELIVERING_SERVICE_CHOOSE_EXISTING = 204 # Admin choosing which existing s
 ADMIN_DELIVERING_SERVICE_RECEIVING_CONTENT = 205 # Admin sending new content (text/file)
 ADMIN_DELIVERING_SERVICE_RECEIVING_FILE = 206 # Admin sending new file content
 ADMIN_DELIVERING_SERVICE_RECEIVING_TEXT = 207 # Admin sending new text content
+ADMIN_INVENTORY_IMPORT_FILE = 208 # Admin uploading a file of credentials for the inventory
 
 
 # Bot configuration
 ADMIN_ID = int(os.getenv("ADMIN_TELEGRAM_ID", "0"))
 
+# Database configuration
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4")) # Threads serving async_db calls
+
+# SQLite pragma profiles applied to every new connection.
+# "legacy" keeps SQLite's defaults (rollback journal, fsync on every commit).
+DB_PRAGMA_PROFILES = {
+    "legacy": {},
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000, # Negative value = size in KiB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000, # Milliseconds
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "mmap_size": 64 * 1024 * 1024,
+        "cache_size": -16000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 10000,
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "mmap_size": 256 * 1024 * 1024,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+DB_PRAGMA_PROFILE = os.getenv("DB_PRAGMA_PROFILE", "balanced")
+if DB_PRAGMA_PROFILE not in DB_PRAGMA_PROFILES:
+    raise ValueError(f"Invalid DB_PRAGMA_PROFILE: {DB_PRAGMA_PROFILE} (choose from {', '.join(DB_PRAGMA_PROFILES)})")
+
+# Individual pragmas can be overridden on top of the selected profile
+# (e.g. DB_SYNCHRONOUS=FULL or DB_MMAP_SIZE=0)
+DB_PRAGMAS = dict(DB_PRAGMA_PROFILES[DB_PRAGMA_PROFILE])
+for _pragma in ("journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "busy_timeout"):
+    _override = os.getenv(f"DB_{_pragma.upper()}")
+    if _override:
+        DB_PRAGMAS[_pragma] = _override
+
+# In-process cache of user rows (database.get_user)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300")) # Seconds
+
+# Run mode: "polling" (getUpdates) or "webhook" (Telegram pushes updates to our HTTP server)
+RUN_MODE = os.getenv("RUN_MODE", "polling").lower()
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", os.getenv("WEB_PORT", "8080")))
+HEALTH_SERVER = os.getenv("HEALTH_SERVER", "1") == "1" # Serve the health route in polling mode too
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "") # Public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "") # Random per start if empty
+
+# Bot API endpoint (a local Bot API server, or benchmarks/fake_bot_api.py for load tests)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+BOT_API_BASE_FILE_URL = os.getenv("BOT_API_BASE_FILE_URL", "https://api.telegram.org/file/bot")
+
+# Updates processed concurrently (updates of the same chat always run one at a time, in order)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+# Flood control on incoming updates (checked before any handler; a rate of 0 disables that limit)
+FLOOD_USER_RATE = float(os.getenv("FLOOD_USER_RATE", "1")) # Updates per second one user may send
+FLOOD_USER_BURST = float(os.getenv("FLOOD_USER_BURST", "5")) # Updates one user may send at once
+FLOOD_GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "100")) # Updates per second from all users together
+FLOOD_GLOBAL_BURST = float(os.getenv("FLOOD_GLOBAL_BURST", "200"))
+FLOOD_NOTICE_INTERVAL = float(os.getenv("FLOOD_NOTICE_INTERVAL", "10")) # Seconds between "slow down" replies to one user
+
+# Admin panel
+ADMIN_USERS_PAGE_SIZE = int(os.getenv("ADMIN_USERS_PAGE_SIZE", "10")) # Users per page in the admin user browser
+ADMIN_REQUESTS_PAGE_SIZE = int(os.getenv("ADMIN_REQUESTS_PAGE_SIZE", "20")) # Requests per page in bulk approve/reject
+ADMIN_CHAT_TTL = float(os.getenv("ADMIN_CHAT_TTL", "1800")) # Seconds of silence after which an admin-user chat stops relaying
+
+# Broadcast engine (Telegram allows roughly 30 messages/s overall and 1 message/s per chat)
+BROADCAST_GLOBAL_RATE = float(os.getenv("BROADCAST_GLOBAL_RATE", "25")) # Messages per second across all chats
+BROADCAST_PER_CHAT_RATE = float(os.getenv("BROADCAST_PER_CHAT_RATE", "1")) # Messages per second to one chat
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8")) # Concurrent send_message calls
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5")) # Attempts per recipient (RetryAfter/network errors)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5")) # Seconds between progress edits
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "500")) # Recipients loaded per query
+
+# Credential inventory: approvals deliver a pre-loaded item; the admin is alerted when stock runs low
+INVENTORY_LOW_STOCK = int(os.getenv("INVENTORY_LOW_STOCK", "10")) # Alert when a service's stock drops to this
+INVENTORY_IMPORT_BATCH = int(os.getenv("INVENTORY_IMPORT_BATCH", "1000")) # Items inserted per transaction while importing
+
+# Subscription expiry: renewal reminders this many days before expiry (comma separated),
+# the most reminders/expirations handled per scheduler run, and the seconds to wait before
+# retrying a run that failed
+SUBSCRIPTION_REMINDER_DAYS = sorted(
+    (int(days) for days in os.getenv("SUBSCRIPTION_REMINDER_DAYS", "3,1").split(",") if days.strip()),
+    reverse=True
+)
+SUBSCRIPTION_BATCH_SIZE = int(os.getenv("SUBSCRIPTION_BATCH_SIZE", "500"))
+SUBSCRIPTION_RETRY_DELAY = float(os.getenv("SUBSCRIPTION_RETRY_DELAY", "60"))
+
+# Upload the connection guide images to the admin chat at startup so users get cached file_ids
+GUIDE_WARMUP = os.getenv("GUIDE_WARMUP", "1") == "1"
+
+# User activity write-behind: seconds between flushes of buffered last_activity/profile updates
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))
+
+# Conversation persistence: seconds between flushes of changed conversation states/user data to SQLite
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "5"))
+
 # Asset paths
 ASSETS_DIR = "assets"
 IMAGES_DIR = os.path.join(ASSETS_DIR, "images")
@@ -77,6 +185,14 @@ CONFIGS_DIR = os.path.join(ASSETS_DIR, "configs")
 os.makedirs(IMAGES_DIR, exist_ok=True)
 os.makedirs(CONFIGS_DIR, exist_ok=True)
 
+# Per-user config templates in CONFIGS_DIR, by service type (see config_generator.py).
+# Templates ending in .txt are sent as a message, anything else as a file.
+CONFIG_TEMPLATES = {
+    "openvpn": "openvpn.ovpn",
+    "v2ray": "v2ray.txt",
+    "proxy": "proxy.txt"
+}
+
 # App download links
 APP_LINKS = {
     "android": "https://play.google.com/store/apps/details?id=net.openvpn.openvpn",
@@ -94,6 +210,14 @@ ACCOUNT_TYPES = {
     "اکسس پوینت (Proxy)": 1000 # Example price
 }
 
+# Subscription length in days of each account type; approved purchases of other types never expire
+ACCOUNT_TYPE_DAYS = {
+    "1 ماهه (30 روز)": 30,
+    "3 ماهه (90 روز)": 90,
+    "6 ماهه (180 روز)": 180,
+    "1 ساله (365 روز)": 365,
+}
+
 # Service types (used for admin to set content/price, and for user request)
 SERVICE_TYPES = {
     "OpenVPN": "openvpn",
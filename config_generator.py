@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Config generator module for VPN Telegram Bot
+Renders per-user OpenVPN/V2Ray/proxy configs from the templates in config.CONFIGS_DIR
+(named in config.CONFIG_TEMPLATES). Rendering is cheap and runs inline; every result is
+cached per (user, request) in generated_configs so a config is only generated once.
+
+Templates use string.Template placeholders:
+    $user_id $request_id $label   the buyer, their request and a readable "service-user-request" label
+    $username $password           per-user login (OpenVPN auth-user-pass)
+    $uuid                         per-user client id (V2Ray/Xray)
+    $secret                       per-user MTProto proxy secret (32 hex digits)
+"""
+
+import os
+import secrets
+import string
+import uuid
+from typing import Any, Dict, Optional
+
+import async_db
+import config
+import metrics
+
+def template_path(service_type: str) -> Optional[str]:
+    """Path of the template for a service type, or None if there is none."""
+    name = config.CONFIG_TEMPLATES.get(service_type)
+    if not name:
+        return None
+    path = os.path.join(config.CONFIGS_DIR, name)
+    return path if os.path.isfile(path) else None
+
+def render(path: str, service_type: str, user_id: int, request_id: int) -> Dict[str, Any]:
+    """Generate per-user credentials and render the template."""
+    with open(path, encoding="utf-8") as f:
+        template = string.Template(f.read())
+    username = f"u{user_id}r{request_id}"
+    password = secrets.token_urlsafe(12)
+    values = {
+        "user_id": user_id,
+        "request_id": request_id,
+        "label": f"{service_type}-{user_id}-{request_id}",
+        "username": username,
+        "password": password,
+        "uuid": str(uuid.uuid4()),
+        "secret": secrets.token_hex(16),
+    }
+    try:
+        content = template.substitute(values)
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"Invalid placeholder in {path}: {e}") from None
+    extension = os.path.splitext(path)[1]
+    return {
+        "username": username,
+        "content": content,
+        "file_name": None if extension == ".txt" else f"{service_type}_{request_id}{extension}",
+    }
+
+async def generate(user_id: int, request_id: int, service_type: str) -> Optional[Dict[str, Any]]:
+    """Return the config of a user's purchase request, generating it on first use.
+    Returns None if the service type has no template."""
+    cached = await async_db.get_generated_config(user_id, request_id)
+    if cached is not None:
+        metrics.CONFIG_CACHE.inc(result="hit")
+        return cached
+    metrics.CONFIG_CACHE.inc(result="miss")
+    path = template_path(service_type)
+    if path is None:
+        return None
+    with metrics.CONFIG_GENERATION_SECONDS.time(service=service_type):
+        generated = render(path, service_type, user_id, request_id)
+    # If the same request was generated concurrently, the first stored config wins
+    return await async_db.save_generated_config(
+        user_id, request_id, service_type, generated["username"], generated["content"], generated["file_name"]
+    )
@@ -8,23 +8,62 @@ Handles all database operations including user management, credits, and services
 import sqlite3
 import os
 import threading
+import functools
 from contextlib import contextmanager
 from typing import Optional, List, Tuple, Dict, Any
 import datetime
 
+import config
+import metrics
+from cache import LRUCache
+
 # Database file path
 DB_PATH = "vpn_bot.db"
 
+# Pragmas applied to every new connection (see config.DB_PRAGMA_PROFILES)
+DB_PRAGMAS = config.DB_PRAGMAS
+
+# Only these pragmas may be set through the profile
+ALLOWED_PRAGMAS = ("journal_mode", "synchronous", "mmap_size", "cache_size", "temp_store", "busy_timeout")
+
 # Thread-local storage for database connections
 thread_local = threading.local()
 
+# Read-through cache of user rows keyed by user id
+user_cache = LRUCache(max_size=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+
+metrics.FunctionMetric("bot_user_cache_hits_total", "User cache hits", "counter", lambda: user_cache.hits)
+metrics.FunctionMetric("bot_user_cache_misses_total", "User cache misses", "counter", lambda: user_cache.misses)
+metrics.FunctionMetric("bot_user_cache_size", "Users currently cached", "gauge", lambda: user_cache.stats()['size'])
+
+def apply_pragmas(conn: sqlite3.Connection, pragmas: Dict[str, Any]) -> None:
+    """Apply a pragma profile to an open connection."""
+    for name, value in pragmas.items():
+        value = str(value)
+        if name not in ALLOWED_PRAGMAS or not value.lstrip('-').isalnum():
+            raise ValueError(f"Invalid pragma setting: {name}={value}")
+        conn.execute(f"PRAGMA {name} = {value}")
+
+def open_connection(db_path: Optional[str] = None, pragmas: Optional[Dict[str, Any]] = None) -> sqlite3.Connection:
+    """Open a new database connection with the pragma profile applied."""
+    conn = sqlite3.connect(db_path or DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    apply_pragmas(conn, DB_PRAGMAS if pragmas is None else pragmas)
+    return conn
+
 def get_db_connection():
     """Get thread-local database connection"""
     if not hasattr(thread_local, 'connection'):
-        thread_local.connection = sqlite3.connect(DB_PATH, check_same_thread=False)
-        thread_local.connection.row_factory = sqlite3.Row
+        thread_local.connection = open_connection()
     return thread_local.connection
 
+def close_db_connection() -> None:
+    """Close this thread's database connection (a new one is opened on next use)."""
+    conn = getattr(thread_local, 'connection', None)
+    if conn is not None:
+        conn.close()
+        del thread_local.connection
+
 @contextmanager
 def get_db():
     """Context manager for database operations"""
@@ -37,6 +76,22 @@ def get_db():
     else:
         conn.commit()
 
+@contextmanager
+def get_db_immediate():
+    """Context manager for a write transaction that takes the write lock up front (BEGIN IMMEDIATE)"""
+    conn = get_db_connection()
+    if conn.in_transaction:
+        conn.commit()
+    with metrics.DB_LOCK_WAIT_SECONDS.time():
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except Exception as e:
+        conn.rollback()
+        raise e
+    else:
+        conn.commit()
+
 def init_database():
     """Initialize database with required tables"""
     with get_db() as conn:
@@ -119,16 +174,253 @@ def init_database():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 account_type TEXT,
+                requested_service TEXT,
+                requested_device TEXT,
                 request_date TEXT,
-                status TEXT DEFAULT 'pending', -- 'pending', 'approved', 'rejected'
+                status TEXT DEFAULT 'pending', -- 'pending', 'approved', 'rejected', 'expired'
+                starts_at TEXT, -- subscription start (set on approval)
+                expires_at TEXT, -- NULL for account types that never expire
+                reminded_days INTEGER, -- days-before-expiry of the last renewal reminder sent
+                notify_at TEXT, -- next reminder or expiry due for the scheduler (NULL when none)
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
         """)
+
+        # Databases created before these columns existed need them added
+        _ensure_columns(cursor, "purchase_requests", {
+            "requested_service": "TEXT",
+            "requested_device": "TEXT",
+            "starts_at": "TEXT",
+            "expires_at": "TEXT",
+            "reminded_days": "INTEGER",
+            "notify_at": "TEXT",
+        })
+        _backfill_account_type_names(cursor)
+
+        # Indexes matching the filtered/sorted queries below
+        # (checked by benchmarks/check_query_plans.py)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_is_approved ON users (is_approved)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchase_requests_status_date ON purchase_requests (status, request_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchase_requests_user_date ON purchase_requests (user_id, request_date)")
+        # (status, id): keyset pages and id lists of the requests in one status
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchase_requests_status ON purchase_requests (status)")
+        # Only subscriptions with a pending reminder/expiry: the scheduler reads the earliest ones
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchase_requests_notify ON purchase_requests (notify_at) WHERE notify_at IS NOT NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_messages_answered_date ON support_messages (is_answered, message_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_support_messages_date ON support_messages (message_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_credit_transfers_sender ON credit_transfers (sender_id, transfer_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_credit_transfers_receiver ON credit_transfers (receiver_id, transfer_date)")
+
+        # Broadcast jobs and their per-recipient delivery status (resumable after restart)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_chat_id INTEGER,
+                progress_message_id INTEGER,
+                message_text TEXT,
+                status TEXT DEFAULT 'running', -- 'running', 'completed'
+                total INTEGER DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                created_date TEXT,
+                finished_date TEXT
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                job_id INTEGER,
+                user_id INTEGER,
+                status TEXT DEFAULT 'pending', -- 'pending', 'sent', 'failed'
+                error TEXT,
+                PRIMARY KEY (job_id, user_id),
+                FOREIGN KEY (job_id) REFERENCES broadcast_jobs (id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients (job_id, status, user_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)")
+
+        # Telegram file_ids of uploaded media, keyed by local path + file fingerprint
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS media_file_ids (
+                path TEXT PRIMARY KEY,
+                fingerprint TEXT, -- mtime and size of the file when it was uploaded
+                file_id TEXT,
+                updated_date TEXT
+            )
+        """)
+
+        # python-telegram-bot persistence: pickled user/chat/bot data and conversation states
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS persistence_data (
+                kind TEXT NOT NULL, -- 'user', 'chat' or 'bot'
+                key INTEGER NOT NULL, -- user/chat ID (0 for bot data)
+                data BLOB NOT NULL,
+                updated_date TEXT,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS persistence_conversations (
+                name TEXT NOT NULL, -- ConversationHandler name
+                key TEXT NOT NULL, -- JSON-encoded conversation key (chat/user IDs)
+                state TEXT NOT NULL, -- JSON-encoded state
+                updated_date TEXT,
+                PRIMARY KEY (name, key)
+            ) WITHOUT ROWID
+        """)
+
+        # Pre-provisioned credentials/configs, handed out one per approved purchase request
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS inventory_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                service_type TEXT NOT NULL, -- 'openvpn', 'v2ray', 'proxy'
+                content TEXT NOT NULL, -- credential/link, or the config file's text when is_file
+                is_file INTEGER DEFAULT 0,
+                file_name TEXT,
+                added_date TEXT,
+                claimed_by INTEGER, -- user the item was delivered to (NULL while in stock)
+                request_id INTEGER,
+                claimed_date TEXT,
+                UNIQUE (service_type, content)
+            )
+        """)
+        # Unclaimed stock in FIFO order: the claim query and the stock counts read only this
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_unclaimed ON inventory_items (service_type, id) WHERE claimed_by IS NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_request ON inventory_items (request_id) WHERE request_id IS NOT NULL")
+
+        # Per-user configs rendered by config_generator, cached per purchase request
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS generated_configs (
+                user_id INTEGER NOT NULL,
+                request_id INTEGER NOT NULL,
+                service_type TEXT NOT NULL,
+                username TEXT, -- VPN login created for the user
+                content TEXT NOT NULL, -- rendered config/link as delivered
+                file_name TEXT, -- set when the config is sent as a file
+                created_date TEXT,
+                PRIMARY KEY (user_id, request_id)
+            )
+        """)
+
+        # Materialized statistics counters (single row), kept current by triggers
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_counters (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_users INTEGER NOT NULL DEFAULT 0,
+                approved_users INTEGER NOT NULL DEFAULT 0,
+                pending_users INTEGER NOT NULL DEFAULT 0,
+                total_credit INTEGER NOT NULL DEFAULT 0,
+                total_discount_codes INTEGER NOT NULL DEFAULT 0,
+                total_support_messages INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_counters_users_insert AFTER INSERT ON users
+            BEGIN
+                UPDATE bot_counters SET
+                    total_users = total_users + 1,
+                    approved_users = approved_users + IFNULL(NEW.is_approved = 1, 0),
+                    pending_users = pending_users + IFNULL(NEW.is_approved = 0, 0),
+                    total_credit = total_credit + IFNULL(NEW.credit, 0)
+                WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_counters_users_delete AFTER DELETE ON users
+            BEGIN
+                UPDATE bot_counters SET
+                    total_users = total_users - 1,
+                    approved_users = approved_users - IFNULL(OLD.is_approved = 1, 0),
+                    pending_users = pending_users - IFNULL(OLD.is_approved = 0, 0),
+                    total_credit = total_credit - IFNULL(OLD.credit, 0)
+                WHERE id = 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_counters_users_update AFTER UPDATE OF is_approved, credit ON users
+            BEGIN
+                UPDATE bot_counters SET
+                    approved_users = approved_users + IFNULL(NEW.is_approved = 1, 0) - IFNULL(OLD.is_approved = 1, 0),
+                    pending_users = pending_users + IFNULL(NEW.is_approved = 0, 0) - IFNULL(OLD.is_approved = 0, 0),
+                    total_credit = total_credit + IFNULL(NEW.credit, 0) - IFNULL(OLD.credit, 0)
+                WHERE id = 1;
+            END
+        """)
+        for table, column in (("discount_codes", "total_discount_codes"), ("support_messages", "total_support_messages")):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_counters_{table}_insert AFTER INSERT ON {table}
+                BEGIN
+                    UPDATE bot_counters SET {column} = {column} + 1 WHERE id = 1;
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_counters_{table}_delete AFTER DELETE ON {table}
+                BEGIN
+                    UPDATE bot_counters SET {column} = {column} - 1 WHERE id = 1;
+                END
+            """)
+        # First run (or upgrade of an existing database): seed the counters from the tables
+        cursor.execute("SELECT 1 FROM bot_counters WHERE id = 1")
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT INTO bot_counters (id) VALUES (1)")
+            _write_counters(cursor, _compute_counters(cursor))
         
         conn.commit()
 
+def _ensure_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]) -> None:
+    """Add any missing columns to an existing table."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, declaration in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+def _backfill_account_type_names(cursor: sqlite3.Cursor) -> None:
+    """Requests made while the purchase keyboard sent the price instead of the account type
+    name: store the name, and give the approved ones the expiry dates they missed."""
+    names_by_price: Dict[str, List[str]] = {}
+    for name, price in config.ACCOUNT_TYPES.items():
+        names_by_price.setdefault(str(price), []).append(name)
+    for price, names in names_by_price.items():
+        if len(names) == 1: # An ambiguous price cannot be mapped back
+            cursor.execute("UPDATE purchase_requests SET account_type = ? WHERE account_type = ?", (names[0], price))
+    if not config.ACCOUNT_TYPE_DAYS:
+        return
+    placeholders = ", ".join("?" for _ in config.ACCOUNT_TYPE_DAYS)
+    cursor.execute(
+        f"""SELECT id, account_type, starts_at FROM purchase_requests
+            WHERE status = 'approved' AND expires_at IS NULL AND starts_at IS NOT NULL AND account_type IN ({placeholders})""",
+        tuple(config.ACCOUNT_TYPE_DAYS)
+    )
+    now = datetime.datetime.now().replace(microsecond=0)
+    updates = []
+    for row in cursor.fetchall():
+        try:
+            starts = datetime.datetime.fromisoformat(row['starts_at'])
+        except ValueError:
+            continue
+        expires = starts + datetime.timedelta(days=config.ACCOUNT_TYPE_DAYS[row['account_type']])
+        updates.append((expires.isoformat(), _next_notify_at(expires, now, None).isoformat(), row['id']))
+    cursor.executemany("UPDATE purchase_requests SET expires_at = ?, notify_at = ? WHERE id = ?", updates)
+
 # --- User Management ---
 
+def _invalidates_user(func):
+    """Drop the user row (first argument) from user_cache once the write has committed."""
+    @functools.wraps(func)
+    def wrapper(user_id, *args, **kwargs):
+        try:
+            return func(user_id, *args, **kwargs)
+        finally:
+            user_cache.invalidate(user_id)
+    return wrapper
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    """Get hit/miss counters of the user cache."""
+    return user_cache.stats()
+
+
+@_invalidates_user
 def add_user(user_id: int, username: str, first_name: str, last_name: str) -> None:
     """Add a new user if not exists, or update username/names if changed."""
     with get_db() as conn:
@@ -148,13 +440,22 @@ def add_user(user_id: int, username: str, first_name: str, last_name: str) -> No
         conn.commit()
 
 def get_user(user_id: int) -> Optional[Dict[str, Any]]:
-    """Retrieve user details by ID."""
+    """Retrieve user details by ID (served from user_cache when possible)."""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
+    generation = user_cache.generation
     with get_db() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         user = cursor.fetchone()
-        return dict(user) if user else None
+    if not user:
+        return None
+    user = dict(user)
+    user_cache.set(user_id, user, generation)
+    return dict(user)
 
+@_invalidates_user
 def update_user_info(user_id: int, **kwargs) -> bool:
     """Update specific user information (phone_number, full_name, requested_os)."""
     with get_db() as conn:
@@ -180,6 +481,7 @@ def update_user_info(user_id: int, **kwargs) -> bool:
             print(f"Database error during user info update: {e}")
             return False
 
+@_invalidates_user
 def update_user_activity(user_id: int) -> None:
     """Update the last activity timestamp for a user."""
     with get_db() as conn:
@@ -188,6 +490,29 @@ def update_user_activity(user_id: int) -> None:
         cursor.execute("UPDATE users SET last_activity = ? WHERE id = ?", (current_date, user_id))
         conn.commit()
 
+def save_user_activity(activity: List[Tuple[str, int]], profiles: List[Tuple[Optional[str], str, str, str, int]]) -> bool:
+    """Write buffered activity in one transaction: (last_activity, user_id) rows, and
+    (username, first_name, last_name, last_activity, user_id) rows for profile refreshes."""
+    try:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE users SET last_activity = ? WHERE id = ?", activity)
+            cursor.executemany(
+                "UPDATE users SET username = ?, first_name = ?, last_name = ?, last_activity = ? WHERE id = ?",
+                profiles
+            )
+    except sqlite3.Error as e:
+        print(f"Database error while saving user activity: {e}")
+        return False
+    # Patch the cached rows instead of dropping them: these are the most active users
+    user_cache.update((user_id, {'last_activity': last_activity}) for last_activity, user_id in activity)
+    user_cache.update(
+        (user_id, {'username': username, 'first_name': first_name, 'last_name': last_name, 'last_activity': last_activity})
+        for username, first_name, last_name, last_activity, user_id in profiles
+    )
+    return True
+
+@_invalidates_user
 def approve_user(user_id: int) -> bool:
     """Approve a user."""
     with get_db() as conn:
@@ -199,6 +524,7 @@ def approve_user(user_id: int) -> bool:
         except sqlite3.Error:
             return False
 
+@_invalidates_user
 def reject_user(user_id: int) -> bool:
     """Reject a user (set is_approved to 0 again)."""
     with get_db() as conn:
@@ -224,6 +550,26 @@ def get_pending_users() -> List[Dict[str, Any]]:
         cursor.execute("SELECT * FROM users WHERE is_approved = 0")
         return [dict(row) for row in cursor.fetchall()]
 
+def get_users_page(after_id: int = 0, before_id: Optional[int] = None, limit: int = 10, pending_only: bool = False) -> List[Dict[str, Any]]:
+    """Get one page of users ordered by id using keyset pagination.
+    Returns up to `limit` users with id > after_id, or, if before_id is given, the
+    `limit` users immediately before it. Rows are always in ascending id order."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        approved_filter = "is_approved = 0 AND " if pending_only else ""
+        if before_id is not None:
+            cursor.execute(
+                f"SELECT * FROM users WHERE {approved_filter}id < ? ORDER BY id DESC LIMIT ?",
+                (before_id, limit)
+            )
+            return [dict(row) for row in reversed(cursor.fetchall())]
+        cursor.execute(
+            f"SELECT * FROM users WHERE {approved_filter}id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+@_invalidates_user
 def increase_credit(user_id: int, amount: int) -> bool:
     """Increase user's credit."""
     with get_db() as conn:
@@ -235,6 +581,7 @@ def increase_credit(user_id: int, amount: int) -> bool:
         except sqlite3.Error:
             return False
 
+@_invalidates_user
 def decrease_credit(user_id: int, amount: int) -> bool:
     """Decrease user's credit, ensuring it doesn't go below zero."""
     with get_db() as conn:
@@ -251,8 +598,63 @@ def decrease_credit(user_id: int, amount: int) -> bool:
         except (sqlite3.Error, TypeError): # TypeError if fetchone()[0] fails (user not found)
             return False
 
+# --- Catalog Cache ---
+# services, service_prices and discount_codes are tiny and rarely written, so reads are
+# served from an in-memory snapshot. Every admin edit bumps _catalog_version after
+# committing; the next read sees the new version and reloads. Redemptions only replace
+# the redeemed code's entry with its new usage_count (use_discount_code).
+
+_catalog_lock = threading.Lock()
+_catalog_version = 0
+_catalog: Optional[Dict[str, Any]] = None
+
+def _bumps_catalog(func):
+    """Bump the catalog version once a catalog write has committed."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _catalog_version
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with _catalog_lock:
+                _catalog_version += 1
+    return wrapper
+
+def load_catalog() -> Dict[str, Any]:
+    """Return the current catalog snapshot, reloading it from the database if a write bumped the version."""
+    global _catalog
+    snapshot = _catalog
+    if snapshot is not None and snapshot['version'] == _catalog_version:
+        return snapshot
+    with _catalog_lock:
+        if _catalog is not None and _catalog['version'] == _catalog_version:
+            return _catalog
+        version = _catalog_version
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM services")
+            services = {row['type']: dict(row) for row in cursor.fetchall()}
+            cursor.execute("SELECT service_type, price FROM service_prices")
+            prices = {row[0]: row[1] for row in cursor.fetchall()}
+            cursor.execute("SELECT * FROM discount_codes")
+            discount_codes = {row['code']: dict(row) for row in cursor.fetchall()}
+        _catalog = {
+            'version': version,
+            'services': services,
+            'service_prices': prices,
+            'discount_codes': discount_codes,
+        }
+        return _catalog
+
+def get_catalog_version() -> int:
+    """Get the current catalog version."""
+    return _catalog_version
+
+metrics.FunctionMetric("bot_catalog_version", "Catalog version (bumped on every admin edit of services, prices or discount codes)", "gauge", get_catalog_version)
+
 # --- Discount Codes ---
 
+@_bumps_catalog
 def add_discount_code(code: str, value: int) -> bool:
     """Add a new discount code."""
     with get_db() as conn:
@@ -272,29 +674,35 @@ def add_discount_code(code: str, value: int) -> bool:
 
 def get_discount_code(code: str) -> Optional[Dict[str, Any]]:
     """Retrieve a discount code."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM discount_codes WHERE code = ?", (code,))
-        code_data = cursor.fetchone()
-        return dict(code_data) if code_data else None
+    code_data = load_catalog()['discount_codes'].get(code)
+    return dict(code_data) if code_data else None
 
 def use_discount_code(code: str) -> Optional[int]:
-    """Apply a discount code and increment its usage count."""
+    """Apply a discount code and increment its usage count.
+    Only the code's entry in the catalog snapshot is updated; redemptions do not bump the catalog."""
     with get_db() as conn:
         cursor = conn.cursor()
         try:
             cursor.execute("SELECT value FROM discount_codes WHERE code = ?", (code,))
             result = cursor.fetchone()
-            if result:
-                value = result[0]
-                cursor.execute("UPDATE discount_codes SET usage_count = usage_count + 1 WHERE code = ?", (code,))
-                conn.commit()
-                return value
-            return None # Code not found
+            if not result:
+                return None # Code not found
+            value = result[0]
+            cursor.execute("UPDATE discount_codes SET usage_count = usage_count + 1 WHERE code = ?", (code,))
+            cursor.execute("SELECT usage_count FROM discount_codes WHERE code = ?", (code,))
+            usage_count = cursor.fetchone()[0]
+            conn.commit()
         except sqlite3.Error:
             conn.rollback()
             return None
+    with _catalog_lock:
+        entry = _catalog['discount_codes'].get(code) if _catalog is not None else None
+        if entry is not None:
+            # The count read in the transaction is absolute, so a reload racing with this stays correct
+            _catalog['discount_codes'][code] = {**entry, 'usage_count': usage_count}
+    return value
 
+@_bumps_catalog
 def delete_discount_code(code: str) -> bool:
     """Delete a discount code."""
     with get_db() as conn:
@@ -308,13 +716,11 @@ def delete_discount_code(code: str) -> bool:
 
 def get_all_discount_codes() -> List[Dict[str, Any]]:
     """Get all discount codes."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM discount_codes")
-        return [dict(row) for row in cursor.fetchall()]
+    return [dict(row) for row in load_catalog()['discount_codes'].values()]
 
 # --- Services (config/link storage) ---
 
+@_bumps_catalog
 def set_service(service_type: str, content: str, is_file: bool, file_name: Optional[str] = None) -> bool:
     """Set or update the content for a service type."""
     with get_db() as conn:
@@ -332,12 +738,10 @@ def set_service(service_type: str, content: str, is_file: bool, file_name: Optio
 
 def get_service(service_type: str) -> Optional[Dict[str, Any]]:
     """Retrieve service content by type."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM services WHERE type = ?", (service_type,))
-        service = cursor.fetchone()
-        return dict(service) if service else None
+    service = load_catalog()['services'].get(service_type)
+    return dict(service) if service else None
 
+@_bumps_catalog
 def delete_service(service_type: str) -> bool:
     """Delete a service."""
     with get_db() as conn:
@@ -351,14 +755,12 @@ def delete_service(service_type: str) -> bool:
 
 def get_all_services() -> List[Dict[str, Any]]:
     """Get all defined services."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM services")
-        return [dict(row) for row in cursor.fetchall()]
+    return [dict(row) for row in load_catalog()['services'].values()]
 
 
 # --- Service Prices ---
 
+@_bumps_catalog
 def set_service_price(service_type: str, price: int) -> bool:
     """Set or update the price for a service type."""
     with get_db() as conn:
@@ -376,18 +778,11 @@ def set_service_price(service_type: str, price: int) -> bool:
 
 def get_service_price(service_type: str) -> Optional[int]:
     """Retrieve the price for a service type."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT price FROM service_prices WHERE service_type = ?", (service_type,))
-        result = cursor.fetchone()
-        return result[0] if result else None
+    return load_catalog()['service_prices'].get(service_type)
 
 def get_all_service_prices() -> Dict[str, int]:
     """Get all defined service prices."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT service_type, price FROM service_prices")
-        return {row[0]: row[1] for row in cursor.fetchall()}
+    return dict(load_catalog()['service_prices'])
 
 # --- Credit Transfers ---
 
@@ -407,6 +802,40 @@ def add_credit_transfer(sender_id: int, receiver_id: int, amount: int) -> bool:
         except sqlite3.Error:
             return False
 
+def transfer_credit(sender_id: int, receiver_id: int, amount: int) -> Optional[Tuple[int, int]]:
+    """Move credit between users and record the transfer in a single transaction.
+    Returns (sender_credit, receiver_credit) after the transfer, or None if the sender
+    does not have enough credit, either user does not exist, or the transaction failed."""
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            # Conditional debit: only succeeds if the sender can cover the amount
+            cursor.execute(
+                "UPDATE users SET credit = credit - ? WHERE id = ? AND credit >= ?",
+                (amount, sender_id, amount)
+            )
+            if cursor.rowcount != 1:
+                conn.rollback()
+                return None
+            cursor.execute("UPDATE users SET credit = credit + ? WHERE id = ?", (amount, receiver_id))
+            if cursor.rowcount != 1:
+                conn.rollback() # Receiver not found, undo the debit
+                return None
+            current_date = datetime.datetime.now().isoformat()
+            cursor.execute(
+                """INSERT INTO credit_transfers (sender_id, receiver_id, amount, transfer_date)
+                   VALUES (?, ?, ?, ?)""",
+                (sender_id, receiver_id, amount, current_date)
+            )
+            cursor.execute("SELECT id, credit FROM users WHERE id IN (?, ?)", (sender_id, receiver_id))
+            credits = {row['id']: row['credit'] for row in cursor.fetchall()}
+            return credits[sender_id], credits[receiver_id]
+    except sqlite3.Error as e:
+        print(f"Database error during credit transfer: {e}")
+        return None
+    finally:
+        user_cache.invalidate(sender_id, receiver_id)
+
 def get_credit_transfers_for_user(user_id: int) -> List[Dict[str, Any]]:
     """Get all credit transfers for a given user (as sender or receiver)."""
     with get_db() as conn:
@@ -455,6 +884,19 @@ def get_support_messages(answered: Optional[bool] = None) -> List[Dict[str, Any]
             cursor.execute("SELECT * FROM support_messages WHERE is_answered = ? ORDER BY message_date DESC", (status,))
         return [dict(row) for row in cursor.fetchall()]
 
+def get_support_messages_with_users(answered: Optional[bool] = None) -> List[Dict[str, Any]]:
+    """Get support messages with the sender's username and full_name in a single query."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        query = """SELECT sm.*, u.username, u.full_name
+                   FROM support_messages sm LEFT JOIN users u ON u.id = sm.user_id"""
+        if answered is None:
+            cursor.execute(f"{query} ORDER BY sm.message_date DESC")
+        else:
+            status = 1 if answered else 0
+            cursor.execute(f"{query} WHERE sm.is_answered = ? ORDER BY sm.message_date DESC", (status,))
+        return [dict(row) for row in cursor.fetchall()]
+
 def mark_support_message_answered(message_id: int) -> bool:
     """Mark a support message as answered."""
     with get_db() as conn:
@@ -506,8 +948,47 @@ def get_purchase_requests_by_status(status: str) -> List[Dict[str, Any]]:
         cursor.execute("SELECT * FROM purchase_requests WHERE status = ? ORDER BY request_date DESC", (status,))
         return [dict(row) for row in cursor.fetchall()]
 
+def get_purchase_requests_with_users(status: str) -> List[Dict[str, Any]]:
+    """Retrieve purchase requests by status with the owner's username and full_name in a single query."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT pr.*, u.username, u.full_name
+               FROM purchase_requests pr LEFT JOIN users u ON u.id = pr.user_id
+               WHERE pr.status = ? ORDER BY pr.request_date DESC""",
+            (status,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_purchase_requests_page(status: str, after_id: int = 0, before_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """Get one page of requests in a status ordered by id using keyset pagination (same
+    cursor rules as get_users_page). Rows only carry id, user_id and account_type."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        if before_id is not None:
+            cursor.execute(
+                "SELECT id, user_id, account_type FROM purchase_requests WHERE status = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (status, before_id, limit)
+            )
+            return [dict(row) for row in reversed(cursor.fetchall())]
+        cursor.execute(
+            "SELECT id, user_id, account_type FROM purchase_requests WHERE status = ? AND id > ? ORDER BY id LIMIT ?",
+            (status, after_id, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_purchase_request_ids(status: str) -> List[int]:
+    """IDs of every request in a status (read from the status index only)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM purchase_requests WHERE status = ? ORDER BY id", (status,))
+        return [row[0] for row in cursor.fetchall()]
+
 def update_purchase_request_status(request_id: int, new_status: str) -> bool:
-    """Update the status of a purchase request."""
+    """Update the status of a purchase request. Approval only applies to a pending
+    request, so that its subscription starts in the same update."""
+    if new_status == 'approved':
+        return bool(update_purchase_requests_status([request_id], new_status))
     with get_db() as conn:
         cursor = conn.cursor()
         try:
@@ -517,46 +998,497 @@ def update_purchase_request_status(request_id: int, new_status: str) -> bool:
         except sqlite3.Error:
             return False
 
+# Bound parameters per IN (...) list (old SQLite builds allow 999 per statement)
+IN_CHUNK_SIZE = 500
+
+def update_purchase_requests_status(request_ids: List[int], new_status: str, from_status: str = 'pending') -> List[Tuple[int, int, str]]:
+    """Move every listed request still in from_status to new_status in one transaction; approval
+    sets the subscription dates in the same update. Returns (request_id, user_id, requested_service)
+    of the requests that changed; requests already handled are skipped."""
+    request_ids = sorted(set(request_ids))
+    if not request_ids:
+        return []
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            changed: List[Tuple[int, int, str]] = []
+            for start in range(0, len(request_ids), IN_CHUNK_SIZE):
+                chunk = request_ids[start:start + IN_CHUNK_SIZE]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor.execute(
+                    f"SELECT id, user_id, requested_service, account_type FROM purchase_requests WHERE status = ? AND id IN ({placeholders})",
+                    (from_status, *chunk)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    continue
+                if new_status == 'approved':
+                    now = datetime.datetime.now().replace(microsecond=0)
+                    cursor.executemany(
+                        """UPDATE purchase_requests SET status = ?, starts_at = ?, expires_at = ?, reminded_days = NULL, notify_at = ?
+                           WHERE id = ? AND status = ?""",
+                        [(new_status, *_subscription_dates(row['account_type'], now), row['id'], from_status) for row in rows]
+                    )
+                else:
+                    placeholders = ", ".join("?" for _ in rows)
+                    cursor.execute(
+                        f"UPDATE purchase_requests SET status = ? WHERE id IN ({placeholders})",
+                        (new_status, *(row['id'] for row in rows))
+                    )
+                changed.extend((row['id'], row['user_id'], row['requested_service']) for row in rows)
+            return changed
+    except sqlite3.Error as e:
+        print(f"Database error during bulk purchase request update: {e}")
+        return []
+
+# --- Subscriptions ---
+
+def _next_notify_at(expires: datetime.datetime, now: datetime.datetime, reminded_days: Optional[int]) -> datetime.datetime:
+    """Next time the scheduler must look at a subscription: its next unsent reminder still ahead, else its expiry."""
+    for days in config.SUBSCRIPTION_REMINDER_DAYS: # Largest offset first
+        if reminded_days is not None and days >= reminded_days:
+            continue
+        remind_at = expires - datetime.timedelta(days=days)
+        if remind_at > now:
+            return remind_at
+    return expires
+
+def _due_reminder(expires: datetime.datetime, now: datetime.datetime, reminded_days: Optional[int]) -> Optional[int]:
+    """The reminder offset (days) whose time has come and that was not sent yet; only the latest one
+    is returned, so a bot that was offline sends one reminder instead of several."""
+    due = [
+        days for days in config.SUBSCRIPTION_REMINDER_DAYS
+        if expires - datetime.timedelta(days=days) <= now and (reminded_days is None or days < reminded_days)
+    ]
+    return min(due) if due else None
+
+def _subscription_dates(account_type: str, now: datetime.datetime) -> Tuple[str, Optional[str], Optional[str]]:
+    """(starts_at, expires_at, notify_at) of a subscription approved now; account types
+    without a length in config.ACCOUNT_TYPE_DAYS never expire."""
+    days = config.ACCOUNT_TYPE_DAYS.get(account_type)
+    if not days:
+        return now.isoformat(), None, None
+    expires = now + datetime.timedelta(days=days)
+    return now.isoformat(), expires.isoformat(), _next_notify_at(expires, now, None).isoformat()
+
+def get_next_subscription_due() -> Optional[str]:
+    """Earliest pending reminder/expiry time (ISO format), or None if no subscription is waiting for one."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(notify_at) FROM purchase_requests WHERE notify_at IS NOT NULL")
+        return cursor.fetchone()[0]
+
+def process_due_subscriptions(limit: int = 500) -> Optional[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """Handle up to limit subscriptions whose reminder or expiry is due, in one transaction: reminders
+    move on to the next reminder (or the expiry) and expired subscriptions are marked 'expired'.
+    Returns (reminders, expired) as dicts with id, user_id, account_type and expires_at, or None on a
+    database error; notifying the users is up to the caller. Rows with an unreadable expires_at are
+    taken off the schedule so they cannot stall it."""
+    now = datetime.datetime.now().replace(microsecond=0)
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """SELECT id, user_id, account_type, status, expires_at, reminded_days FROM purchase_requests
+                   WHERE notify_at <= ? ORDER BY notify_at LIMIT ?""",
+                (now.isoformat(), limit)
+            )
+            reminders: List[Dict[str, Any]] = []
+            expired: List[Dict[str, Any]] = []
+            rescheduled: List[Tuple[Optional[int], str, int]] = []
+            cleared: List[Tuple[int]] = []
+            for row in cursor.fetchall():
+                if row['status'] != 'approved' or not row['expires_at']:
+                    cleared.append((row['id'],)) # No longer an active subscription
+                    continue
+                try:
+                    expires = datetime.datetime.fromisoformat(row['expires_at'])
+                except (TypeError, ValueError):
+                    print(f"Invalid expires_at {row['expires_at']!r} of purchase request {row['id']}; not scheduled")
+                    cleared.append((row['id'],))
+                    continue
+                subscription = {key: row[key] for key in ('id', 'user_id', 'account_type', 'expires_at')}
+                if expires <= now:
+                    expired.append(subscription)
+                    continue
+                reminded_days = _due_reminder(expires, now, row['reminded_days'])
+                if reminded_days is None:
+                    reminded_days = row['reminded_days']
+                else:
+                    reminders.append(subscription)
+                rescheduled.append((reminded_days, _next_notify_at(expires, now, reminded_days).isoformat(), row['id']))
+            cursor.executemany("UPDATE purchase_requests SET reminded_days = ?, notify_at = ? WHERE id = ?", rescheduled)
+            cursor.executemany(
+                "UPDATE purchase_requests SET status = 'expired', notify_at = NULL WHERE id = ?",
+                [(subscription['id'],) for subscription in expired]
+            )
+            cursor.executemany("UPDATE purchase_requests SET notify_at = NULL WHERE id = ?", cleared)
+            return reminders, expired
+    except sqlite3.Error as e:
+        print(f"Database error while processing due subscriptions: {e}")
+        return None
+
+
+# --- Broadcast Jobs ---
+
+def create_broadcast_job(admin_chat_id: int, message_text: str) -> int:
+    """Create a broadcast job with every current user as a pending recipient and return its ID."""
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            current_date = datetime.datetime.now().isoformat()
+            cursor.execute(
+                """INSERT INTO broadcast_jobs (admin_chat_id, message_text, status, created_date)
+                   VALUES (?, ?, 'running', ?)""",
+                (admin_chat_id, message_text, current_date)
+            )
+            job_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO broadcast_recipients (job_id, user_id) SELECT ?, id FROM users",
+                (job_id,)
+            )
+            cursor.execute("UPDATE broadcast_jobs SET total = ? WHERE id = ?", (cursor.rowcount, job_id))
+            return job_id
+    except sqlite3.Error as e:
+        print(f"Database error while creating broadcast job: {e}")
+        return 0
+
+def set_broadcast_progress_message(job_id: int, message_id: int) -> bool:
+    """Remember the admin message that shows the job's progress."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?", (message_id, job_id))
+            conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error:
+            return False
+
+def get_broadcast_job(job_id: int) -> Optional[Dict[str, Any]]:
+    """Retrieve a broadcast job by its ID."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+        job = cursor.fetchone()
+        return dict(job) if job else None
+
+def get_unfinished_broadcast_jobs() -> List[Dict[str, Any]]:
+    """Get broadcast jobs that were still running (e.g. when the bot stopped)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_pending_broadcast_recipients(job_id: int, after_user_id: int = 0, limit: int = 500) -> List[int]:
+    """Get the next batch of recipients that have not been sent to yet (keyset by user_id)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """SELECT user_id FROM broadcast_recipients
+               WHERE job_id = ? AND status = 'pending' AND user_id > ?
+               ORDER BY user_id LIMIT ?""",
+            (job_id, after_user_id, limit)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+def record_broadcast_results(job_id: int, results: List[Tuple[int, str, Optional[str]]]) -> bool:
+    """Store a batch of (user_id, status, error) delivery results and update the job's counters."""
+    if not results:
+        return True
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                """UPDATE broadcast_recipients SET status = ?, error = ?
+                   WHERE job_id = ? AND user_id = ? AND status = 'pending'""",
+                [(status, error, job_id, user_id) for user_id, status, error in results]
+            )
+            sent = sum(1 for _, status, _ in results if status == 'sent')
+            cursor.execute(
+                "UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ? WHERE id = ?",
+                (sent, len(results) - sent, job_id)
+            )
+            return True
+    except sqlite3.Error as e:
+        print(f"Database error while recording broadcast results: {e}")
+        return False
+
+def finish_broadcast_job(job_id: int) -> bool:
+    """Mark a broadcast job as completed."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            current_date = datetime.datetime.now().isoformat()
+            cursor.execute(
+                "UPDATE broadcast_jobs SET status = 'completed', finished_date = ? WHERE id = ?",
+                (current_date, job_id)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error:
+            return False
+
+# --- Media file_id Cache ---
+
+def get_media_file_ids(paths: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Get cached Telegram file_ids for the given local paths ({path: {fingerprint, file_id}})."""
+    if not paths:
+        return {}
+    with get_db() as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join("?" for _ in paths)
+        cursor.execute(f"SELECT path, fingerprint, file_id FROM media_file_ids WHERE path IN ({placeholders})", tuple(paths))
+        return {row['path']: {'fingerprint': row['fingerprint'], 'file_id': row['file_id']} for row in cursor.fetchall()}
+
+def save_media_file_ids(entries: List[Tuple[str, str, str]]) -> bool:
+    """Store (path, fingerprint, file_id) entries returned by Telegram after an upload."""
+    if not entries:
+        return True
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            current_date = datetime.datetime.now().isoformat()
+            cursor.executemany(
+                """INSERT OR REPLACE INTO media_file_ids (path, fingerprint, file_id, updated_date)
+                   VALUES (?, ?, ?, ?)""",
+                [(path, fingerprint, file_id, current_date) for path, fingerprint, file_id in entries]
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error:
+            return False
+
+# --- Credential Inventory ---
+
+def add_inventory_items(service_type: str, items: List[Tuple[str, bool, Optional[str]]]) -> int:
+    """Add a batch of (content, is_file, file_name) items to the stock of a service type.
+    Items already in stock (same content) are skipped; returns how many were added."""
+    if not items:
+        return 0
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            current_date = datetime.datetime.now().isoformat()
+            before = conn.total_changes
+            cursor.executemany(
+                """INSERT OR IGNORE INTO inventory_items (service_type, content, is_file, file_name, added_date)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [(service_type, content, 1 if is_file else 0, file_name, current_date) for content, is_file, file_name in items]
+            )
+            conn.commit()
+            return conn.total_changes - before
+        except sqlite3.Error as e:
+            print(f"Database error while adding inventory items: {e}")
+            conn.rollback()
+            return 0
+
+def claim_inventory_item(service_type: str, user_id: int, request_id: int) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Atomically take the oldest unclaimed item of a service type for a purchase request.
+    Returns (item, items left in stock), or None if the stock is empty. The count stops at
+    INVENTORY_LOW_STOCK + 1 so the write lock is not held for a scan of a large stock.
+    Claiming again for the same request returns the item it already holds."""
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM inventory_items WHERE request_id = ?", (request_id,))
+            item = cursor.fetchone()
+            if item is None:
+                cursor.execute(
+                    """SELECT * FROM inventory_items WHERE service_type = ? AND claimed_by IS NULL
+                       ORDER BY id LIMIT 1""",
+                    (service_type,)
+                )
+                item = cursor.fetchone()
+                if item is None:
+                    return None
+                current_date = datetime.datetime.now().isoformat()
+                cursor.execute(
+                    "UPDATE inventory_items SET claimed_by = ?, request_id = ?, claimed_date = ? WHERE id = ?",
+                    (user_id, request_id, current_date, item['id'])
+                )
+                item = dict(item, claimed_by=user_id, request_id=request_id, claimed_date=current_date)
+            cursor.execute(
+                """SELECT COUNT(*) FROM (SELECT 1 FROM inventory_items
+                   WHERE service_type = ? AND claimed_by IS NULL LIMIT ?)""",
+                (service_type, config.INVENTORY_LOW_STOCK + 1)
+            )
+            return dict(item), cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Database error while claiming inventory item: {e}")
+        return None
+
+def release_inventory_item(item_id: int) -> bool:
+    """Put a claimed item back in stock (e.g. when it could not be delivered)."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "UPDATE inventory_items SET claimed_by = NULL, request_id = NULL, claimed_date = NULL WHERE id = ?",
+                (item_id,)
+            )
+            conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error:
+            return False
+
+def get_inventory_stock() -> Dict[str, int]:
+    """Get the number of unclaimed items per service type."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT service_type, COUNT(*) FROM inventory_items WHERE claimed_by IS NULL GROUP BY service_type"
+        )
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+# --- Generated Configs ---
+
+def get_generated_config(user_id: int, request_id: int) -> Optional[Dict[str, Any]]:
+    """Get the config already generated for a user's purchase request."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM generated_configs WHERE user_id = ? AND request_id = ?", (user_id, request_id))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def save_generated_config(user_id: int, request_id: int, service_type: str, username: Optional[str],
+                          content: str, file_name: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Store a generated config unless one exists for the request already; returns the stored one."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            current_date = datetime.datetime.now().isoformat()
+            cursor.execute(
+                """INSERT OR IGNORE INTO generated_configs
+                   (user_id, request_id, service_type, username, content, file_name, created_date)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (user_id, request_id, service_type, username, content, file_name, current_date)
+            )
+            cursor.execute("SELECT * FROM generated_configs WHERE user_id = ? AND request_id = ?", (user_id, request_id))
+            row = cursor.fetchone()
+            conn.commit()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            print(f"Database error while saving generated config: {e}")
+            conn.rollback()
+            return None
+
+# --- Conversation Persistence ---
+
+def get_persistence_data(kind: str, key: int) -> Optional[bytes]:
+    """Get the stored (pickled) data of one user, chat or the bot."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT data FROM persistence_data WHERE kind = ? AND key = ?", (kind, key))
+        row = cursor.fetchone()
+        return row['data'] if row else None
+
+def get_persistence_conversations(name: str) -> List[Tuple[str, str]]:
+    """Get all stored (key, state) pairs of a conversation handler."""
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, state FROM persistence_conversations WHERE name = ?", (name,))
+        return [(row['key'], row['state']) for row in cursor.fetchall()]
+
+def save_persistence_batch(data: List[Tuple[str, int, Optional[bytes]]], conversations: List[Tuple[str, str, Optional[str]]]) -> bool:
+    """Write changed persistence entries in one transaction.
+    data holds (kind, key, blob) and conversations (name, key, state); a None blob/state deletes the entry."""
+    if not data and not conversations:
+        return True
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            current_date = datetime.datetime.now().isoformat()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO persistence_data (kind, key, data, updated_date) VALUES (?, ?, ?, ?)",
+                [(kind, key, blob, current_date) for kind, key, blob in data if blob is not None]
+            )
+            cursor.executemany(
+                "DELETE FROM persistence_data WHERE kind = ? AND key = ?",
+                [(kind, key) for kind, key, blob in data if blob is None]
+            )
+            cursor.executemany(
+                "INSERT OR REPLACE INTO persistence_conversations (name, key, state, updated_date) VALUES (?, ?, ?, ?)",
+                [(name, key, state, current_date) for name, key, state in conversations if state is not None]
+            )
+            cursor.executemany(
+                "DELETE FROM persistence_conversations WHERE name = ? AND key = ?",
+                [(name, key) for name, key, state in conversations if state is None]
+            )
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Database error while saving persistence batch: {e}")
+            conn.rollback()
+            return False
 
 # --- Bot Statistics ---
 
+STATISTICS_COUNTERS = (
+    'total_users', 'approved_users', 'pending_users',
+    'total_credit', 'total_discount_codes', 'total_support_messages'
+)
+
+def _compute_counters(cursor: sqlite3.Cursor) -> Dict[str, int]:
+    """Recompute every statistics counter from the source tables (full scans)."""
+    cursor.execute("""
+        SELECT COUNT(*),
+               IFNULL(SUM(is_approved = 1), 0),
+               IFNULL(SUM(is_approved = 0), 0),
+               IFNULL(SUM(credit), 0)
+        FROM users
+    """)
+    total_users, approved_users, pending_users, total_credit = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM discount_codes")
+    total_discount_codes = cursor.fetchone()[0]
+    cursor.execute("SELECT COUNT(*) FROM support_messages")
+    total_support_messages = cursor.fetchone()[0]
+    return {
+        'total_users': total_users,
+        'approved_users': approved_users,
+        'pending_users': pending_users,
+        'total_credit': total_credit,
+        'total_discount_codes': total_discount_codes,
+        'total_support_messages': total_support_messages
+    }
+
+def _write_counters(cursor: sqlite3.Cursor, counters: Dict[str, int]) -> None:
+    """Overwrite the materialized counters row."""
+    cursor.execute(
+        f"UPDATE bot_counters SET {', '.join(f'{name} = ?' for name in STATISTICS_COUNTERS)} WHERE id = 1",
+        tuple(counters[name] for name in STATISTICS_COUNTERS)
+    )
+
 def get_bot_statistics() -> Dict[str, Any]:
-    """Get bot statistics"""
+    """Get bot statistics from the materialized counters row."""
     try:
         with get_db() as conn:
             cursor = conn.cursor()
-            
-            # Total users
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            # Approved users
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_approved = 1")
-            approved_users = cursor.fetchone()[0]
-            
-            # Pending users
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_approved = 0")
-            pending_users = cursor.fetchone()[0]
-            
-            # Total credit (sum of all users' credits)
-            cursor.execute("SELECT SUM(credit) FROM users")
-            total_credit = cursor.fetchone()[0] or 0 # Use 0 if SUM is NULL (no users)
-            
-            # Total discount codes
-            cursor.execute("SELECT COUNT(*) FROM discount_codes")
-            total_discount_codes = cursor.fetchone()[0]
-            
-            # Total support messages
-            cursor.execute("SELECT COUNT(*) FROM support_messages")
-            total_support_messages = cursor.fetchone()[0]
-            
-            return {
-                'total_users': total_users,
-                'approved_users': approved_users,
-                'pending_users': pending_users,
-                'total_credit': total_credit,
-                'total_discount_codes': total_discount_codes,
-                'total_support_messages': total_support_messages
-            }
+            cursor.execute(f"SELECT {', '.join(STATISTICS_COUNTERS)} FROM bot_counters WHERE id = 1")
+            row = cursor.fetchone()
+            return dict(row) if row else {}
     except sqlite3.Error:
         return {}
+
+def reconcile_statistics(fix: bool = True) -> Dict[str, Tuple[int, int]]:
+    """Recompute the statistics counters from scratch and compare them with the stored ones.
+    Returns {counter: (stored, actual)} for every counter that drifted; with fix=True the
+    stored counters are corrected in the same transaction."""
+    try:
+        with get_db_immediate() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(STATISTICS_COUNTERS)} FROM bot_counters WHERE id = 1")
+            row = cursor.fetchone()
+            stored = dict(row) if row else {name: 0 for name in STATISTICS_COUNTERS}
+            actual = _compute_counters(cursor)
+            drift = {
+                name: (stored[name], actual[name])
+                for name in STATISTICS_COUNTERS if stored[name] != actual[name]
+            }
+            if fix and drift:
+                if row is None:
+                    cursor.execute("INSERT INTO bot_counters (id) VALUES (1)")
+                _write_counters(cursor, actual)
+            return drift
+    except sqlite3.Error as e:
+        print(f"Database error during statistics reconciliation: {e}")
+        return {}
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inventory module for VPN Telegram Bot
+Pre-provisioned credentials per service type: streaming bulk import, delivery of
+one item per approved purchase request, low-stock alerts and stock/claim metrics.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from telegram import Bot
+
+import async_db
+import broadcast
+import config
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+InventoryItem = Tuple[str, bool, Optional[str]] # (content, is_file, file_name)
+
+# --- Import ---
+
+def iter_items(path: str) -> Iterator[InventoryItem]:
+    """Read items from an uploaded file without loading it whole.
+    A zip archive gives one config file per member; any other file one credential per line
+    (blank lines and lines starting with # are skipped)."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                with archive.open(info) as member:
+                    content = member.read().decode("utf-8", errors="replace")
+                if content.strip():
+                    yield content, True, os.path.basename(info.filename)
+        return
+    with open(path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line, False, None
+
+def import_file(path: str, service_type: str) -> Tuple[int, int]:
+    """Add every item of a file to the stock of service_type in batches of INVENTORY_IMPORT_BATCH.
+    Runs on a database thread (async_db.run). Returns (items added, items read); duplicates are skipped."""
+    added = read = 0
+    batch: List[InventoryItem] = []
+    for item in iter_items(path):
+        batch.append(item)
+        if len(batch) >= config.INVENTORY_IMPORT_BATCH:
+            added += database.add_inventory_items(service_type, batch)
+            read += len(batch)
+            batch = []
+    added += database.add_inventory_items(service_type, batch)
+    read += len(batch)
+    return added, read
+
+async def refresh_stock_metrics() -> dict:
+    """Reload the stock counts into bot_inventory_stock; returns {service_type: count}."""
+    stock = await async_db.get_inventory_stock()
+    for service_type in config.SERVICE_TYPES.values():
+        metrics.INVENTORY_STOCK.set(stock.get(service_type, 0), service=service_type)
+    return stock
+
+# --- Delivery ---
+
+async def _send_item(bot: Bot, user_id: int, service_type: str, item: dict) -> None:
+    if item['is_file']:
+        await bot.send_document(
+            chat_id=user_id,
+            document=item['content'].encode("utf-8"),
+            filename=item['file_name'] or f"{service_type}_config.ovpn",
+            caption=f"سرویس {service_type} شما:"
+        )
+    else:
+        await bot.send_message(chat_id=user_id, text=f"سرویس {service_type} شما:\n\n{item['content']}")
+
+async def _alert_low_stock(bot: Bot, service_type: str, remaining: int) -> None:
+    # Each claim sees a distinct remaining count, so every threshold alerts exactly once
+    if remaining == 0:
+        text = f"🚨 موجودی انبار سرویس {service_type} تمام شد. درخواست‌های بعدی نیاز به ارسال دستی دارند."
+    elif remaining == config.INVENTORY_LOW_STOCK:
+        text = f"⚠️ موجودی انبار سرویس {service_type} کم است: {remaining} مورد باقی مانده."
+    else:
+        return
+    try:
+        await bot.send_message(chat_id=config.ADMIN_ID, text=text)
+    except Exception as e:
+        logger.error(f"Failed to send low stock alert for {service_type}: {e}")
+
+async def deliver(bot: Bot, request_id: int, user_id: int, service_type: str) -> str:
+    """Claim a stock item for an approved request and send it to the user.
+    Returns 'delivered', 'out_of_stock' or 'failed' (the item is put back in stock)."""
+    started = time.perf_counter()
+    claimed = await async_db.claim_inventory_item(service_type, user_id, request_id)
+    if claimed is None:
+        metrics.INVENTORY_CLAIMS.inc(service=service_type, outcome='out_of_stock')
+        return 'out_of_stock'
+    item, remaining = claimed # Counted only up to INVENTORY_LOW_STOCK + 1
+    metrics.INVENTORY_STOCK.dec(service=service_type)
+
+    ok, error = await broadcast.get_sender().send(user_id, lambda: _send_item(bot, user_id, service_type, item))
+    if not ok:
+        logger.error(f"Failed to deliver inventory item {item['id']} to user {user_id}: {error}")
+        await async_db.release_inventory_item(item['id'])
+        metrics.INVENTORY_STOCK.inc(service=service_type)
+        metrics.INVENTORY_CLAIMS.inc(service=service_type, outcome='failed')
+        return 'failed'
+
+    metrics.INVENTORY_CLAIMS.inc(service=service_type, outcome='delivered')
+    metrics.INVENTORY_DELIVERY_SECONDS.observe(time.perf_counter() - started, service=service_type)
+    await _alert_low_stock(bot, service_type, remaining)
+    return 'delivered'
+
+async def deliver_and_report(bot: Bot, requests: List[Tuple[int, int, str]], admin_chat_id: int,
+                             report_message_id: int, header: str, fallback_text: str) -> None:
+    """Deliver stock items for approved (request_id, user_id, service_type) requests, notify the
+    users who got nothing with fallback_text (formatted with the request ID) and report to the admin."""
+    outcomes = await asyncio.gather(*(deliver(bot, *request) for request in requests))
+    delivered = sum(1 for outcome in outcomes if outcome == 'delivered')
+    notifications = [
+        (user_id, fallback_text.format(request_id))
+        for (request_id, user_id, _), outcome in zip(requests, outcomes) if outcome != 'delivered'
+    ]
+    header += f"\n📦 سرویس ارسال شده از انبار: {delivered}"
+    if notifications:
+        header += f"\n⏳ نیازمند ارسال دستی: {len(notifications)}"
+    await broadcast.notify_and_report(bot, notifications, admin_chat_id, report_message_id, header)
@@ -1,14 +1,152 @@
-from flask import Flask
-from threading import Thread
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keep-alive / webhook HTTP server for VPN Telegram Bot
+A small asyncio HTTP/1.1 server that runs on the bot's own event loop. It answers
+health pings and, in webhook mode, hands Telegram updates to the Application.
+"""
 
-app = Flask("")
+import asyncio
+import hmac
+import json
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 
-@app.route('/')
-def home():
-    return "VPN Bot is running."
+import metrics
 
-def run():
-    app.run(host="0.0.0.0", port=8080)
+logger = logging.getLogger(__name__)
 
-def keep_alive():
-    Thread(target=run).start()
+# Largest request body accepted (Telegram updates are a few KB)
+MAX_BODY_SIZE = 1024 * 1024
+# Seconds a client gets to send its whole request before the connection is dropped
+READ_TIMEOUT = 10
+
+STATUS_TEXT = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    408: "Request Timeout", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error"
+}
+
+class Request:
+    """A parsed HTTP request."""
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+# A route handler returns (status, content type, body)
+Response = Tuple[int, str, bytes]
+Handler = Callable[[Request], Awaitable[Response]]
+
+class WebServer:
+    """Minimal HTTP server with exact-path routing."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        """Register a handler for METHOD path."""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, content_type, body = await self._handle_request(reader)
+        except asyncio.TimeoutError:
+            status, content_type, body = 408, "text/plain", b"Request Timeout"
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            status, content_type, body = 400, "text/plain", b"Bad Request"
+        except Exception:
+            logger.exception("Unhandled error while serving an HTTP request")
+            status, content_type, body = 500, "text/plain", b"Internal Server Error"
+        try:
+            writer.write(
+                f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], Optional[bytes]]:
+        """Read the request line, headers and body; the body is None if it is too large."""
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        method, target, _ = request_line.split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", "0") or 0)
+        if length > MAX_BODY_SIZE:
+            return method, target, headers, None
+        body = await reader.readexactly(length) if length else b""
+        return method, target, headers, body
+
+    async def _handle_request(self, reader: asyncio.StreamReader) -> Response:
+        # The deadline covers the whole request, so idle or trickling clients cannot hold a connection
+        method, target, headers, body = await asyncio.wait_for(self._read_request(reader), READ_TIMEOUT)
+        if body is None:
+            return 413, "text/plain", b"Payload Too Large"
+
+        path = target.split("?", 1)[0]
+        handler = self._routes.get((method.upper(), path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self._routes):
+                return 405, "text/plain", b"Method Not Allowed"
+            return 404, "text/plain", b"Not Found"
+        return await handler(Request(method.upper(), path, headers, body))
+
+async def home(request: Request) -> Response:
+    """Health route answered to uptime pings."""
+    return 200, "text/plain; charset=utf-8", b"VPN Bot is running."
+
+async def metrics_route(request: Request) -> Response:
+    """Prometheus scrape endpoint."""
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.render().encode("utf-8")
+
+def add_webhook_route(server: WebServer, application, path: str, secret_token: str) -> None:
+    """Accept Telegram updates on POST path and queue them for the Application."""
+    from telegram import Update
+
+    async def webhook(request: Request) -> Response:
+        received = request.headers.get("x-telegram-bot-api-secret-token", "")
+        # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+        if not hmac.compare_digest(received.encode("utf-8"), secret_token.encode("utf-8")):
+            return 403, "text/plain", b"Forbidden"
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400, "text/plain", b"Bad Request"
+        # Return immediately; the Application processes the update from its queue
+        await application.update_queue.put(update)
+        return 200, "text/plain", b"OK"
+
+    server.route("POST", path, webhook)
+
+def create_server(host: str, port: int) -> WebServer:
+    """Build the server with the health and metrics routes."""
+    server = WebServer(host, port)
+    server.route("GET", "/", home)
+    server.route("GET", "/metrics", metrics_route)
+    return server
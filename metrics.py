@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Metrics module for VPN Telegram Bot
+In-process counters, gauges and histograms rendered in the Prometheus text format.
+No external collector is needed; the /metrics route of keep_alive serves render().
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["Metric"] = []
+_registry_lock = threading.Lock()
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    """Base class: a named metric with optional labels, registered on creation."""
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    """Distribution of observed values (e.g. latencies) over fixed buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self, **labels) -> Optional[Dict[str, object]]:
+        """Return cumulative bucket counts, sum and count for one label set."""
+        with self._lock:
+            data = self._values.get(self._key(labels))
+            data = list(data) if data else None
+        if data is None:
+            return None
+        cumulative, running = [], 0
+        for bound, count in zip(self.buckets, data):
+            running += count
+            cumulative.append((bound, running))
+        return {'buckets': cumulative, 'sum': data[-2], 'count': data[-1]}
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        lines = []
+        for key, data in items:
+            running = 0
+            for bound, count in zip(self.buckets, data):
+                running += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(data[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+class FunctionMetric(Metric):
+    """Counter or gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, metric_type: str, func: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.type = metric_type
+        self.func = func
+
+    def samples(self) -> List[str]:
+        try:
+            return [f"{self.name} {_format_value(self.func())}"]
+        except Exception:
+            return []
+
+def percentile(histogram: Histogram, pct: float, **labels) -> Optional[float]:
+    """Estimate a percentile (upper bucket bound) from a histogram's buckets."""
+    snapshot = histogram.snapshot(**labels)
+    if not snapshot or not snapshot['count']:
+        return None
+    target = snapshot['count'] * pct / 100.0
+    for bound, cumulative in snapshot['buckets']:
+        if cumulative >= target:
+            return bound
+    return None
+
+def render() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+# --- Bot-wide metrics ---
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in update handlers", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handlers that raised", ["handler"])
+
+UPDATES_QUEUED = Gauge("bot_updates_queued", "Updates waiting for their chat's previous update or a free processing slot")
+UPDATES_IN_PROGRESS = Gauge("bot_updates_in_progress", "Updates currently being processed")
+UPDATE_WAIT_SECONDS = Histogram("bot_update_wait_seconds", "Time an update waited before processing started")
+THROTTLED_UPDATES = Counter("bot_throttled_updates_total", "Incoming updates dropped by flood control", ["scope"])
+
+DB_SECONDS = Histogram("bot_db_call_seconds", "Execution time of database.py functions", ["function"])
+DB_QUEUE_SECONDS = Histogram("bot_db_queue_seconds", "Time database calls waited for a free database thread", ["function"])
+DB_LOCK_WAIT_SECONDS = Histogram("bot_db_lock_wait_seconds", "Time spent acquiring the SQLite write lock (BEGIN IMMEDIATE)")
+DB_ERRORS = Counter("bot_db_errors_total", "database.py functions that raised", ["function"])
+
+API_SECONDS = Histogram("bot_api_request_seconds", "Latency of outgoing Bot API requests", ["method"])
+API_ERRORS = Counter("bot_api_errors_total", "Bot API requests that failed or returned an error status", ["method"])
+API_RETRY_AFTER = Counter("bot_api_retry_after_total", "Bot API requests rejected with 429 (RetryAfter)", ["method"])
+
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Broadcast deliveries by outcome", ["status"])
+INVENTORY_STOCK = Gauge("bot_inventory_stock", "Unclaimed credentials in the inventory", ["service"])
+INVENTORY_CLAIMS = Counter("bot_inventory_claims_total", "Inventory claims on approval by outcome (delivered, out_of_stock, failed)", ["service", "outcome"])
+INVENTORY_DELIVERY_SECONDS = Histogram("bot_inventory_delivery_seconds", "Time from approval to the credential reaching the user", ["service"])
+CONFIG_GENERATION_SECONDS = Histogram("bot_config_generation_seconds", "Time to render a per-user config from its template", ["service"])
+CONFIG_CACHE = Counter("bot_config_cache_total", "Generated config lookups by result (hit, miss)", ["result"])
+SUBSCRIPTION_EVENTS = Counter("bot_subscription_events_total", "Subscription renewal reminders and expirations handled by the scheduler", ["event"])
+NOTIFICATIONS = Counter("bot_notifications_total", "Bulk notification deliveries (e.g. bulk request approval) by outcome", ["status"])
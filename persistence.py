@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistence module for VPN Telegram Bot
+SQLite-backed BasePersistence: conversation states, user_data, chat_data and bot_data
+survive restarts. Only changed keys are written, and user/chat data is loaded on first use.
+"""
+
+import asyncio
+import json
+import pickle
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import async_db
+
+# Conversation keys are tuples of chat/user IDs
+ConversationKey = Tuple[int, ...]
+
+class SQLitePersistence(BasePersistence[Dict[Any, Any], Dict[Any, Any], Dict[Any, Any]]):
+    """Stores bot state in the persistence_* tables of the bot database.
+
+    The Application hands over changed entries every `update_interval` seconds; they are
+    buffered per key and written together in one transaction.
+    """
+
+    def __init__(self, update_interval: float = 60):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self._loaded_users: Set[int] = set()
+        self._loaded_chats: Set[int] = set()
+        # Pending writes; a None value deletes the stored entry
+        self._pending_data: Dict[Tuple[str, int], Optional[bytes]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    # --- Loading ---
+
+    async def _load(self, kind: str, key: int) -> Dict[Any, Any]:
+        blob = await async_db.get_persistence_data(kind, key)
+        return pickle.loads(blob) if blob else {}
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Loaded per user in refresh_user_data instead of reading every row at startup
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return await self._load('bot', 0)
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[ConversationKey, object]:
+        rows = await async_db.get_persistence_conversations(name)
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id not in self._loaded_users:
+            self._loaded_users.add(user_id)
+            for name, value in (await self._load('user', user_id)).items():
+                user_data.setdefault(name, value)
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        if chat_id not in self._loaded_chats:
+            self._loaded_chats.add(chat_id)
+            for name, value in (await self._load('chat', chat_id)).items():
+                chat_data.setdefault(name, value)
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass # Only this process writes bot_data, so the in-memory copy is current
+
+    # --- Saving ---
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        self._loaded_users.add(user_id)
+        self._pending_data[('user', user_id)] = pickle.dumps(data) if data else None
+        await self._write_pending()
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        self._loaded_chats.add(chat_id)
+        self._pending_data[('chat', chat_id)] = pickle.dumps(data) if data else None
+        await self._write_pending()
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._pending_data[('bot', 0)] = pickle.dumps(data)
+        await self._write_pending()
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: ConversationKey, new_state: Optional[object]) -> None:
+        state = json.dumps(new_state) if new_state is not None else None
+        self._pending_conversations[(name, json.dumps(list(key)))] = state
+        await self._write_pending()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_data[('user', user_id)] = None
+        await self._write_pending()
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._pending_data[('chat', chat_id)] = None
+        await self._write_pending()
+
+    async def flush(self) -> None:
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        """Write everything buffered so far in a single transaction."""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            # The Application runs all update_* calls of one interval concurrently;
+            # yield once so they are all buffered before the batch is taken
+            await asyncio.sleep(0)
+            if not self._pending_data and not self._pending_conversations:
+                return
+            data, self._pending_data = self._pending_data, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            saved = await async_db.save_persistence_batch(
+                [(kind, key, blob) for (kind, key), blob in data.items()],
+                [(name, key, state) for (name, key), state in conversations.items()]
+            )
+            if not saved:
+                # Retry on the next write unless a newer value has been buffered meanwhile
+                for entry_key, blob in data.items():
+                    self._pending_data.setdefault(entry_key, blob)
+                for entry_key, state in conversations.items():
+                    self._pending_conversations.setdefault(entry_key, state)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rate limiting module for VPN Telegram Bot
+In-memory token buckets used to stay under Telegram's flood limits and to
+throttle users who flood the bot.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity` tokens."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take tokens if available right now; never waits."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` would be available (0 if available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self._paused_until - now)
+        if self._tokens < tokens and self.rate > 0:
+            wait = max(wait, (tokens - self._tokens) / self.rate)
+        return wait
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        """Wait until tokens are available, then take them."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(max(self.delay(tokens), 0.001))
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds` (e.g. after a RetryAfter from Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+class KeyedTokenBucket:
+    """One TokenBucket per key (e.g. per chat), keeping only the most recently used keys."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def bucket(self, key: Hashable) -> TokenBucket:
+        """Return the bucket for key, creating it if needed."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key: Hashable, tokens: float = 1.0) -> bool:
+        """Take tokens from key's bucket if available right now."""
+        return self.bucket(key).try_acquire(tokens)
+
+    async def acquire(self, key: Hashable, tokens: float = 1.0) -> None:
+        """Wait for tokens in key's bucket."""
+        await self.bucket(key).acquire(tokens)
+
+class FloodControl:
+    """Admission check for incoming updates: a per-user and a global token bucket
+    (a rate of 0 disables that bucket), plus a per-user bucket limiting "slow down" notices."""
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float,
+                 notice_interval: float, exempt: Iterable[int] = ()):
+        self.users = KeyedTokenBucket(user_rate, user_burst) if user_rate > 0 else None
+        self.global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self.notices = KeyedTokenBucket(1.0 / notice_interval, 1.0) if notice_interval > 0 else None
+        self.exempt = set(exempt)
+
+    def check(self, user_id: Optional[int]) -> Optional[str]:
+        """Return None if the update may be handled, else the bucket that ran out ('user' or 'global').
+        The user's own bucket is checked first so one flooding user cannot drain the global one."""
+        if user_id in self.exempt:
+            return None
+        if self.users is not None and user_id is not None and not self.users.try_acquire(user_id):
+            return 'user'
+        if self.global_bucket is not None and not self.global_bucket.try_acquire():
+            return 'global'
+        return None
+
+    def should_notify(self, user_id: int) -> bool:
+        """True at most once per notice interval per user."""
+        return self.notices is not None and self.notices.try_acquire(user_id)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Subscriptions module for VPN Telegram Bot
+Expiry scheduler: a single JobQueue job that wakes at the earliest pending renewal reminder
+or expiry (read from the notify_at index), handles what is due in batches, notifies the users
+through the rate-limited sender and schedules itself for the next due time.
+"""
+
+import datetime
+import logging
+from typing import Optional
+
+from telegram.ext import ContextTypes, JobQueue
+
+import async_db
+import broadcast
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "subscription_expiry"
+
+def _reminder_text(subscription: dict) -> str:
+    expires_date = subscription['expires_at'].split('T')[0]
+    return (
+        f"⏰ اشتراک شما ({subscription['account_type']}) در تاریخ {expires_date} به پایان می‌رسد.\n"
+        "برای تمدید از دکمه «🛍 خرید اکانت» استفاده کنید."
+    )
+
+def _expired_text(subscription: dict) -> str:
+    return (
+        f"⌛️ اشتراک شما ({subscription['account_type']}) به پایان رسید.\n"
+        "برای تمدید از دکمه «🛍 خرید اکانت» استفاده کنید."
+    )
+
+async def schedule(job_queue: Optional[JobQueue]) -> None:
+    """Make sure the scheduler job runs at the earliest due reminder/expiry.
+    Called at startup and after approvals; an already scheduled earlier run is kept."""
+    if job_queue is None:
+        logger.warning("JobQueue is not available (install python-telegram-bot[job-queue]); subscriptions will not expire")
+        return
+    due = await async_db.get_next_subscription_due()
+    if due is None:
+        return
+    due_at = datetime.datetime.fromisoformat(due).astimezone() # Stored in local time
+    jobs = job_queue.get_jobs_by_name(JOB_NAME)
+    if jobs and jobs[0].next_t is not None and jobs[0].next_t <= due_at:
+        return
+    for job in jobs:
+        job.schedule_removal()
+    delay = max(0.0, (due_at - datetime.datetime.now().astimezone()).total_seconds())
+    job_queue.run_once(check_due_subscriptions, when=delay, name=JOB_NAME)
+    logger.debug(f"Subscription scheduler will wake in {delay:.0f}s")
+
+def _schedule_retry(job_queue: JobQueue) -> None:
+    """Run again after SUBSCRIPTION_RETRY_DELAY: a failed run must not re-arm itself right away,
+    or a persistent error (e.g. a locked database) would keep the job spinning."""
+    job_queue.run_once(check_due_subscriptions, when=config.SUBSCRIPTION_RETRY_DELAY, name=JOB_NAME)
+    logger.warning(f"Subscription scheduler will retry in {config.SUBSCRIPTION_RETRY_DELAY:.0f}s")
+
+async def check_due_subscriptions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the due renewal reminders, expire the due subscriptions and schedule the next run.
+    Reminders are marked sent before delivery, so a failed delivery is not retried."""
+    try:
+        processed = await async_db.process_due_subscriptions(config.SUBSCRIPTION_BATCH_SIZE)
+        if processed is not None:
+            reminders, expired = processed
+            metrics.SUBSCRIPTION_EVENTS.inc(len(reminders), event='reminded')
+            metrics.SUBSCRIPTION_EVENTS.inc(len(expired), event='expired')
+            notifications = [(s['user_id'], _reminder_text(s)) for s in reminders]
+            notifications += [(s['user_id'], _expired_text(s)) for s in expired]
+            if notifications:
+                sent, failed = await broadcast.notify_users(context.bot, notifications)
+                logger.info(
+                    f"Subscriptions: {len(reminders)} reminded, {len(expired)} expired "
+                    f"({sent} notified, {len(failed)} failed)"
+                )
+            # A full batch means more may be due already; schedule() then runs again right away
+            await schedule(context.job_queue)
+            return
+    except Exception as e:
+        logger.error(f"Subscription scheduler run failed: {e}")
+    _schedule_retry(context.job_queue)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Telemetry module for VPN Telegram Bot
+Hooks python-telegram-bot into metrics.py: handler latency/errors and Bot API request latency/errors.
+"""
+
+import functools
+import time
+from typing import Any, Callable, Tuple
+
+from telegram.ext import Application, ApplicationHandlerStop, BaseHandler, ConversationHandler
+from telegram.request import HTTPXRequest
+
+import metrics
+from callback_router import CallbackRouter
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records latency, failures and 429s per Bot API method."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics.API_ERRORS.inc(method=api_method)
+            raise
+        finally:
+            metrics.API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        if code == 429:
+            metrics.API_RETRY_AFTER.inc(method=api_method)
+        elif code >= 400:
+            metrics.API_ERRORS.inc(method=api_method)
+        return code, payload
+
+def instrument_callback(callback: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a handler callback to record its latency and errors."""
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context, *args)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    wrapper.instrumented = True
+    return wrapper
+
+def _instrument_handler(handler: BaseHandler) -> None:
+    if isinstance(handler, ConversationHandler):
+        for child in handler.entry_points + handler.fallbacks:
+            _instrument_handler(child)
+        for state_handlers in handler.states.values():
+            for child in state_handlers:
+                _instrument_handler(child)
+    elif isinstance(getattr(handler.callback, "__self__", None), CallbackRouter):
+        # Time each routed callback rather than the shared dispatcher
+        router = handler.callback.__self__
+        for action, (callback, arg_types) in router.routes.items():
+            if not getattr(callback, "instrumented", False):
+                router.routes[action] = (instrument_callback(callback), arg_types)
+    elif not getattr(handler.callback, "instrumented", False):
+        handler.callback = instrument_callback(handler.callback)
+
+def instrument_application(application: Application) -> None:
+    """Instrument every handler registered on the application (including conversation states)."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
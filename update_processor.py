@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Update processor module for VPN Telegram Bot
+Processes updates of different chats concurrently while keeping the updates of
+one chat strictly in arrival order (conversation states and credit changes depend on it).
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+def ordering_key(update: object) -> Optional[Hashable]:
+    """Updates with the same key are processed one at a time (None: no ordering needed)."""
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+    return None
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Runs up to max_concurrent_updates updates at once, serialized per chat.
+
+    An update first waits for the previous update of its chat, and only then for
+    a free processing slot, so a busy chat never holds slots other chats could use.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks: Dict[Hashable, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Hashable, int] = {}
+        self._queued_at: Dict[int, float] = {} # id(update) -> arrival time
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        self._queued_at[id(update)] = time.perf_counter()
+        metrics.UPDATES_QUEUED.inc()
+        try:
+            key = ordering_key(update)
+            if key is None:
+                # The base class limits concurrency to max_concurrent_updates
+                await super().process_update(update, coroutine)
+            else:
+                await self._process_in_order(key, update, coroutine)
+        finally:
+            # Still present only if cancelled before processing started
+            if self._queued_at.pop(id(update), None) is not None:
+                metrics.UPDATES_QUEUED.dec()
+
+    async def _process_in_order(self, key: Hashable, update: object, coroutine: Awaitable) -> None:
+        lock = self._chat_locks.get(key)
+        if lock is None:
+            lock = self._chat_locks[key] = asyncio.Lock()
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # Forget the lock once no update of this chat is queued or running
+            self._chat_waiters[key] -= 1
+            if not self._chat_waiters[key]:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        queued_at = self._queued_at.pop(id(update), None)
+        if queued_at is not None:
+            metrics.UPDATE_WAIT_SECONDS.observe(time.perf_counter() - queued_at)
+        metrics.UPDATES_QUEUED.dec()
+        metrics.UPDATES_IN_PROGRESS.inc()
+        try:
+            await coroutine
+        finally:
+            metrics.UPDATES_IN_PROGRESS.dec()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass